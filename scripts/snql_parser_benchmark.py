@@ -0,0 +1,82 @@
+"""\
+Compares the parse latency of the SnQL grammar (parsimonious) with the
+recursive descent parser.
+
+Usage: SNUBA_SETTINGS=test python scripts/snql_parser_benchmark.py [iterations]
+
+Both parsers only build the initial AST of the queries: the post processing
+phases, which are shared, are not measured.
+"""
+
+import sys
+import time
+from typing import Callable, Sequence, Tuple
+
+from snuba.query.snql.parser import SnQLVisitor, snql_grammar
+from snuba.query.snql.recursive_descent import parse_snql_query_recursive_descent
+
+iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+
+QUERIES: Sequence[Tuple[str, str]] = [
+    ("simple", "MATCH (events) SELECT count() AS count WHERE project_id = 1"),
+    (
+        "subscription",
+        "MATCH (events) SELECT count() AS count "
+        "WHERE project_id IN tuple(1, 2, 3) AND "
+        "timestamp >= toDateTime('2021-01-01T00:00:00') AND "
+        "timestamp < toDateTime('2021-01-01T00:01:00') AND "
+        "(tags[environment] = 'production' OR tags[environment] = 'staging')",
+    ),
+    (
+        "dashboard",
+        "MATCH (events) SELECT count() AS count, uniq(user) AS users, "
+        "quantile(0.95)(duration) AS p95, toStartOfHour(timestamp) AS time "
+        "BY time, tags[release] "
+        "WHERE project_id = 1 AND timestamp >= toDateTime('2021-01-01T00:00:00') "
+        "ORDER BY time ASC LIMIT 1000 OFFSET 0 GRANULARITY 3600",
+    ),
+    (
+        "in list (1000)",
+        "MATCH (events) SELECT count() AS count WHERE group_id IN tuple(%s)"
+        % ", ".join(str(i) for i in range(1000)),
+    ),
+    (
+        "selected columns (200)",
+        "MATCH (events) SELECT %s"
+        % ", ".join(f"sum(c{i}) AS s{i}" for i in range(200)),
+    ),
+    (
+        "nested conditions",
+        "MATCH (events) SELECT count() AS count WHERE %s"
+        % " AND ".join(
+            f"(a{i} = {i} OR (b{i} = 'x' AND c{i} > {i}))" for i in range(50)
+        ),
+    ),
+]
+
+
+def parsimonious(body: str) -> None:
+    SnQLVisitor().visit(snql_grammar.parse(body))
+
+
+def measure(parse: Callable[[str], None], body: str) -> float:
+    """
+    Returns the mean parse latency, in milliseconds.
+    """
+    parse(body)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        parse(body)
+    return (time.perf_counter() - start) * 1000 / iterations
+
+
+print(
+    f"{'query':<24}{'parsimonious (ms)':>20}{'recursive descent (ms)':>25}{'speedup':>10}"
+)
+for name, body in QUERIES:
+    reference = measure(parsimonious, body)
+    recursive_descent = measure(parse_snql_query_recursive_descent, body)
+    print(
+        f"{name:<24}{reference:>20.3f}{recursive_descent:>25.3f}"
+        f"{reference / recursive_descent:>9.1f}x"
+    )
@@ -48,6 +48,28 @@ from snuba.stateful_consumer.consumer_state_machine import ConsumerStateMachine
     type=int,
     help="Max length of time to buffer messages in memory before writing to Kafka.",
 )
+@click.option(
+    "--max-pending-batches",
+    default=0,
+    type=int,
+    help="Max number of batches that can be written to ClickHouse in the background while the next batch is collected. Offsets are committed once a batch is written. When 0, batches are written synchronously.",
+)
+@click.option(
+    "--target-insert-latency-ms",
+    type=int,
+    help="Adjust the batch size automatically, between --min-batch-size and --max-batch-size, aiming for inserts that take this long. When neither this nor --target-insert-rows is set, the batch size is fixed.",
+)
+@click.option(
+    "--target-insert-rows",
+    type=int,
+    help="Adjust the batch size automatically, between --min-batch-size and --max-batch-size, aiming for inserts of at most this many rows. Can be combined with --target-insert-latency-ms.",
+)
+@click.option(
+    "--min-batch-size",
+    default=settings.DEFAULT_MIN_BATCH_SIZE,
+    type=int,
+    help="Min number of messages per batch when the batch size is adjusted automatically.",
+)
 @click.option(
     "--auto-offset-reset",
     default="error",
@@ -66,6 +88,11 @@ from snuba.stateful_consumer.consumer_state_machine import ConsumerStateMachine
     type=int,
     help="Minimum number of messages per topic+partition librdkafka tries to maintain in the local consumer queue.",
 )
+@click.option(
+    "--stats-port",
+    type=int,
+    help="Port to serve a JSON summary of the consumer metrics on (on localhost only.) Disabled when not set.",
+)
 @click.option("--log-level", help="Logging level to use.")
 @click.option(
     "--stateful-consumer",
@@ -96,6 +123,10 @@ def consumer(
     storage_name: str,
     max_batch_size: int,
     max_batch_time_ms: int,
+    max_pending_batches: int,
+    target_insert_latency_ms: Optional[int],
+    target_insert_rows: Optional[int],
+    min_batch_size: int,
     auto_offset_reset: str,
     queued_max_messages_kbytes: int,
     queued_min_messages: int,
@@ -103,6 +134,7 @@ def consumer(
     processes: Optional[int],
     input_block_size: Optional[int],
     output_block_size: Optional[int],
+    stats_port: Optional[int] = None,
     log_level: Optional[str] = None,
     profile_path: Optional[str] = None,
 ) -> None:
@@ -128,6 +160,11 @@ def consumer(
         input_block_size=input_block_size,
         output_block_size=output_block_size,
         profile_path=profile_path,
+        max_pending_batches=max_pending_batches,
+        target_insert_latency_ms=target_insert_latency_ms,
+        target_insert_rows=target_insert_rows,
+        min_batch_size=min_batch_size,
+        stats_port=stats_port,
     )
 
     if stateful_consumer:
@@ -59,6 +59,11 @@ from snuba.utils.metrics.wrapper import MetricsWrapper
     type=int,
     help="Minimum number of messages per topic+partition librdkafka tries to maintain in the local consumer queue.",
 )
+@click.option(
+    "--per-node-concurrency",
+    type=int,
+    help="Run replacements against the local tables of every shard concurrently, running at most this many queries on each node at a time.",
+)
 @click.option("--log-level", help="Logging level to use.")
 def replacer(
     *,
@@ -71,6 +76,7 @@ def replacer(
     auto_offset_reset: str,
     queued_max_messages_kbytes: int,
     queued_min_messages: int,
+    per_node_concurrency: Optional[int] = None,
     log_level: Optional[str] = None,
 ) -> None:
 
@@ -115,7 +121,9 @@ def replacer(
         ),
         Topic(replacements_topic),
         BatchProcessingStrategyFactory(
-            worker=ReplacerWorker(storage, metrics=metrics),
+            worker=ReplacerWorker(
+                storage, metrics=metrics, per_node_concurrency=per_node_concurrency
+            ),
             max_batch_size=max_batch_size,
             max_batch_time=max_batch_time_ms,
             metrics=metrics,
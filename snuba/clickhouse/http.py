@@ -2,12 +2,25 @@ from __future__ import annotations
 
 import logging
 import re
+import zlib
+from abc import ABC, abstractmethod
 from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from enum import Enum
 from queue import SimpleQueue
-from typing import Any, Iterable, Iterator, Mapping, Optional, Union
+from typing import (
+    Any,
+    Callable,
+    Iterable,
+    Iterator,
+    Mapping,
+    Optional,
+    Sequence,
+    Union,
+)
 from urllib.parse import urlencode
 
+import lz4.frame
 import rapidjson
 from urllib3.connectionpool import HTTPConnectionPool
 from urllib3.exceptions import HTTPError
@@ -33,6 +46,111 @@ CLICKHOUSE_ERROR_RE = re.compile(
 JSONRow = bytes  # a single row in JSONEachRow format
 
 
+class InsertFormat(Enum):
+    """
+    The ClickHouse input format used to encode the rows that are sent
+    by the ``HTTPBatchWriter``.
+    """
+
+    JSON_EACH_ROW = "JSONEachRow"
+    ROW_BINARY = "RowBinary"
+
+
+class BodyCompressor(ABC):
+    """
+    Incrementally compresses the body of an insert request. Compressors are
+    stateful and must only be used for a single request.
+    """
+
+    content_encoding: str
+
+    @abstractmethod
+    def compress(self, data: bytes) -> bytes:
+        raise NotImplementedError
+
+    @abstractmethod
+    def flush(self) -> bytes:
+        raise NotImplementedError
+
+
+class GzipBodyCompressor(BodyCompressor):
+    content_encoding = "gzip"
+
+    def __init__(self) -> None:
+        self.__compressor = zlib.compressobj(1, wbits=zlib.MAX_WBITS | 16)
+
+    def compress(self, data: bytes) -> bytes:
+        return self.__compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self.__compressor.flush()
+
+
+class LZ4BodyCompressor(BodyCompressor):
+    content_encoding = "lz4"
+
+    def __init__(self) -> None:
+        self.__compressor = lz4.frame.LZ4FrameCompressor()
+        self.__header = self.__compressor.begin()
+
+    def compress(self, data: bytes) -> bytes:
+        header, self.__header = self.__header, b""
+        return header + self.__compressor.compress(data)
+
+    def flush(self) -> bytes:
+        header, self.__header = self.__header, b""
+        return header + self.__compressor.flush()
+
+
+class ZstdBodyCompressor(BodyCompressor):
+    content_encoding = "zstd"
+
+    def __init__(self) -> None:
+        # ``zstandard`` is an optional dependency, only required when zstd
+        # compression is enabled.
+        import zstandard
+
+        self.__compressor = zstandard.ZstdCompressor().compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self.__compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self.__compressor.flush()
+
+
+class BodyCompression(Enum):
+    """
+    The ``Content-Encoding`` used to compress the body of insert requests.
+    ClickHouse decompresses request bodies based on this header.
+    """
+
+    GZIP = "gzip"
+    LZ4 = "lz4"
+    ZSTD = "zstd"
+
+    def get_compressor(self) -> BodyCompressor:
+        return _BODY_COMPRESSORS[self]()
+
+
+_BODY_COMPRESSORS: Mapping[BodyCompression, Callable[[], BodyCompressor]] = {
+    BodyCompression.GZIP: GzipBodyCompressor,
+    BodyCompression.LZ4: LZ4BodyCompressor,
+    BodyCompression.ZSTD: ZstdBodyCompressor,
+}
+
+
+def compress_body(
+    chunks: Iterable[bytes], compressor: BodyCompressor
+) -> Iterator[bytes]:
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+
+    yield compressor.flush()
+
+
 class JSONRowEncoder(Encoder[JSONRow, WriterTableRow]):
     def __default(self, value: Any) -> Any:
         if isinstance(value, datetime):
@@ -55,6 +173,9 @@ class HTTPWriteBatch:
         password: str,
         options: Mapping[str, Any],  # should be ``Mapping[str, str]``?
         chunk_size: Optional[int] = None,
+        insert_format: InsertFormat = InsertFormat.JSON_EACH_ROW,
+        columns: Optional[Sequence[str]] = None,
+        compression: Optional[BodyCompression] = None,
     ) -> None:
         if chunk_size is None:
             chunk_size = settings.CLICKHOUSE_HTTP_CHUNK_SIZE
@@ -67,6 +188,25 @@ class HTTPWriteBatch:
         elif not chunk_size > 0:
             raise ValueError("chunk size must be greater than zero")
 
+        headers = {
+            "X-ClickHouse-User": user,
+            "X-ClickHouse-Key": password,
+            "Connection": "keep-alive",
+            "Accept-Encoding": "gzip,deflate",
+        }
+
+        # The body is consumed (and therefore compressed) by the executor
+        # thread that is sending the request, not the thread appending rows.
+        if compression is not None:
+            body = compress_body(body, compression.get_compressor())
+            headers["Content-Encoding"] = compression.value
+
+        # The column list is required by formats that cannot identify the
+        # column a value belongs to (like RowBinary). Names must be escaped.
+        table = f"{database}.{table_name}"
+        if columns is not None:
+            table = f"{table} ({', '.join(columns)})"
+
         self.__result = executor.submit(
             pool.urlopen,
             "POST",
@@ -74,15 +214,10 @@ class HTTPWriteBatch:
             + urlencode(
                 {
                     **options,
-                    "query": f"INSERT INTO {database}.{table_name} FORMAT JSONEachRow",
+                    "query": f"INSERT INTO {table} FORMAT {insert_format.value}",
                 }
             ),
-            headers={
-                "X-ClickHouse-User": user,
-                "X-ClickHouse-Key": password,
-                "Connection": "keep-alive",
-                "Accept-Encoding": "gzip,deflate",
-            },
+            headers=headers,
             body=body,
         )
 
@@ -145,7 +280,13 @@ class HTTPBatchWriter(BatchWriter[JSONRow]):
         metrics: MetricsBackend,  # deprecated
         options: Optional[Mapping[str, Any]] = None,
         chunk_size: Optional[int] = None,
+        insert_format: InsertFormat = InsertFormat.JSON_EACH_ROW,
+        columns: Optional[Sequence[str]] = None,
+        compression: Optional[BodyCompression] = None,
     ):
+        if compression is None and settings.CLICKHOUSE_HTTP_COMPRESSION is not None:
+            compression = BodyCompression(settings.CLICKHOUSE_HTTP_COMPRESSION)
+
         self.__pool = HTTPConnectionPool(host, port)
         self.__executor = ThreadPoolExecutor()
 
@@ -155,6 +296,9 @@ class HTTPBatchWriter(BatchWriter[JSONRow]):
         self.__password = password
         self.__database = database
         self.__chunk_size = chunk_size
+        self.__insert_format = insert_format
+        self.__columns = columns
+        self.__compression = compression
 
     def __repr__(self) -> str:
         return f"<{type(self).__name__}: {self.__database}.{self.__table_name} on {self.__pool.host}:{self.__pool.port}>"
@@ -169,6 +313,9 @@ class HTTPBatchWriter(BatchWriter[JSONRow]):
             self.__password,
             self.__options,
             self.__chunk_size,
+            self.__insert_format,
+            self.__columns,
+            self.__compression,
         )
 
         for value in values:
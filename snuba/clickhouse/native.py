@@ -11,7 +11,7 @@ from dateutil.tz import tz
 from snuba import settings
 from snuba.clickhouse.errors import ClickhouseError
 from snuba.clickhouse.formatter.nodes import FormattedQuery
-from snuba.reader import Reader, Result, build_result_transformer
+from snuba.reader import Reader, Result, build_column_transformer
 
 logger = logging.getLogger("snuba.clickhouse")
 
@@ -178,7 +178,7 @@ def transform_uuid(value: UUID) -> str:
     return str(value)
 
 
-transform_column_types = build_result_transformer(
+get_column_transformer = build_column_transformer(
     [
         (re.compile(r"^Date(\(.+\))?$"), transform_date),
         (re.compile(r"^DateTime(\(.+\))?$"), transform_datetime),
@@ -204,14 +204,26 @@ class NativeDriverReader(Reader):
         # duplicated names are discarded at this stage.
         columns = {c[0]: i for i, c in enumerate(meta)}
 
-        data = [
-            {column: row[index] for column, index in columns.items()} for row in data
-        ]
-
         meta = [
             {"name": m[0], "type": m[1]} for m in [meta[i] for i in columns.values()]
         ]
 
+        # The values are transformed one column at a time, before the rows
+        # are built, so that every row mapping is only created once.
+        if data:
+            values = [*zip(*data)]
+            column_values = []
+            for column, index in zip(meta, columns.values()):
+                transformer = get_column_transformer(column)
+                column_values.append(
+                    values[index]
+                    if transformer is None
+                    else [*map(transformer, values[index])]
+                )
+
+            names = [*columns]
+            data = [dict(zip(names, row)) for row in zip(*column_values)]
+
         if with_totals:
             assert len(data) > 0
             totals = data.pop(-1)
@@ -219,8 +231,6 @@ class NativeDriverReader(Reader):
         else:
             result = {"data": data, "meta": meta}
 
-        transform_column_types(result)
-
         return result
 
     def execute(
@@ -0,0 +1,262 @@
+from __future__ import annotations
+
+import calendar
+import struct
+from datetime import date, datetime
+from ipaddress import IPv4Address, IPv6Address
+from typing import Any, Callable, Sequence, Tuple
+from uuid import UUID as PythonUUID
+
+from snuba.clickhouse import DATETIME_FORMAT
+from snuba.clickhouse.columns import (
+    UUID,
+    Array,
+    ColumnSet,
+    ColumnType,
+    Date,
+    DateTime,
+    Enum,
+    FixedString,
+    Float,
+    IPv4,
+    IPv6,
+    Nullable,
+    ReadOnly,
+    String,
+    UInt,
+)
+from snuba.utils.codecs import Encoder
+from snuba.writer import WriterTableRow
+
+
+RowBinaryRow = bytes  # a single row in RowBinary format
+
+# Appends the binary representation of a value to the provided buffer.
+ValueWriter = Callable[[Any, bytearray], None]
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+UINT64_MASK = (1 << 64) - 1
+
+
+def _write_varint(value: int, buffer: bytearray) -> None:
+    # Lengths of strings and arrays are encoded as unsigned LEB128.
+    while value > 0x7F:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def _build_struct_writer(format: str) -> ValueWriter:
+    pack = struct.Struct(format).pack
+
+    def write(value: Any, buffer: bytearray) -> None:
+        buffer += pack(value)
+
+    return write
+
+
+def _write_string(value: Any, buffer: bytearray) -> None:
+    if isinstance(value, str):
+        value = value.encode("utf-8")
+    _write_varint(len(value), buffer)
+    buffer += value
+
+
+def _build_fixed_string_writer(length: int) -> ValueWriter:
+    def write(value: Any, buffer: bytearray) -> None:
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+        if len(value) > length:
+            raise ValueError(f"value exceeds FixedString({length})")
+        buffer += value.ljust(length, b"\x00")
+
+    return write
+
+
+_pack_uint16 = struct.Struct("<H").pack
+_pack_uint32 = struct.Struct("<I").pack
+_pack_uuid = struct.Struct("<QQ").pack
+
+
+def _write_date(value: Any, buffer: bytearray) -> None:
+    if isinstance(value, datetime):
+        value = value.date()
+    elif isinstance(value, str):
+        value = datetime.strptime(value[:10], "%Y-%m-%d").date()
+
+    if isinstance(value, date):
+        value = value.toordinal() - EPOCH_ORDINAL
+
+    buffer += _pack_uint16(value)
+
+
+def _write_datetime(value: Any, buffer: bytearray) -> None:
+    if isinstance(value, str):
+        value = datetime.strptime(value, DATETIME_FORMAT)
+
+    if isinstance(value, datetime):
+        # Naive datetimes are treated as UTC, which matches how they are
+        # formatted by ``JSONRowEncoder``.
+        if value.tzinfo is None:
+            value = calendar.timegm(value.timetuple())
+        else:
+            value = int(value.timestamp())
+
+    buffer += _pack_uint32(int(value))
+
+
+def _write_uuid(value: Any, buffer: bytearray) -> None:
+    if isinstance(value, str):
+        value = PythonUUID(value)
+    if isinstance(value, PythonUUID):
+        value = value.int
+
+    # UUIDs are stored as two little endian 64 bit integers, high bits first.
+    buffer += _pack_uuid(value >> 64, value & UINT64_MASK)
+
+
+def _write_ipv4(value: Any, buffer: bytearray) -> None:
+    if not isinstance(value, int):
+        value = int(IPv4Address(value))
+    buffer += _pack_uint32(value)
+
+
+def _write_ipv6(value: Any, buffer: bytearray) -> None:
+    if not isinstance(value, IPv6Address):
+        value = IPv6Address(value)
+    buffer += value.packed
+
+
+def _build_enum_writer(values: Sequence[Tuple[str, int]]) -> ValueWriter:
+    mapping = dict(values)
+    if all(-128 <= value <= 127 for value in mapping.values()):
+        pack = struct.Struct("<b").pack
+    else:
+        pack = struct.Struct("<h").pack
+
+    def write(value: Any, buffer: bytearray) -> None:
+        if isinstance(value, str):
+            value = mapping[value]
+        buffer += pack(value)
+
+    return write
+
+
+def _build_array_writer(inner: ValueWriter) -> ValueWriter:
+    def write(value: Any, buffer: bytearray) -> None:
+        _write_varint(len(value), buffer)
+        for item in value:
+            inner(item, buffer)
+
+    return write
+
+
+def _build_nullable_writer(inner: ValueWriter) -> ValueWriter:
+    def write(value: Any, buffer: bytearray) -> None:
+        if value is None:
+            buffer.append(1)
+        else:
+            buffer.append(0)
+            inner(value, buffer)
+
+    return write
+
+
+def _build_writer(column_type: ColumnType[Any]) -> Tuple[ValueWriter, Any]:
+    """
+    Builds the function that serializes a value of the provided type and
+    returns it together with the value that is used when a row does not
+    contain the column at all.
+    """
+    writer: ValueWriter
+    default: Any
+    if isinstance(column_type, UInt):
+        writer = _build_struct_writer(
+            {8: "<B", 16: "<H", 32: "<I", 64: "<Q"}[column_type.size]
+        )
+        default = 0
+    elif isinstance(column_type, Float):
+        writer = _build_struct_writer({32: "<f", 64: "<d"}[column_type.size])
+        default = 0.0
+    elif isinstance(column_type, String):
+        writer, default = _write_string, b""
+    elif isinstance(column_type, FixedString):
+        writer, default = _build_fixed_string_writer(column_type.length), b""
+    elif isinstance(column_type, DateTime):
+        writer, default = _write_datetime, 0
+    elif isinstance(column_type, Date):
+        writer, default = _write_date, 0
+    elif isinstance(column_type, UUID):
+        writer, default = _write_uuid, 0
+    elif isinstance(column_type, IPv4):
+        writer, default = _write_ipv4, 0
+    elif isinstance(column_type, IPv6):
+        writer, default = _write_ipv6, "::"
+    elif isinstance(column_type, Enum):
+        writer = _build_enum_writer(column_type.values)
+        default = column_type.values[0][0]
+    elif isinstance(column_type, Array):
+        writer = _build_array_writer(_build_writer(column_type.inner_type)[0])
+        default = []
+    else:
+        raise ValueError(f"{column_type!r} cannot be encoded as RowBinary")
+
+    if column_type.has_modifier(Nullable):
+        return _build_nullable_writer(writer), None
+
+    return writer, default
+
+
+def get_insert_columns(columns: ColumnSet) -> Sequence[str]:
+    """
+    Returns the escaped names of the columns, in schema order, that are
+    provided by the encoder when inserting into a table with the given
+    columns. Read only columns are computed by ClickHouse and are never
+    written.
+    """
+    return [
+        column.escaped for column in columns if not column.type.has_modifier(ReadOnly)
+    ]
+
+
+class RowBinaryEncoder(Encoder[RowBinaryRow, WriterTableRow]):
+    """
+    Encodes rows in the ClickHouse ``RowBinary`` format, which avoids
+    paying JSON serialization on the consumer and JSON parsing on the
+    ClickHouse server.
+
+    RowBinary requires a value for every column in the insert statement,
+    since there is no way to mark a value as omitted. The column list is
+    derived from the schema (see ``get_insert_columns``) and any column
+    missing from a row is written as its type default (``NULL`` for
+    nullable columns), so this should only be used for storages whose
+    processors produce complete rows and do not rely on ``DEFAULT``
+    expressions in the table definition.
+    """
+
+    def __init__(self, columns: ColumnSet) -> None:
+        self.__columns = columns
+        self.__writers: Sequence[Tuple[str, ValueWriter, Any]] = [
+            (column.flattened, *_build_writer(column.type))
+            for column in columns
+            if not column.type.has_modifier(ReadOnly)
+        ]
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        # The column writers are closures that cannot be pickled, so the
+        # encoder is rebuilt from the schema when it is sent to a
+        # different process.
+        return (type(self), (self.__columns,))
+
+    def encode(self, value: WriterTableRow) -> RowBinaryRow:
+        buffer = bytearray()
+        for name, writer, default in self.__writers:
+            column_value = value.get(name, default)
+            try:
+                writer(column_value, buffer)
+            except (ValueError, TypeError, KeyError, struct.error) as error:
+                raise ValueError(
+                    f"could not encode {column_value!r} for column {name!r}"
+                ) from error
+        return bytes(buffer)
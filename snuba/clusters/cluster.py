@@ -16,7 +16,7 @@ from typing import (
 
 from snuba import settings
 from snuba.clickhouse.escaping import escape_string
-from snuba.clickhouse.http import HTTPBatchWriter, JSONRow
+from snuba.clickhouse.http import HTTPBatchWriter, InsertFormat, JSONRow
 from snuba.clickhouse.native import ClickhousePool, NativeDriverReader
 from snuba.clusters.storage_sets import StorageSetKey
 from snuba.reader import Reader
@@ -111,6 +111,8 @@ class Cluster(ABC, Generic[TWriterOptions]):
         metrics: MetricsBackend,
         options: TWriterOptions,
         chunk_size: Optional[int],
+        insert_format: InsertFormat = InsertFormat.JSON_EACH_ROW,
+        columns: Optional[Sequence[str]] = None,
     ) -> BatchWriter[JSONRow]:
         raise NotImplementedError
 
@@ -219,6 +221,8 @@ class ClickhouseCluster(Cluster[ClickhouseWriterOptions]):
         metrics: MetricsBackend,
         options: ClickhouseWriterOptions,
         chunk_size: Optional[int],
+        insert_format: InsertFormat = InsertFormat.JSON_EACH_ROW,
+        columns: Optional[Sequence[str]] = None,
     ) -> BatchWriter[JSONRow]:
         return HTTPBatchWriter(
             table_name,
@@ -230,6 +234,8 @@ class ClickhouseCluster(Cluster[ClickhouseWriterOptions]):
             metrics=metrics,
             options=options,
             chunk_size=chunk_size,
+            insert_format=insert_format,
+            columns=columns,
         )
 
     def is_single_node(self) -> bool:
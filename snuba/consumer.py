@@ -17,9 +17,13 @@ from typing import (
 )
 
 import rapidjson
+from clickhouse_driver import errors
 from confluent_kafka import Producer as ConfluentKafkaProducer
 
+from snuba import settings
+from snuba.clickhouse.errors import ClickhouseWriterError
 from snuba.clickhouse.http import JSONRow, JSONRowEncoder
+from snuba.consumers.batch_size import BatchSizeController
 from snuba.datasets.message_filters import StreamMessageFilter
 from snuba.datasets.storage import WritableTableStorage
 from snuba.datasets.storages import StorageKey
@@ -28,8 +32,10 @@ from snuba.processor import (
     MessageProcessor,
     ReplacementBatch,
 )
+from snuba.utils.codecs import Encoder
 from snuba.utils.metrics import MetricsBackend
 from snuba.utils.metrics.wrapper import MetricsWrapper
+from snuba.utils.retries import BasicRetryPolicy, NoRetryPolicy, RetryPolicy
 from snuba.utils.streams import Message, Partition, Topic
 from snuba.utils.streams.backends.kafka import (
     KafkaPayload,
@@ -45,10 +51,11 @@ from snuba.utils.streams.processing.strategies import (
 from snuba.utils.streams.processing.strategies.streaming import (
     CollectStep,
     FilterStep,
+    InstrumentedStep,
     ParallelTransformStep,
     TransformStep,
 )
-from snuba.writer import BatchWriter
+from snuba.writer import BatchWriter, WriterTableRow
 
 
 logger = logging.getLogger("snuba.consumer")
@@ -70,14 +77,61 @@ class JSONRowInsertBatch(NamedTuple):
             return type(self), (self.rows,)
 
 
+def _is_too_many_parts_error(exception: Exception) -> bool:
+    return (
+        isinstance(exception, ClickhouseWriterError)
+        and exception.code == errors.ErrorCodes.TOO_MANY_PARTS
+    )
+
+
 class InsertBatchWriter(ProcessingStep[JSONRowInsertBatch]):
-    def __init__(self, writer: BatchWriter[JSONRow], metrics: MetricsBackend) -> None:
+    def __init__(
+        self,
+        writer: BatchWriter[JSONRow],
+        metrics: MetricsBackend,
+        batch_size_controller: Optional[BatchSizeController] = None,
+    ) -> None:
         self.__writer = writer
         self.__metrics = metrics
+        self.__batch_size_controller = batch_size_controller
+
+        # When the batch size is adjusted automatically, inserts that are
+        # rejected because the table has too many parts are retried, giving
+        # the controller a chance to switch to larger batches. (The policy
+        # must not reference the writer, which would only be freed by the
+        # cyclic garbage collector, keeping the shared memory that is
+        # referenced by its messages in use.)
+        self.__retry_policy: RetryPolicy = (
+            BasicRetryPolicy(
+                settings.TOO_MANY_PARTS_MAX_RETRIES + 1,
+                settings.TOO_MANY_PARTS_RETRY_DELAY,
+                _is_too_many_parts_error,
+            )
+            if batch_size_controller is not None
+            else NoRetryPolicy()
+        )
 
         self.__messages: MutableSequence[Message[JSONRowInsertBatch]] = []
         self.__closed = False
 
+    def __write(self) -> float:
+        write_start = time.time()
+        try:
+            self.__writer.write(
+                itertools.chain.from_iterable(
+                    message.payload.rows for message in self.__messages
+                )
+            )
+        except Exception as error:
+            if self.__batch_size_controller is not None and _is_too_many_parts_error(
+                error
+            ):
+                self.__batch_size_controller.record_too_many_parts()
+                self.__metrics.increment("too_many_parts")
+                logger.warning("Insert rejected by %r: %s", self.__writer, error)
+            raise
+        return write_start
+
     def poll(self) -> None:
         pass
 
@@ -92,23 +146,37 @@ class InsertBatchWriter(ProcessingStep[JSONRowInsertBatch]):
         if not self.__messages:
             return
 
-        write_start = time.time()
-        self.__writer.write(
-            itertools.chain.from_iterable(
-                message.payload.rows for message in self.__messages
-            )
-        )
+        write_start = self.__retry_policy.call(self.__write)
         write_finish = time.time()
 
+        rows = sum(len(message.payload.rows) for message in self.__messages)
+
+        if self.__batch_size_controller is not None:
+            self.__batch_size_controller.record_insert(
+                len(self.__messages), rows, write_finish - write_start
+            )
+            self.__metrics.gauge(
+                "batch_size", self.__batch_size_controller.get_batch_size()
+            )
+
         for message in self.__messages:
             self.__metrics.timing(
                 "latency_ms", (write_finish - message.timestamp.timestamp()) * 1000
             )
 
+        self.__metrics.timing("write_duration_ms", (write_finish - write_start) * 1000)
+        self.__metrics.timing("rows", rows)
+        self.__metrics.timing(
+            "bytes",
+            sum(
+                len(row) for message in self.__messages for row in message.payload.rows
+            ),
+        )
+
         logger.debug(
             "Waited %0.4f seconds for %r rows to be written to %r.",
             write_finish - write_start,
-            sum(len(message.payload.rows) for message in self.__messages),
+            rows,
             self.__writer,
         )
 
@@ -247,20 +315,36 @@ class ProcessedMessageBatchWriter(
 json_row_encoder = JSONRowEncoder()
 
 
-def process_message(
-    processor: MessageProcessor, message: Message[KafkaPayload]
-) -> Union[None, JSONRowInsertBatch, ReplacementBatch]:
-    result = processor.process_message(
-        rapidjson.loads(message.payload.value),
-        KafkaMessageMetadata(
-            message.offset, message.partition.index, message.timestamp
-        ),
+def process_messages(
+    processor: MessageProcessor,
+    messages: Sequence[Message[KafkaPayload]],
+    encoder: Encoder[JSONRow, WriterTableRow] = json_row_encoder,
+) -> Sequence[Union[None, JSONRowInsertBatch, ReplacementBatch]]:
+    results = processor.process_batch(
+        [message.payload.value for message in messages],
+        [
+            KafkaMessageMetadata(
+                message.offset, message.partition.index, message.timestamp
+            )
+            for message in messages
+        ],
     )
 
-    if isinstance(result, InsertBatch):
-        return JSONRowInsertBatch([json_row_encoder.encode(row) for row in result.rows])
-    else:
-        return result
+    return [
+        JSONRowInsertBatch([encoder.encode(row) for row in result.rows])
+        if isinstance(result, InsertBatch)
+        else result
+        for result in results
+    ]
+
+
+def process_message(
+    processor: MessageProcessor,
+    message: Message[KafkaPayload],
+    encoder: Encoder[JSONRow, WriterTableRow] = json_row_encoder,
+) -> Union[None, JSONRowInsertBatch, ReplacementBatch]:
+    [result] = process_messages(processor, [message], encoder)
+    return result
 
 
 class StreamingConsumerStrategyFactory(ProcessingStrategyFactory[KafkaPayload]):
@@ -277,14 +361,20 @@ class StreamingConsumerStrategyFactory(ProcessingStrategyFactory[KafkaPayload]):
         output_block_size: Optional[int],
         replacements_producer: Optional[ConfluentKafkaProducer] = None,
         replacements_topic: Optional[Topic] = None,
+        row_encoder: Encoder[JSONRow, WriterTableRow] = json_row_encoder,
+        max_pending_batches: int = 0,
+        batch_size_controller: Optional[BatchSizeController] = None,
     ) -> None:
         self.__prefilter = prefilter
         self.__processor = processor
         self.__writer = writer
+        self.__row_encoder = row_encoder
         self.__metrics = metrics
 
         self.__max_batch_size = max_batch_size
         self.__max_batch_time = max_batch_time
+        self.__max_pending_batches = max_pending_batches
+        self.__batch_size_controller = batch_size_controller
 
         if processes is not None:
             assert input_block_size is not None, "input block size required"
@@ -312,7 +402,9 @@ class StreamingConsumerStrategyFactory(ProcessingStrategyFactory[KafkaPayload]):
 
     def __build_write_step(self) -> ProcessedMessageBatchWriter:
         insert_batch_writer = InsertBatchWriter(
-            self.__writer, MetricsWrapper(self.__metrics, "insertions")
+            self.__writer,
+            MetricsWrapper(self.__metrics, "insertions"),
+            self.__batch_size_controller,
         )
 
         replacement_batch_writer: Optional[ReplacementBatchWriter]
@@ -335,33 +427,53 @@ class StreamingConsumerStrategyFactory(ProcessingStrategyFactory[KafkaPayload]):
         collect = CollectStep(
             self.__build_write_step,
             commit,
-            self.__max_batch_size,
+            (
+                self.__batch_size_controller.get_batch_size
+                if self.__batch_size_controller is not None
+                else self.__max_batch_size
+            ),
             self.__max_batch_time,
+            self.__max_pending_batches,
+        )
+
+        # The collect step is instrumented separately from the whole strategy,
+        # to distinguish time spent writing batches from time spent decoding
+        # and processing messages.
+        instrumented_collect = InstrumentedStep(
+            collect, MetricsWrapper(self.__metrics, "steps.collect")
         )
 
-        transform_function = functools.partial(process_message, self.__processor)
+        transform_function = functools.partial(
+            process_message, self.__processor, encoder=self.__row_encoder
+        )
+        batch_transform_function = functools.partial(
+            process_messages, self.__processor, encoder=self.__row_encoder
+        )
 
         strategy: ProcessingStrategy[KafkaPayload]
         if self.__processes is None:
-            strategy = TransformStep(transform_function, collect)
+            strategy = TransformStep(transform_function, instrumented_collect)
         else:
             assert self.__input_block_size is not None
             assert self.__output_block_size is not None
             strategy = ParallelTransformStep(
                 transform_function,
-                collect,
+                instrumented_collect,
                 self.__processes,
                 max_batch_size=self.__max_batch_size,
                 max_batch_time=self.__max_batch_time,
                 input_block_size=self.__input_block_size,
                 output_block_size=self.__output_block_size,
                 metrics=MetricsWrapper(self.__metrics, "process"),
+                batch_function=batch_transform_function,
             )
 
         if self.__prefilter is not None:
             strategy = FilterStep(self.__should_accept, strategy)
 
-        return strategy
+        return InstrumentedStep(
+            strategy, MetricsWrapper(self.__metrics, "steps.strategy")
+        )
 
 
 class MultistorageCollector(
@@ -453,20 +565,18 @@ def process_message_multistorage(
     ] = []
 
     for storage_key in message.payload.storage_keys:
+        table_writer = get_writable_storage(storage_key).get_table_writer()
         result = (
-            get_writable_storage(storage_key)
-            .get_table_writer()
-            .get_stream_loader()
+            table_writer.get_stream_loader()
             .get_processor()
             .process_message(value, metadata)
         )
         if isinstance(result, InsertBatch):
+            encoder = table_writer.get_row_encoder()
             results.append(
                 (
                     storage_key,
-                    JSONRowInsertBatch(
-                        [json_row_encoder.encode(row) for row in result.rows]
-                    ),
+                    JSONRowInsertBatch([encoder.encode(row) for row in result.rows]),
                 )
             )
         else:
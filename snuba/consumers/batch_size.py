@@ -0,0 +1,107 @@
+import logging
+from threading import Lock
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class BatchSizeController:
+    """
+    Adjusts the maximum number of messages in the batches collected by the
+    consumer, aiming for inserts that take about ``target_latency`` seconds
+    and that write at most about ``target_rows`` rows. At least one of the
+    targets is required.
+
+    After every insert, the number of messages that could have been written
+    in the target latency is estimated from the throughput of that insert.
+    When an insert is slower than the target, the batch size shrinks towards
+    that estimate, otherwise it grows towards it. The number of messages
+    that produce the target number of rows is estimated from the rows per
+    message of that insert, and the batch size never grows past that
+    estimate. The size changes by at most a factor of two per insert, and
+    always stays between ``min_batch_size`` and ``max_batch_size``.
+
+    ClickHouse rejects inserts with "too many parts" errors when a table
+    receives more inserts than merges can keep up with. When this happens,
+    the batch size is doubled so that fewer, larger inserts are made.
+
+    Inserts may complete in background threads, so the controller is
+    thread safe.
+    """
+
+    def __init__(
+        self,
+        min_batch_size: int,
+        max_batch_size: int,
+        target_latency: Optional[float],
+        target_rows: Optional[int] = None,
+    ) -> None:
+        if not 0 < min_batch_size <= max_batch_size:
+            raise ValueError(
+                "min batch size must be greater than zero and not greater than max batch size"
+            )
+
+        if target_latency is None and target_rows is None:
+            raise ValueError("a target latency or number of rows is required")
+
+        if target_latency is not None and not target_latency > 0:
+            raise ValueError("target latency must be greater than zero")
+
+        if target_rows is not None and not target_rows > 0:
+            raise ValueError("target rows must be greater than zero")
+
+        self.__min_batch_size = min_batch_size
+        self.__max_batch_size = max_batch_size
+        self.__target_latency = target_latency
+        self.__target_rows = target_rows
+
+        self.__lock = Lock()
+        self.__batch_size = max_batch_size
+
+    def __repr__(self) -> str:
+        return f"<{type(self).__name__}: {self.__batch_size} messages (target latency {self.__target_latency} seconds, target rows {self.__target_rows})>"
+
+    def get_batch_size(self) -> int:
+        return self.__batch_size
+
+    def __set_batch_size(self, batch_size: float) -> None:
+        batch_size = int(
+            max(self.__min_batch_size, min(self.__max_batch_size, batch_size))
+        )
+        if batch_size != self.__batch_size:
+            logger.debug(
+                "Changing batch size from %r to %r.", self.__batch_size, batch_size
+            )
+            self.__batch_size = batch_size
+
+    def record_insert(self, messages: int, rows: int, duration: float) -> None:
+        """
+        Record the number of messages and rows that were written by an
+        insert and the time (in seconds) the insert took.
+        """
+        if messages < 1:
+            return
+
+        with self.__lock:
+            batch_size = self.__batch_size
+
+            def towards(estimate: float) -> float:
+                return max(batch_size / 2, min(estimate, batch_size * 2))
+
+            target = float("inf")
+            if self.__target_latency is not None:
+                estimate = messages * self.__target_latency / max(duration, 1e-3)
+                if duration > self.__target_latency:
+                    target = min(batch_size, towards(estimate))
+                else:
+                    target = max(batch_size, towards(estimate))
+
+            if self.__target_rows is not None and rows > 0:
+                target = min(target, towards(messages * self.__target_rows / rows))
+
+            if target != float("inf"):
+                self.__set_batch_size(target)
+
+    def record_too_many_parts(self) -> None:
+        with self.__lock:
+            self.__set_batch_size(self.__batch_size * 2)
@@ -2,14 +2,17 @@ from typing import Callable, Optional, Sequence
 
 from confluent_kafka import KafkaError, KafkaException, Producer
 
-from snuba import environment
+from snuba import environment, settings
 from snuba.consumer import StreamingConsumerStrategyFactory
+from snuba.consumers.batch_size import BatchSizeController
 from snuba.consumers.snapshot_worker import SnapshotProcessor
+from snuba.consumers.stats import ConsumerStats, StatsServer
 from snuba.datasets.storages import StorageKey
 from snuba.datasets.storages.factory import get_writable_storage
 from snuba.processor import MessageProcessor
 from snuba.snapshots import SnapshotId
 from snuba.stateful_consumer.control_protocol import TransactionData
+from snuba.utils.metrics import MetricsBackend
 from snuba.utils.metrics.wrapper import MetricsWrapper
 from snuba.utils.retries import BasicRetryPolicy, RetryPolicy, constant_delay
 from snuba.utils.streams import Topic
@@ -52,6 +55,11 @@ class ConsumerBuilder:
         output_block_size: Optional[int],
         commit_retry_policy: Optional[RetryPolicy] = None,
         profile_path: Optional[str] = None,
+        max_pending_batches: int = 0,
+        target_insert_latency_ms: Optional[int] = None,
+        target_insert_rows: Optional[int] = None,
+        min_batch_size: int = settings.DEFAULT_MIN_BATCH_SIZE,
+        stats_port: Optional[int] = None,
     ) -> None:
         self.storage = get_writable_storage(storage_key)
         self.bootstrap_servers = bootstrap_servers
@@ -99,12 +107,17 @@ class ConsumerBuilder:
         # not actually required.
         self.producer = Producer(self.producer_broker_config)
 
-        self.metrics = MetricsWrapper(
+        self.metrics: MetricsBackend = MetricsWrapper(
             environment.metrics,
             "consumer",
             tags={"group": group_id, "storage": storage_key.value},
         )
 
+        if stats_port is not None:
+            stats = ConsumerStats(self.metrics)
+            StatsServer(stats, "127.0.0.1", stats_port).start()
+            self.metrics = stats
+
         self.max_batch_size = max_batch_size
         self.max_batch_time_ms = max_batch_time_ms
         self.group_id = group_id
@@ -114,6 +127,10 @@ class ConsumerBuilder:
         self.processes = processes
         self.input_block_size = input_block_size
         self.output_block_size = output_block_size
+        self.max_pending_batches = max_pending_batches
+        self.target_insert_latency_ms = target_insert_latency_ms
+        self.target_insert_rows = target_insert_rows
+        self.min_batch_size = min_batch_size
         self.__profile_path = profile_path
 
         if commit_retry_policy is None:
@@ -196,6 +213,21 @@ class ConsumerBuilder:
                 self.producer if self.replacements_topic is not None else None
             ),
             replacements_topic=self.replacements_topic,
+            row_encoder=table_writer.get_row_encoder(),
+            max_pending_batches=self.max_pending_batches,
+            batch_size_controller=(
+                BatchSizeController(
+                    self.min_batch_size,
+                    self.max_batch_size,
+                    self.target_insert_latency_ms / 1000.0
+                    if self.target_insert_latency_ms is not None
+                    else None,
+                    self.target_insert_rows,
+                )
+                if self.target_insert_latency_ms is not None
+                or self.target_insert_rows is not None
+                else None
+            ),
         )
 
         if self.__profile_path is not None:
@@ -0,0 +1,108 @@
+import logging
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from typing import Any, Mapping, MutableMapping, Optional, Union
+
+import rapidjson
+
+from snuba.utils.metrics import MetricsBackend
+from snuba.utils.metrics.types import Tags
+
+
+logger = logging.getLogger(__name__)
+
+
+class ConsumerStats(MetricsBackend):
+    """
+    Forwards metrics to another backend, while keeping a summary of them in
+    memory so that they can be inspected locally (see ``StatsServer``.)
+
+    Counters are summed, the last value of each gauge is kept, and the
+    number, total and maximum of the values recorded for each timing are
+    tracked. Metrics are summarized by name, without their tags.
+    """
+
+    def __init__(self, backend: MetricsBackend) -> None:
+        self.__backend = backend
+
+        self.__lock = Lock()
+        self.__started = time.time()
+        self.__counters: MutableMapping[str, float] = {}
+        self.__gauges: MutableMapping[str, float] = {}
+        self.__timings: MutableMapping[str, MutableMapping[str, float]] = {}
+
+    def increment(
+        self, name: str, value: Union[int, float] = 1, tags: Optional[Tags] = None
+    ) -> None:
+        with self.__lock:
+            self.__counters[name] = self.__counters.get(name, 0) + value
+        self.__backend.increment(name, value, tags)
+
+    def gauge(
+        self, name: str, value: Union[int, float], tags: Optional[Tags] = None
+    ) -> None:
+        with self.__lock:
+            self.__gauges[name] = value
+        self.__backend.gauge(name, value, tags)
+
+    def timing(
+        self, name: str, value: Union[int, float], tags: Optional[Tags] = None
+    ) -> None:
+        with self.__lock:
+            summary = self.__timings.get(name)
+            if summary is None:
+                self.__timings[name] = {"count": 1, "sum": value, "max": value}
+            else:
+                summary["count"] += 1
+                summary["sum"] += value
+                summary["max"] = max(summary["max"], value)
+        self.__backend.timing(name, value, tags)
+
+    def snapshot(self) -> Mapping[str, Any]:
+        with self.__lock:
+            return {
+                "uptime": time.time() - self.__started,
+                "counters": {**self.__counters},
+                "gauges": {**self.__gauges},
+                "timings": {
+                    name: {**summary, "avg": summary["sum"] / summary["count"]}
+                    for name, summary in self.__timings.items()
+                },
+            }
+
+
+class StatsServer:
+    """
+    Serves the snapshot of a ``ConsumerStats`` instance as JSON over HTTP
+    from a background thread.
+    """
+
+    def __init__(self, stats: ConsumerStats, host: str, port: int) -> None:
+        class StatsRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                body = rapidjson.dumps(stats.snapshot()).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                logger.debug(format, *args)
+
+        self.__server = ThreadingHTTPServer((host, port), StatsRequestHandler)
+        self.__thread = Thread(target=self.__server.serve_forever, daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self.__server.server_address[1]
+
+    def start(self) -> None:
+        logger.info("Serving consumer stats on port %r...", self.port)
+        self.__thread.start()
+
+    def stop(self) -> None:
+        self.__server.shutdown()
+        self.__server.server_close()
+        self.__thread.join()
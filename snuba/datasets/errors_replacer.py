@@ -3,9 +3,21 @@ import time
 import uuid
 
 from collections import deque
+from dataclasses import dataclass
 from datetime import datetime
 from enum import Enum
-from typing import Any, Deque, Mapping, Optional, Sequence, Tuple
+from itertools import chain, groupby
+from typing import (
+    Any,
+    Deque,
+    Hashable,
+    Mapping,
+    MutableSequence,
+    Optional,
+    Sequence,
+    Tuple,
+    cast,
+)
 
 from snuba import settings
 from snuba.clickhouse import DATETIME_FORMAT
@@ -122,6 +134,19 @@ def get_projects_query_flags(
     return (needs_final, exclude_groups)
 
 
+@dataclass(frozen=True)
+class CoalescableReplacement(Replacement):
+    """
+    A replacement that can be combined with adjacent replacements that have
+    the same key into a single replacement (see
+    ``ErrorsReplacer.coalesce_replacements``.) The parts contain the data
+    taken from each of the messages that the replacement applies.
+    """
+
+    key: Tuple[Hashable, ...]
+    parts: Sequence[Any]
+
+
 class ErrorsReplacer(ReplacerProcessor):
     def __init__(
         self,
@@ -179,6 +204,57 @@ class ErrorsReplacer(ReplacerProcessor):
 
         return processed
 
+    def coalesce_replacements(
+        self, replacements: Sequence[Replacement]
+    ) -> Sequence[Replacement]:
+        """
+        Combines runs of adjacent replacements of the same type for the same
+        project, like merges into the same group or group deletions, into a
+        single replacement. Replacements are never reordered, since the
+        result of most of them depends on the ones that were applied before.
+        """
+        coalesced: MutableSequence[Replacement] = []
+        for key, run in groupby(
+            replacements,
+            lambda replacement: replacement.key
+            if isinstance(replacement, CoalescableReplacement)
+            else None,
+        ):
+            if key is None:
+                coalesced.extend(run)
+                continue
+
+            pending = [cast(CoalescableReplacement, r) for r in run]
+            for i in range(
+                0, len(pending), settings.REPLACER_MAX_COALESCED_REPLACEMENTS
+            ):
+                chunk = pending[i : i + settings.REPLACER_MAX_COALESCED_REPLACEMENTS]
+                if len(chunk) == 1:
+                    coalesced.append(chunk[0])
+                else:
+                    coalesced.append(
+                        self.__build_coalesced_replacement(
+                            key, [*chain.from_iterable(r.parts for r in chunk)],
+                        )
+                    )
+
+        return coalesced
+
+    def __build_coalesced_replacement(
+        self, key: Tuple[Hashable, ...], parts: Sequence[Any]
+    ) -> Replacement:
+        type_ = key[0]
+        if type_ == "end_delete_groups":
+            return build_delete_groups(key, parts, self.__required_columns)
+        elif type_ == "end_merge":
+            return build_merge(key, parts, self.__all_columns)
+        elif type_ == "tombstone_events":
+            return build_tombstone_events(key, parts, self.__required_columns)
+        elif type_ == "exclude_groups":
+            return build_exclude_groups(key, parts)
+        else:
+            raise ValueError(f"cannot coalesce replacements of type {type_!r}")
+
     def pre_replacement(self, replacement: Replacement, matching_records: int) -> bool:
         # query_time_flags == (type, project_id, [...data...])
         flag_type, project_id = replacement.query_time_flags[:2]
@@ -205,21 +281,74 @@ class ErrorsReplacer(ReplacerProcessor):
         return False
 
 
+class ReplacementCountMode(Enum):
+    """
+    Determines the query that is run before each replacement to find out
+    whether there are any rows to replace (see ``REPLACER_COUNT_MODE``.)
+    """
+
+    # Count the rows that will be replaced.
+    EXACT = "exact"
+    # Only check whether any row may be replaced. This skips the FINAL
+    # merge and stops reading at the first matching row. Rows that have
+    # already been replaced but not merged yet can still match, which only
+    # causes a replacement that does nothing to run.
+    EXISTS = "exists"
+    # Count the matching rows without FINAL. This is an upper bound of the
+    # number of rows that will be replaced.
+    APPROXIMATE = "approximate"
+
+
+def _build_count_query_template(where: str) -> str:
+    mode = ReplacementCountMode(settings.REPLACER_COUNT_MODE)
+    if mode == ReplacementCountMode.EXISTS:
+        return (
+            """\
+        SELECT count() FROM (
+        SELECT 1
+        FROM %(table_name)s
+    """
+            + where
+            + """\
+        LIMIT 1
+        )
+    """
+        )
+    elif mode == ReplacementCountMode.APPROXIMATE:
+        return (
+            """\
+        SELECT count()
+        FROM %(table_name)s
+    """
+            + where
+        )
+    else:
+        return (
+            """\
+        SELECT count()
+        FROM %(table_name)s FINAL
+    """
+            + where
+        )
+
+
+def _merge_group_ids(group_ids: Sequence[Sequence[int]]) -> Sequence[int]:
+    if len(group_ids) == 1:
+        return group_ids[0]
+
+    return [*dict.fromkeys(chain.from_iterable(group_ids))]
+
+
 def _build_event_tombstone_replacement(
-    message: Mapping[str, Any],
+    key: Tuple[Hashable, ...],
+    parts: Sequence[Any],
     required_columns: Sequence[str],
     where: str,
     query_args: Mapping[str, str],
     query_time_flags: Tuple[Any, ...],
 ) -> Replacement:
     select_columns = map(lambda i: i if i != "deleted" else "1", required_columns)
-    count_query_template = (
-        """\
-        SELECT count()
-        FROM %(table_name)s FINAL
-    """
-        + where
-    )
+    count_query_template = _build_count_query_template(where)
 
     insert_query_template = (
         """\
@@ -233,12 +362,17 @@ def _build_event_tombstone_replacement(
     final_query_args = {
         "required_columns": ", ".join(required_columns),
         "select_columns": ", ".join(select_columns),
-        "project_id": message["project_id"],
+        "project_id": key[1],
     }
     final_query_args.update(query_args)
 
-    return Replacement(
-        count_query_template, insert_query_template, final_query_args, query_time_flags
+    return CoalescableReplacement(
+        count_query_template,
+        insert_query_template,
+        final_query_args,
+        query_time_flags,
+        key,
+        parts,
     )
 
 
@@ -252,22 +386,54 @@ def process_delete_groups(
     assert all(isinstance(gid, int) for gid in group_ids)
     timestamp = datetime.strptime(message["datetime"], settings.PAYLOAD_DATETIME_FORMAT)
 
-    where = """\
+    return build_delete_groups(
+        ("end_delete_groups", message["project_id"]),
+        [(group_ids, timestamp.strftime(DATETIME_FORMAT))],
+        required_columns,
+    )
+
+
+def build_delete_groups(
+    key: Tuple[Hashable, ...],
+    parts: Sequence[Tuple[Sequence[int], str]],
+    required_columns: Sequence[str],
+) -> Replacement:
+    """
+    Builds a replacement that deletes the groups from one or more
+    ``end_delete_groups`` messages for the same project. Each part contains
+    the group IDs and the timestamp from a message.
+    """
+    group_ids = _merge_group_ids([part_group_ids for part_group_ids, _ in parts])
+
+    query_args = {"group_ids": ", ".join(str(gid) for gid in group_ids)}
+
+    if len(parts) == 1:
+        [(_, timestamp)] = parts
+        where = """\
         PREWHERE group_id IN (%(group_ids)s)
         WHERE project_id = %(project_id)s
         AND received <= CAST('%(timestamp)s' AS DateTime)
         AND NOT deleted
     """
+        query_args["timestamp"] = timestamp
+    else:
+        # Each message only deletes the events received before it was sent.
+        where = """\
+        PREWHERE group_id IN (%(group_ids)s)
+        WHERE project_id = %(project_id)s
+        AND (%(conditions)s)
+        AND NOT deleted
+    """
+        query_args["conditions"] = " OR ".join(
+            "(group_id IN (%s) AND received <= CAST('%s' AS DateTime))"
+            % (", ".join(str(gid) for gid in part_group_ids), timestamp)
+            for part_group_ids, timestamp in parts
+        )
 
-    query_args = {
-        "group_ids": ", ".join(str(gid) for gid in group_ids),
-        "timestamp": timestamp.strftime(DATETIME_FORMAT),
-    }
-
-    query_time_flags = (EXCLUDE_GROUPS, message["project_id"], group_ids)
+    query_time_flags = (EXCLUDE_GROUPS, key[1], group_ids)
 
     return _build_event_tombstone_replacement(
-        message, required_columns, where, query_args, query_time_flags
+        key, parts, required_columns, where, query_args, query_time_flags
     )
 
 
@@ -278,6 +444,21 @@ def process_tombstone_events(
     if not event_ids:
         return None
 
+    return build_tombstone_events(
+        ("tombstone_events", message["project_id"]),
+        ["'%s'" % str(uuid.UUID(eid)).replace("-", "") for eid in message["event_ids"]],
+        required_columns,
+    )
+
+
+def build_tombstone_events(
+    key: Tuple[Hashable, ...], parts: Sequence[str], required_columns: Sequence[str],
+) -> Replacement:
+    """
+    Builds a replacement that deletes the events from one or more
+    ``tombstone_events`` messages for the same project. Each part is an
+    event ID, formatted as a string literal.
+    """
     # XXX: We need to construct a query that works on both event_id columns,
     # either represented as UUID or as hyphenless FixedString. That's why we
     # use replaceAll(toString()).
@@ -288,16 +469,13 @@ def process_tombstone_events(
     """
 
     query_args = {
-        "event_ids": ", ".join(
-            "'%s'" % str(uuid.UUID(eid)).replace("-", "")
-            for eid in message["event_ids"]
-        ),
+        "event_ids": ", ".join(dict.fromkeys(parts)),
     }
 
-    query_time_flags = (None, message["project_id"])
+    query_time_flags = (None, key[1])
 
     return _build_event_tombstone_replacement(
-        message, required_columns, where, query_args, query_time_flags
+        key, parts, required_columns, where, query_args, query_time_flags
     )
 
 
@@ -306,8 +484,14 @@ def process_exclude_groups(message: Mapping[str, Any]) -> Optional[Replacement]:
     if not group_ids:
         return None
 
-    query_time_flags = (EXCLUDE_GROUPS, message["project_id"], group_ids)
-    return Replacement(None, None, {}, query_time_flags)
+    return build_exclude_groups(("exclude_groups", message["project_id"]), [group_ids])
+
+
+def build_exclude_groups(
+    key: Tuple[Hashable, ...], parts: Sequence[Sequence[int]]
+) -> Replacement:
+    query_time_flags = (EXCLUDE_GROUPS, key[1], _merge_group_ids(parts))
+    return CoalescableReplacement(None, None, {}, query_time_flags, key, parts)
 
 
 SEEN_MERGE_TXN_CACHE: Deque[str] = deque(maxlen=100)
@@ -331,26 +515,65 @@ def process_merge(
 
     assert all(isinstance(gid, int) for gid in previous_group_ids)
     timestamp = datetime.strptime(message["datetime"], settings.PAYLOAD_DATETIME_FORMAT)
+
+    return build_merge(
+        ("end_merge", message["project_id"], message["new_group_id"]),
+        [(previous_group_ids, timestamp.strftime(DATETIME_FORMAT))],
+        all_columns,
+    )
+
+
+def build_merge(
+    key: Tuple[Hashable, ...],
+    parts: Sequence[Tuple[Sequence[int], str]],
+    all_columns: Sequence[FlattenedColumn],
+) -> Replacement:
+    """
+    Builds a replacement that merges the groups from one or more
+    ``end_merge`` messages for the same project into the same group. Each
+    part contains the previous group IDs and the timestamp from a message.
+    """
+    _, project_id, new_group_id = key
+    previous_group_ids = _merge_group_ids(
+        [part_group_ids for part_group_ids, _ in parts]
+    )
+
     all_column_names = [c.escaped for c in all_columns]
     select_columns = map(
-        lambda i: i if i != "group_id" else str(message["new_group_id"]),
-        all_column_names,
+        lambda i: i if i != "group_id" else str(new_group_id), all_column_names,
     )
 
-    where = """\
+    query_args = {
+        "all_columns": ", ".join(all_column_names),
+        "select_columns": ", ".join(select_columns),
+        "project_id": project_id,
+        "previous_group_ids": ", ".join(str(gid) for gid in previous_group_ids),
+    }
+
+    if len(parts) == 1:
+        [(_, timestamp)] = parts
+        where = """\
         PREWHERE group_id IN (%(previous_group_ids)s)
         WHERE project_id = %(project_id)s
         AND received <= CAST('%(timestamp)s' AS DateTime)
         AND NOT deleted
     """
-
-    count_query_template = (
-        """\
-        SELECT count()
-        FROM %(table_name)s FINAL
+        query_args["timestamp"] = timestamp
+    else:
+        # Each message only merges the events received before it was sent.
+        where = """\
+        PREWHERE group_id IN (%(previous_group_ids)s)
+        WHERE project_id = %(project_id)s
+        AND (%(conditions)s)
+        AND NOT deleted
     """
-        + where
-    )
+        query_args["conditions"] = " OR ".join(
+            "(group_id IN (%s) AND received <= CAST('%s' AS DateTime))"
+            % (", ".join(str(gid) for gid in part_group_ids), timestamp)
+            for part_group_ids, timestamp in parts
+        )
+
+    count_query_template = _build_count_query_template(where)
 
     insert_query_template = (
         """\
@@ -361,18 +584,15 @@ def process_merge(
         + where
     )
 
-    query_args = {
-        "all_columns": ", ".join(all_column_names),
-        "select_columns": ", ".join(select_columns),
-        "project_id": message["project_id"],
-        "previous_group_ids": ", ".join(str(gid) for gid in previous_group_ids),
-        "timestamp": timestamp.strftime(DATETIME_FORMAT),
-    }
-
-    query_time_flags = (EXCLUDE_GROUPS, message["project_id"], previous_group_ids)
+    query_time_flags = (EXCLUDE_GROUPS, project_id, previous_group_ids)
 
-    return Replacement(
-        count_query_template, insert_query_template, query_args, query_time_flags
+    return CoalescableReplacement(
+        count_query_template,
+        insert_query_template,
+        query_args,
+        query_time_flags,
+        key,
+        parts,
     )
 
 
@@ -402,13 +622,7 @@ def process_unmerge(
         AND NOT deleted
     """
 
-    count_query_template = (
-        """\
-        SELECT count()
-        FROM %(table_name)s FINAL
-    """
-        + where
-    )
+    count_query_template = _build_count_query_template(where)
 
     insert_query_template = (
         """\
@@ -515,14 +729,7 @@ def process_delete_tag(
         "timestamp": timestamp.strftime(DATETIME_FORMAT),
     }
 
-    count_query_template = (
-        """\
-        SELECT count()
-        FROM %(table_name)s FINAL
-    """
-        + prewhere
-        + where
-    )
+    count_query_template = _build_count_query_template(prewhere + where)
 
     query_time_flags = (NEEDS_FINAL, message["project_id"])
 
@@ -19,6 +19,7 @@ from snuba.datasets.schemas.tables import TableSource
 from snuba.datasets.storage import QueryStorageSelector, ReadableStorage
 from snuba.query.data_source.simple import Table
 from snuba.query.logical import Query as LogicalQuery
+from snuba.query.processors.fused import execute_processors
 from snuba.query.processors.mandatory_condition_applier import MandatoryConditionApplier
 from snuba.request.request_settings import RequestSettings
 
@@ -48,11 +49,7 @@ class SimpleQueryPlanExecutionStrategy(QueryPlanExecutionStrategy[Query]):
         def process_and_run_query(
             query: Query, request_settings: RequestSettings
         ) -> QueryResult:
-            for processor in self.__query_processors:
-                with sentry_sdk.start_span(
-                    description=type(processor).__name__, op="processor"
-                ):
-                    processor.process_query(query, request_settings)
+            execute_processors(self.__query_processors, query, request_settings)
             return runner(query, request_settings, self.__cluster.get_reader())
 
         use_split = state.get_config("use_split", 1)
@@ -1,6 +1,7 @@
 from abc import ABC, abstractmethod
 from typing import NamedTuple, Optional, Sequence
 
+from snuba.clickhouse.http import InsertFormat
 from snuba.clickhouse.processors import QueryProcessor
 from snuba.clickhouse.translators.snuba.mapping import TranslationMappers
 from snuba.clusters.cluster import (
@@ -130,6 +131,7 @@ class WritableTableStorage(ReadableTableStorage, WritableStorage):
         query_splitters: Optional[Sequence[QuerySplitStrategy]] = None,
         replacer_processor: Optional[ReplacerProcessor] = None,
         writer_options: ClickhouseWriterOptions = None,
+        insert_format: InsertFormat = InsertFormat.JSON_EACH_ROW,
     ) -> None:
         super().__init__(
             storage_key, storage_set_key, schema, query_processors, query_splitters
@@ -141,6 +143,7 @@ class WritableTableStorage(ReadableTableStorage, WritableStorage):
             stream_loader=stream_loader,
             replacer_processor=replacer_processor,
             writer_options=writer_options,
+            insert_format=insert_format,
         )
 
     def get_table_writer(self) -> TableWriter:
@@ -1,15 +1,18 @@
 from snuba.clickhouse.processors import QueryProcessor
 from snuba.clickhouse.query import Query
 from snuba.query.expressions import Column, Expression, FunctionCall, Literal
+from snuba.query.processors.fused import ExpressionProcessor, ExpressionTransformer
 from snuba.request.request_settings import RequestSettings
 
 
-class EventIdColumnProcessor(QueryProcessor):
+class EventIdColumnProcessor(ExpressionProcessor[Query], QueryProcessor):
     """
     Strip any dashes out of the event ID to match what is stored internally.
     """
 
-    def process_query(self, query: Query, request_settings: RequestSettings) -> None:
+    def get_expression_transformer(
+        self, query: Query, request_settings: RequestSettings
+    ) -> ExpressionTransformer:
         def process_column(exp: Expression) -> Expression:
             if isinstance(exp, Column):
                 if exp.column_name == "event_id":
@@ -27,4 +30,4 @@ class EventIdColumnProcessor(QueryProcessor):
 
             return exp
 
-        query.transform_expressions(process_column)
+        return process_column
@@ -8,10 +8,11 @@ from snuba.query.expressions import Expression
 from snuba.query.expressions import FunctionCall as FunctionCallExpr
 from snuba.query.expressions import Literal
 from snuba.query.matchers import Column, FunctionCall, Or, String
+from snuba.query.processors.fused import ExpressionProcessor, ExpressionTransformer
 from snuba.request.request_settings import RequestSettings
 
 
-class EventsBooleanContextsProcessor(QueryProcessor):
+class EventsBooleanContextsProcessor(ExpressionProcessor[Query], QueryProcessor):
     """
     When Discover started using contexts it turned out that, if we return
     promoted contexts through the contexts[...] syntax we have an inconsistency
@@ -30,7 +31,9 @@ class EventsBooleanContextsProcessor(QueryProcessor):
     patch to the events storage for as long as it exists.
     """
 
-    def process_query(self, query: Query, request_settings: RequestSettings) -> None:
+    def get_expression_transformer(
+        self, query: Query, request_settings: RequestSettings
+    ) -> ExpressionTransformer:
         # We care only of promoted contexts, so we do not need to match
         # the original nested expression.
         matcher = FunctionCall(
@@ -73,4 +76,4 @@ class EventsBooleanContextsProcessor(QueryProcessor):
                 )
             return exp
 
-        query.transform_expressions(replace_exp)
+        return replace_exp
@@ -1,11 +1,14 @@
 from snuba.clickhouse.processors import QueryProcessor
 from snuba.clickhouse.query import Query
 from snuba.query.expressions import Column, Expression, FunctionCall, Literal
+from snuba.query.processors.fused import ExpressionProcessor, ExpressionTransformer
 from snuba.request.request_settings import RequestSettings
 
 
-class GroupIdColumnProcessor(QueryProcessor):
-    def process_query(self, query: Query, request_settings: RequestSettings) -> None:
+class GroupIdColumnProcessor(ExpressionProcessor[Query], QueryProcessor):
+    def get_expression_transformer(
+        self, query: Query, request_settings: RequestSettings
+    ) -> ExpressionTransformer:
         def process_column(exp: Expression) -> Expression:
             if isinstance(exp, Column):
                 if exp.column_name == "group_id":
@@ -20,4 +23,4 @@ class GroupIdColumnProcessor(QueryProcessor):
 
             return exp
 
-        query.transform_expressions(process_column)
+        return process_column
@@ -2,7 +2,8 @@ from dataclasses import dataclass
 from typing import Any, Mapping, Optional, Sequence
 
 from snuba import settings
-from snuba.clickhouse.http import JSONRow
+from snuba.clickhouse.http import InsertFormat, JSONRow, JSONRowEncoder
+from snuba.clickhouse.rowbinary import RowBinaryEncoder, get_insert_columns
 from snuba.clusters.cluster import (
     ClickhouseClientSettings,
     ClickhouseCluster,
@@ -16,9 +17,10 @@ from snuba.replacers.replacer_processor import ReplacerProcessor
 from snuba.snapshots import BulkLoadSource
 from snuba.snapshots.loaders import BulkLoader
 from snuba.snapshots.loaders.single_table import RowProcessor, SingleTableBulkLoader
+from snuba.utils.codecs import Encoder
 from snuba.utils.metrics import MetricsBackend
 from snuba.utils.streams.backends.kafka import KafkaPayload
-from snuba.writer import BatchWriter
+from snuba.writer import BatchWriter, WriterTableRow
 
 
 @dataclass(frozen=True)
@@ -157,12 +159,20 @@ class TableWriter:
         stream_loader: KafkaStreamLoader,
         replacer_processor: Optional[ReplacerProcessor] = None,
         writer_options: ClickhouseWriterOptions = None,
+        insert_format: InsertFormat = InsertFormat.JSON_EACH_ROW,
     ) -> None:
         self.__cluster = cluster
         self.__table_schema = write_schema
         self.__stream_loader = stream_loader
         self.__replacer_processor = replacer_processor
         self.__writer_options = writer_options
+        self.__insert_format = insert_format
+
+        self.__row_encoder: Encoder[JSONRow, WriterTableRow]
+        if insert_format is InsertFormat.ROW_BINARY:
+            self.__row_encoder = RowBinaryEncoder(write_schema.get_columns())
+        else:
+            self.__row_encoder = JSONRowEncoder()
 
     def get_schema(self) -> WritableTableSchema:
         return self.__table_schema
@@ -174,14 +184,36 @@ class TableWriter:
         table_name=None,
         chunk_size: int = settings.CLICKHOUSE_HTTP_CHUNK_SIZE,
     ) -> BatchWriter[JSONRow]:
+        """
+        Returns a writer that expects rows encoded by the encoder returned
+        by ``get_row_encoder``.
+        """
         table_name = table_name or self.__table_schema.get_table_name()
 
         options = self.__update_writer_options(options)
 
+        columns = (
+            get_insert_columns(self.__table_schema.get_columns())
+            if self.__insert_format is InsertFormat.ROW_BINARY
+            else None
+        )
+
         return self.__cluster.get_batch_writer(
-            table_name, metrics, options, chunk_size=chunk_size,
+            table_name,
+            metrics,
+            options,
+            chunk_size=chunk_size,
+            insert_format=self.__insert_format,
+            columns=columns,
         )
 
+    def get_row_encoder(self) -> Encoder[JSONRow, WriterTableRow]:
+        """
+        Returns the encoder that serializes processed rows in the format
+        the batch writer of this table sends to Clickhouse.
+        """
+        return self.__row_encoder
+
     def get_bulk_loader(
         self,
         source: BulkLoadSource,
@@ -2,7 +2,6 @@ from __future__ import annotations
 
 from typing import Mapping, NamedTuple, Optional, Sequence, Tuple, Union
 
-import sentry_sdk
 from snuba.clickhouse.processors import QueryProcessor
 from snuba.clickhouse.query import Query as ClickhouseQuery
 from snuba.clusters.cluster import ClickhouseCluster, get_cluster
@@ -23,6 +22,7 @@ from snuba.query.data_source.join import IndividualNode, JoinClause, JoinVisitor
 from snuba.query.data_source.simple import Entity, Table
 from snuba.query.data_source.visitor import DataSourceVisitor
 from snuba.query.logical import Query as LogicalQuery
+from snuba.query.processors.fused import execute_processors
 from snuba.request.request_settings import RequestSettings
 from snuba.web import QueryResult
 
@@ -356,11 +356,7 @@ class ProcessorsExecutor(DataSourceVisitor[None, Table], JoinVisitor[None, Table
     def __process_simple_query(
         self, clickhouse_query: ClickhouseQuery, processors: Sequence[QueryProcessor]
     ) -> None:
-        for clickhouse_processor in processors:
-            with sentry_sdk.start_span(
-                description=type(clickhouse_processor).__name__, op="processor"
-            ):
-                clickhouse_processor.process_query(clickhouse_query, self.__settings)
+        execute_processors(processors, clickhouse_query, self.__settings)
 
     def _visit_simple_source(self, data_source: Table) -> None:
         # We are never supposed to get here.
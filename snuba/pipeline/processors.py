@@ -1,10 +1,11 @@
-from typing import Callable, Sequence
+from typing import Callable, Sequence, cast
 
-import sentry_sdk
 from snuba.clickhouse.processors import QueryProcessor
+from snuba.clickhouse.query import Query
 from snuba.datasets.entities.factory import get_entity
 from snuba.datasets.plans.query_plan import ClickhouseQueryPlan
 from snuba.query.logical import Query as LogicalQuery
+from snuba.query.processors.fused import execute_processors
 from snuba.request.request_settings import RequestSettings
 
 
@@ -22,11 +23,8 @@ def _execute_clickhouse_processors(
     execution strategy to be executed at every database query.
     This function can be used in either case by customizing the sequence.
     """
-    for clickhouse_processor in processors(query_plan):
-        with sentry_sdk.start_span(
-            description=type(clickhouse_processor).__name__, op="processor"
-        ):
-            clickhouse_processor.process_query(query_plan.query, settings)
+    # The query type of the plan is not inferred by mypy.
+    execute_processors(processors(query_plan), cast(Query, query_plan.query), settings)
 
 
 def execute_plan_processors(
@@ -67,8 +65,4 @@ def execute_entity_processors(query: LogicalQuery, settings: RequestSettings) ->
     """
     entity = get_entity(query.get_from_clause().key)
 
-    for processor in entity.get_query_processors():
-        with sentry_sdk.start_span(
-            description=type(processor).__name__, op="processor"
-        ):
-            processor.process_query(query, settings)
+    execute_processors(entity.get_query_processors(), query, settings)
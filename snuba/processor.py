@@ -5,6 +5,7 @@ from datetime import datetime, timedelta
 from hashlib import md5
 from typing import Any, NamedTuple, Optional, Sequence, Union
 
+import rapidjson
 import simplejson as json
 
 from snuba.util import force_bytes
@@ -39,6 +40,22 @@ class MessageProcessor(ABC):
     def process_message(self, message, metadata) -> Optional[ProcessedMessage]:
         raise NotImplementedError
 
+    def process_batch(
+        self, values: Sequence[bytes], metadata: Sequence[Any]
+    ) -> Sequence[Optional[ProcessedMessage]]:
+        """
+        Process a batch of raw (JSON encoded) message values, returning one
+        result for each value, in the same order.
+
+        By default, each value is decoded and processed individually with
+        ``process_message``. Processors can override this to amortize the
+        cost of decoding and processing across the batch.
+        """
+        return [
+            self.process_message(rapidjson.loads(value), value_metadata)
+            for value, value_metadata in zip(values, metadata)
+        ]
+
 
 class InvalidMessageType(Exception):
     pass
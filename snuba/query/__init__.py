@@ -1,11 +1,13 @@
 from __future__ import annotations
 
 from abc import ABC, abstractmethod
+from copy import deepcopy
 from dataclasses import dataclass, replace
 from enum import Enum
 from itertools import chain
 from typing import (
     Callable,
+    Dict,
     Generic,
     Iterable,
     Optional,
@@ -56,6 +58,9 @@ class SelectedExpression:
 TExp = TypeVar("TExp", bound=Expression)
 
 
+TQuery = TypeVar("TQuery", bound="Query")
+
+
 class Query(DataSource, ABC):
     """
     The representation of a query in Snuba.
@@ -111,6 +116,19 @@ class Query(DataSource, ABC):
         self.__totals = totals
         self.__granularity = granularity
 
+    def __deepcopy__(self: TQuery, memo: Dict[int, object]) -> TQuery:
+        """
+        Copies the query without copying its expressions. Expressions
+        and simple data sources are immutable and are shared between the
+        copies, so only the containers that hold them (like the list of
+        selected columns) and the nested queries are actually copied.
+        """
+        copied = self.__class__.__new__(self.__class__)
+        memo[id(self)] = copied
+        for name, value in self.__dict__.items():
+            copied.__dict__[name] = deepcopy(value, memo)
+        return copied
+
     def get_columns(self) -> ColumnSet:
         """
         From the DataSource class. It returns the schema exposed by this
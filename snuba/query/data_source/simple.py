@@ -1,6 +1,8 @@
+from __future__ import annotations
+
 from abc import ABC
 from dataclasses import dataclass, field
-from typing import Optional, Sequence
+from typing import Any, Dict, Optional, Sequence
 
 from snuba.clickhouse.columns import ColumnSet
 from snuba.datasets.entities import EntityKey
@@ -15,12 +17,18 @@ class SimpleDataSource(DataSource, ABC):
     RelationalSources (tables) are simple data sources while nested
     queries and joins are not SimpleDataSources.
 
-    This class does not add anything but it is useful to define
-    subclasses of the Query class that can only reference simple
-    data sources.
+    This class is useful to define subclasses of the Query class that
+    can only reference simple data sources.
     """
 
-    pass
+    def __copy__(self) -> SimpleDataSource:
+        return self
+
+    def __deepcopy__(self, memo: Dict[int, Any]) -> SimpleDataSource:
+        # Simple data sources are immutable and their schema is shared by
+        # every query on the same entity or table, so copies of a query do
+        # not need to copy them.
+        return self
 
 
 @dataclass(frozen=True)
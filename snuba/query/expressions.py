@@ -4,7 +4,9 @@ from abc import ABC, abstractmethod
 from dataclasses import dataclass, replace
 from datetime import date, datetime
 from typing import (
+    Any,
     Callable,
+    Dict,
     Generic,
     Iterator,
     Optional,
@@ -54,6 +56,18 @@ class Expression(ABC):
         """
         raise NotImplementedError
 
+    def __copy__(self) -> Expression:
+        return self
+
+    def __deepcopy__(self, memo: Dict[int, Any]) -> Expression:
+        """
+        Expressions are immutable, so a copy of a query can share the
+        expression trees with the original one instead of copying every
+        node. Copying a query is then proportional to the number of root
+        expressions in the query rather than to the size of its trees.
+        """
+        return self
+
     @abstractmethod
     def accept(self, visitor: ExpressionVisitor[TVisited]) -> TVisited:
         """
@@ -3,6 +3,7 @@ from __future__ import annotations
 from typing import (
     Any,
     Callable,
+    Dict,
     Iterable,
     Mapping,
     MutableMapping,
@@ -76,6 +77,13 @@ class Query(AbstractQuery[Entity]):
             granularity=granularity,
         )
 
+    def __deepcopy__(self, memo: Dict[int, Any]) -> Query:
+        # The legacy body is never changed once the query is parsed, so it
+        # is shared by the copies instead of being copied with the rest of
+        # the query.
+        memo[id(self.__body)] = self.__body
+        return super().__deepcopy__(memo)
+
     def get_final(self) -> bool:
         return self.__final
 
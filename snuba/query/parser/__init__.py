@@ -1,13 +1,17 @@
+import copy
 import logging
 import re
 from dataclasses import replace
 from typing import Any, List, Mapping, MutableMapping, Optional, Sequence, Tuple, Union
 
-from snuba import environment
+import rapidjson
+
+from snuba import environment, settings
 from snuba.clickhouse.escaping import NEGATE_RE
 from snuba.datasets.dataset import Dataset
 from snuba.datasets.entities.factory import get_entity
 from snuba.datasets.entity import Entity
+from snuba.datasets.factory import get_dataset_name
 from snuba.query import (
     LimitBy,
     OrderBy,
@@ -30,6 +34,7 @@ from snuba.query.expressions import (
 from snuba.query.logical import Query
 from snuba.query.matchers import FunctionCall as FunctionCallMatch
 from snuba.query.matchers import String as StringMatch
+from snuba.query.parser.cache import ParsedQueryCache
 from snuba.query.parser.conditions import parse_conditions_to_expr
 from snuba.query.parser.exceptions import (
     AliasShadowingException,
@@ -38,6 +43,7 @@ from snuba.query.parser.exceptions import (
 )
 from snuba.query.parser.expressions import parse_aggregation, parse_expression
 from snuba.query.parser.validation import validate_query
+from snuba.state import get_config
 from snuba.util import is_function, to_list, tuplify
 from snuba.utils.metrics.wrapper import MetricsWrapper
 
@@ -45,6 +51,10 @@ logger = logging.getLogger(__name__)
 
 metrics = MetricsWrapper(environment.metrics, "parser")
 
+_parsed_query_cache: ParsedQueryCache[Query] = ParsedQueryCache(
+    settings.PARSED_QUERY_CACHE_SIZE
+)
+
 
 def parse_query(body: MutableMapping[str, Any], dataset: Dataset) -> Query:
     """
@@ -72,7 +82,37 @@ def parse_query(body: MutableMapping[str, Any], dataset: Dataset) -> Query:
       References to aliases are reintroduced at the end of the query
       processing.
       Alias references are packaged back at the end of processing.
+
+    Parsed queries are cached, so parsing the same body again only copies
+    the query parsed the first time.
     """
+    try:
+        # The parser depends on the ``format_clickhouse_arrays`` runtime
+        # config, which is part of the key like the dataset.
+        key = rapidjson.dumps(
+            [
+                get_dataset_name(dataset),
+                get_config("format_clickhouse_arrays", 1),
+                body,
+            ],
+            sort_keys=True,
+        )
+    except (TypeError, ValueError):
+        # Bodies that cannot be encoded as JSON are never cached.
+        return _parse_query(body, dataset)
+
+    cached = _parsed_query_cache.get(key)
+    if cached is not None:
+        metrics.increment("parsed_query_cache.hit", tags={"parser": "legacy"})
+        return copy.deepcopy(cached)
+
+    metrics.increment("parsed_query_cache.miss", tags={"parser": "legacy"})
+    query = _parse_query(body, dataset)
+    _parsed_query_cache.set(key, copy.deepcopy(query))
+    return query
+
+
+def _parse_query(body: MutableMapping[str, Any], dataset: Dataset) -> Query:
     # TODO: Parse the entity out of the query body and select the correct one from the dataset
     entity = dataset.get_default_entity()
 
@@ -0,0 +1,43 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Generic, Optional, TypeVar
+
+TValue = TypeVar("TValue")
+
+
+class ParsedQueryCache(Generic[TValue]):
+    """
+    Keeps the most recently used parsed queries (or the templates they are
+    built from) in process memory. The least recently used entry is evicted
+    once ``max_size`` entries are stored. A cache with a ``max_size`` of 0
+    never stores anything.
+
+    The cache does not copy the values it stores: callers are responsible
+    for never handing out (or modifying) a stored query.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self.__max_size = max_size
+        self.__lock = Lock()
+        self.__entries: OrderedDict[str, TValue] = OrderedDict()
+
+    def get(self, key: str) -> Optional[TValue]:
+        with self.__lock:
+            value = self.__entries.get(key)
+            if value is not None:
+                self.__entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: TValue) -> None:
+        if self.__max_size <= 0:
+            return
+
+        with self.__lock:
+            self.__entries[key] = value
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.__max_size:
+                self.__entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__entries.clear()
@@ -8,17 +8,20 @@ from snuba.query.expressions import (
 )
 from snuba.query.logical import Query
 from snuba.query.processors import QueryProcessor
+from snuba.query.processors.fused import ExpressionProcessor, ExpressionTransformer
 from snuba.request.request_settings import RequestSettings
 
 
-class BasicFunctionsProcessor(QueryProcessor):
+class BasicFunctionsProcessor(ExpressionProcessor[Query], QueryProcessor):
     """
     Mimics the ad hoc function processing that happens today in utils.function_expr.
 
     This exists only to preserve the current Snuba syntax and only works on the new AST.
     """
 
-    def process_query(self, query: Query, request_settings: RequestSettings) -> None:
+    def get_expression_transformer(
+        self, query: Query, request_settings: RequestSettings
+    ) -> ExpressionTransformer:
         def process_functions(exp: Expression) -> Expression:
             if isinstance(exp, FunctionCall):
                 if exp.function_name == "uniq":
@@ -43,4 +46,4 @@ class BasicFunctionsProcessor(QueryProcessor):
                     )
             return exp
 
-        query.transform_expressions(process_functions)
+        return process_functions
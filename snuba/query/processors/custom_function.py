@@ -7,6 +7,7 @@ from snuba.query.expressions import Column, Expression, FunctionCall, Literal
 from snuba.query.logical import Query
 from snuba.query.parser.expressions import parse_clickhouse_function
 from snuba.query.processors import QueryProcessor
+from snuba.query.processors.fused import ExpressionProcessor, ExpressionTransformer
 from snuba.query.validation import InvalidFunctionCall
 from snuba.query.validation.signature import ParamType, SignatureValidator
 from snuba.request.request_settings import RequestSettings
@@ -38,7 +39,7 @@ def partial_function(body: str, constants: Sequence[Tuple[str, Any]]) -> Express
     return replace_in_expression(parsed, constants_lookup)
 
 
-class CustomFunction(QueryProcessor):
+class CustomFunction(ExpressionProcessor[Query], QueryProcessor):
     """
     Defines a custom snuba function.
     The custom function has a name, a signature in the form of a list of
@@ -84,7 +85,9 @@ class CustomFunction(QueryProcessor):
         self.__body = body
         self.__validator = SignatureValidator(param_types)
 
-    def process_query(self, query: Query, request_settings: RequestSettings) -> None:
+    def get_expression_transformer(
+        self, query: Query, request_settings: RequestSettings
+    ) -> ExpressionTransformer:
         def apply_function(expression: Expression) -> Expression:
             if (
                 isinstance(expression, FunctionCall)
@@ -112,4 +115,4 @@ class CustomFunction(QueryProcessor):
             else:
                 return expression
 
-        query.transform_expressions(apply_function)
+        return apply_function
@@ -0,0 +1,155 @@
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, Generic, List, Sequence, TypeVar
+
+import sentry_sdk
+from typing_extensions import Protocol
+
+from snuba import environment
+from snuba.query import Query
+from snuba.query.expressions import Expression
+from snuba.request.request_settings import RequestSettings
+from snuba.state import get_config
+from snuba.utils.metrics.wrapper import MetricsWrapper
+
+metrics = MetricsWrapper(environment.metrics, "query_processor")
+
+TQuery = TypeVar("TQuery", bound=Query)
+TProcessedQuery = TypeVar("TProcessedQuery", bound=Query, contravariant=True)
+
+ExpressionTransformer = Callable[[Expression], Expression]
+
+
+class Processor(Protocol[TProcessedQuery]):
+    """
+    Any processor that transforms a query in place. Both the logical and
+    the Clickhouse query processors satisfy this protocol.
+    """
+
+    def process_query(
+        self, query: TProcessedQuery, request_settings: RequestSettings
+    ) -> None:
+        raise NotImplementedError
+
+
+class ExpressionProcessor(ABC, Generic[TQuery]):
+    """
+    A query processor that only rewrites the expressions of the query one
+    at a time, through the query `transform_expressions` method.
+
+    Consecutive expression processors are executed by `execute_processors`
+    in a single traversal of the query where, at every node, each processor
+    is applied to the output of the previous one. This is equivalent to
+    running them one after the other as long as they are independent, as
+    query processors are already required to be. Specifically a processor
+    must not rewrite the expressions produced by another processor, other
+    than their root, and the transformer must not depend on the rest of
+    the query, which may be partially processed when it is called.
+    """
+
+    @abstractmethod
+    def get_expression_transformer(
+        self, query: TQuery, request_settings: RequestSettings
+    ) -> ExpressionTransformer:
+        """
+        Returns the function that rewrites a single expression of the query.
+        """
+        raise NotImplementedError
+
+    def process_query(self, query: TQuery, request_settings: RequestSettings) -> None:
+        query.transform_expressions(
+            self.get_expression_transformer(query, request_settings)
+        )
+
+
+class FusedExpressionProcessor(Generic[TQuery]):
+    """
+    Applies a sequence of expression processors with a single traversal
+    of the query. The time spent in each processor is recorded
+    separately from the time spent traversing the query.
+    """
+
+    def __init__(self, processors: Sequence[ExpressionProcessor[TQuery]]) -> None:
+        self.__processors = processors
+
+    def process_query(self, query: TQuery, request_settings: RequestSettings) -> None:
+        transformers = [
+            processor.get_expression_transformer(query, request_settings)
+            for processor in self.__processors
+        ]
+        durations = [0.0] * len(transformers)
+        clock = time.perf_counter
+
+        def transform(exp: Expression) -> Expression:
+            for index, transformer in enumerate(transformers):
+                start = clock()
+                exp = transformer(exp)
+                durations[index] += clock() - start
+            return exp
+
+        query.transform_expressions(transform)
+
+        for processor, duration in zip(self.__processors, durations):
+            _record_duration(type(processor).__name__, duration, fused=True)
+
+
+def _fuse_processors(
+    processors: Sequence[Processor[TQuery]],
+) -> Sequence[Processor[TQuery]]:
+    """
+    Replaces each run of consecutive expression processors with a
+    FusedExpressionProcessor.
+    """
+    ret: List[Processor[TQuery]] = []
+    pending: List[ExpressionProcessor[TQuery]] = []
+
+    def flush() -> None:
+        if len(pending) == 1:
+            ret.append(pending[0])
+        elif pending:
+            ret.append(FusedExpressionProcessor(list(pending)))
+        pending.clear()
+
+    for processor in processors:
+        if isinstance(processor, ExpressionProcessor):
+            pending.append(processor)
+        else:
+            flush()
+            ret.append(processor)
+    flush()
+
+    return ret
+
+
+def _record_duration(name: str, duration: float, fused: bool) -> None:
+    metrics.timing(
+        "duration",
+        duration * 1000,
+        tags={"processor": name, "fused": "true" if fused else "false"},
+    )
+
+
+def execute_processors(
+    processors: Sequence[Processor[TQuery]],
+    query: TQuery,
+    request_settings: RequestSettings,
+) -> None:
+    """
+    Executes a sequence of query processors in order on the query and
+    records how long each of them takes.
+
+    Consecutive expression processors are applied together in a single
+    traversal of the query unless the `fuse_expression_processors` runtime
+    config is set to 0.
+    """
+    to_execute = (
+        _fuse_processors(processors)
+        if get_config("fuse_expression_processors", 1)
+        else processors
+    )
+    for processor in to_execute:
+        name = type(processor).__name__
+        with sentry_sdk.start_span(description=name, op="processor"):
+            start = time.perf_counter()
+            processor.process_query(query, request_settings)
+            _record_duration(name, time.perf_counter() - start, fused=False)
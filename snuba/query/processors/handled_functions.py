@@ -12,6 +12,7 @@ from snuba.query.expressions import (
 )
 from snuba.query.logical import Query
 from snuba.query.processors import QueryProcessor
+from snuba.query.processors.fused import ExpressionProcessor, ExpressionTransformer
 from snuba.query.conditions import (
     BooleanFunctions,
     ConditionFunctions,
@@ -20,7 +21,7 @@ from snuba.query.conditions import (
 from snuba.request.request_settings import RequestSettings
 
 
-class HandledFunctionsProcessor(QueryProcessor):
+class HandledFunctionsProcessor(ExpressionProcessor[Query], QueryProcessor):
     """
     Adds the isHandled and notHandled snuba functions.
 
@@ -47,7 +48,9 @@ class HandledFunctionsProcessor(QueryProcessor):
                 exp, f"Illegal function call to {exp.function_name}: {str(err)}"
             ) from err
 
-    def process_query(self, query: Query, request_settings: RequestSettings) -> None:
+    def get_expression_transformer(
+        self, query: Query, request_settings: RequestSettings
+    ) -> ExpressionTransformer:
         def process_functions(exp: Expression) -> Expression:
             if isinstance(exp, FunctionCall):
                 if exp.function_name == "isHandled":
@@ -108,4 +111,4 @@ class HandledFunctionsProcessor(QueryProcessor):
                     )
             return exp
 
-        query.transform_expressions(process_functions)
+        return process_functions
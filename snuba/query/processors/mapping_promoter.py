@@ -10,6 +10,7 @@ from snuba.clickhouse.translators.snuba.mappers import (
     mapping_pattern,
 )
 from snuba.query.expressions import Column, Expression, FunctionCall
+from snuba.query.processors.fused import ExpressionProcessor, ExpressionTransformer
 from snuba.request.request_settings import RequestSettings
 
 
@@ -64,7 +65,7 @@ def match_subscriptable_reference(exp: Expression) -> Optional[SubscriptableMatc
     )
 
 
-class MappingColumnPromoter(QueryProcessor):
+class MappingColumnPromoter(ExpressionProcessor[Query], QueryProcessor):
     """
     Promotes expressions that access the value of a mapping column by
     replacing them with the corresponding promoted column provided in
@@ -85,7 +86,9 @@ class MappingColumnPromoter(QueryProcessor):
         # column name.
         self.__specs = mapping_specs
 
-    def process_query(self, query: Query, request_settings: RequestSettings) -> None:
+    def get_expression_transformer(
+        self, query: Query, request_settings: RequestSettings
+    ) -> ExpressionTransformer:
         def transform_nested_column(exp: Expression) -> Expression:
             subscript = match_subscriptable_reference(exp)
             if subscript is None:
@@ -124,4 +127,4 @@ class MappingColumnPromoter(QueryProcessor):
 
             return exp
 
-        query.transform_expressions(transform_nested_column)
+        return transform_nested_column
@@ -5,10 +5,11 @@ from snuba.query.expressions import Expression
 from snuba.query.logical import Query
 from snuba.query.matchers import Pattern, MatchResult
 from snuba.query.processors import QueryProcessor
+from snuba.query.processors.fused import ExpressionProcessor, ExpressionTransformer
 from snuba.request.request_settings import RequestSettings
 
 
-class PatternReplacer(QueryProcessor):
+class PatternReplacer(ExpressionProcessor[Query], QueryProcessor):
     """
     Define a processor that matches specific expressions and replaces them
     """
@@ -21,7 +22,9 @@ class PatternReplacer(QueryProcessor):
         self.__matcher = matcher
         self.__transformation_fn = transformation_fn
 
-    def process_query(self, query: Query, request_settings: RequestSettings) -> None:
+    def get_expression_transformer(
+        self, query: Query, request_settings: RequestSettings
+    ) -> ExpressionTransformer:
         def apply_matcher(expression: Expression) -> Expression:
             result = self.__matcher.match(expression)
             if result is not None:
@@ -30,4 +33,4 @@ class PatternReplacer(QueryProcessor):
 
             return expression
 
-        query.transform_expressions(apply_matcher)
+        return apply_matcher
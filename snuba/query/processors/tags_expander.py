@@ -3,10 +3,11 @@ from dataclasses import replace
 from snuba.query.expressions import Column, Expression, FunctionCall
 from snuba.query.logical import Query
 from snuba.query.processors import QueryProcessor
+from snuba.query.processors.fused import ExpressionProcessor, ExpressionTransformer
 from snuba.request.request_settings import RequestSettings
 
 
-class TagsExpanderProcessor(QueryProcessor):
+class TagsExpanderProcessor(ExpressionProcessor[Query], QueryProcessor):
     """
     Transforms the special syntax we provide to expand the tags column into a call
     to arrayJoin so that, after this query processor, tags_key and tags_value special
@@ -14,7 +15,9 @@ class TagsExpanderProcessor(QueryProcessor):
     valid column name.
     """
 
-    def process_query(self, query: Query, request_settings: RequestSettings) -> None:
+    def get_expression_transformer(
+        self, query: Query, request_settings: RequestSettings
+    ) -> ExpressionTransformer:
         def transform_expression(exp: Expression) -> Expression:
             # This is intentionally not configurable in order to discourage creating
             # a special syntax for expressions that should be function calls.
@@ -35,4 +38,4 @@ class TagsExpanderProcessor(QueryProcessor):
                 )
             return exp
 
-        query.transform_expressions(transform_expression)
+        return transform_expression
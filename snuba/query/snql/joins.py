@@ -2,6 +2,7 @@ from __future__ import annotations
 from typing import MutableMapping, NamedTuple, Optional, Sequence, Union
 
 from snuba.datasets.entities import EntityKey
+from snuba.datasets.entities.factory import get_entity
 from snuba.query.data_source.join import (
     IndividualNode,
     JoinClause,
@@ -20,6 +21,30 @@ class RelationshipTuple(NamedTuple):
     data: JoinRelationship
 
 
+def build_relationship_tuple(
+    lhs: IndividualNode[QueryEntity],
+    relationship: str,
+    rhs: IndividualNode[QueryEntity],
+) -> RelationshipTuple:
+    """
+    Validates that the relationship joins the two entities of the nodes.
+    """
+    assert isinstance(lhs.data_source, QueryEntity)
+    assert isinstance(rhs.data_source, QueryEntity)
+    lhs_entity = get_entity(lhs.data_source.key)
+    data = lhs_entity.get_join_relationship(relationship)
+    if data is None:
+        raise ParsingException(
+            f"{lhs.data_source.key.value} does not have a join relationship {relationship}"
+        )
+    elif data.rhs_entity != rhs.data_source.key:
+        raise ParsingException(
+            f"-[{relationship}]-> cannot be used to join {lhs.data_source.key.value} to {rhs.data_source.key.value}"
+        )
+
+    return RelationshipTuple(lhs, relationship, rhs, data)
+
+
 class Node:
     """
     This class is a linked list of entities to join together. Each Node holds its own IndividualNode
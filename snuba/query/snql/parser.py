@@ -1,3 +1,6 @@
+import copy
+import re
+from dataclasses import replace
 from typing import (
     Any,
     Callable,
@@ -13,6 +16,7 @@ from typing import (
 
 from parsimonious.grammar import Grammar
 from parsimonious.nodes import Node, NodeVisitor
+from snuba import settings
 from snuba.datasets.dataset import Dataset
 from snuba.datasets.entities import EntityKey
 from snuba.datasets.entities.factory import get_entity
@@ -58,7 +62,9 @@ from snuba.query.parser import (
     _mangle_aliases,
     _parse_subscriptables,
     _validate_aliases,
+    metrics,
 )
+from snuba.query.parser.cache import ParsedQueryCache
 from snuba.query.parser.exceptions import ParsingException
 from snuba.query.snql.expression_visitor import (
     HighPriArithmetic,
@@ -85,7 +91,10 @@ from snuba.query.snql.expression_visitor import (
 from snuba.query.snql.joins import (
     RelationshipTuple,
     build_join_clause,
+    build_relationship_tuple,
 )
+from snuba.query.snql.recursive_descent import parse_snql_query_recursive_descent
+from snuba.state import get_config
 from snuba.util import parse_datetime
 
 snql_grammar = Grammar(
@@ -213,6 +222,12 @@ class SnQLVisitor(NodeVisitor):
             if isinstance(args[k], Node):
                 del args[k]
 
+        if "groupby" in args:
+            if "selected_columns" not in args:
+                args["selected_columns"] = []
+            args["selected_columns"] += args["groupby"]
+            args["groupby"] = [gb.expression for gb in args["groupby"]]
+
         if isinstance(data_source, (CompositeQuery, LogicalQuery, JoinClause)):
             args["from_clause"] = data_source
             return CompositeQuery(**args)
@@ -222,12 +237,6 @@ class SnQLVisitor(NodeVisitor):
             # TODO: How sample rate gets stored needs to be addressed in a future PR
             args["sample"] = data_source.sample
 
-        if "groupby" in args:
-            if "selected_columns" not in args:
-                args["selected_columns"] = []
-            args["selected_columns"] += args["groupby"]
-            args["groupby"] = map(lambda gb: gb.expression, args["groupby"])
-
         return LogicalQuery(**args)
 
     def visit_match_clause(
@@ -328,20 +337,7 @@ class SnQLVisitor(NodeVisitor):
         ],
     ) -> RelationshipTuple:
         _, lhs, _, relationship, _, rhs = visited_children
-        assert isinstance(lhs.data_source, QueryEntity)
-        assert isinstance(rhs.data_source, QueryEntity)
-        lhs_entity = get_entity(lhs.data_source.key)
-        data = lhs_entity.get_join_relationship(relationship)
-        if data is None:
-            raise ParsingException(
-                f"{lhs.data_source.key.value} does not have a join relationship {relationship}"
-            )
-        elif data.rhs_entity != rhs.data_source.key:
-            raise ParsingException(
-                f"-[{relationship}]-> cannot be used to join {lhs.data_source.key.value} to {rhs.data_source.key.value}"
-            )
-
-        return RelationshipTuple(lhs, relationship, rhs, data)
+        return build_relationship_tuple(lhs, relationship, rhs)
 
     def visit_relationship_link(
         self, node: Node, visited_children: Tuple[Any, Node, Any]
@@ -728,6 +724,9 @@ def parse_snql_query_initial(
     account the initial query body. Extensions are parsed by extension
     processors and are supposed to update the AST.
     """
+    if get_config("snql_recursive_descent_parser", 0):
+        return parse_snql_query_recursive_descent(body)
+
     exp_tree = snql_grammar.parse(body)
     parsed = SnQLVisitor().visit(exp_tree)
     assert isinstance(parsed, (CompositeQuery, LogicalQuery))  # mypy
@@ -848,9 +847,7 @@ def _post_process(
             _post_process(from_clause, funcs)
 
 
-def parse_snql_query(
-    body: str, dataset: Dataset
-) -> Union[CompositeQuery[QueryEntity], LogicalQuery]:
+def _parse_snql_query(body: str,) -> Union[CompositeQuery[QueryEntity], LogicalQuery]:
     query = parse_snql_query_initial(body)
 
     # These are the post processing phases
@@ -869,3 +866,202 @@ def parse_snql_query(
     )
 
     return query
+
+
+class QueryTemplate(NamedTuple):
+    """
+    A parsed query where the literals of the original query body were
+    replaced by placeholders. ``query`` is None when the template cannot be
+    used to build the queries with its shape (in which case these queries
+    are always parsed.)
+    """
+
+    query: Optional[Union[CompositeQuery[QueryEntity], LogicalQuery]]
+
+
+_query_template_cache: ParsedQueryCache[QueryTemplate] = ParsedQueryCache(
+    settings.PARSED_QUERY_CACHE_SIZE
+)
+
+# Matches the literals that can be lifted out of a query body. The numbers
+# that are not part of an expression (such as the limit) are kept, since
+# they are not represented by literals once parsed.
+QUERY_PARAMETER_RE = re.compile(
+    r"(?P<keep>\b(?:LIMIT|OFFSET|GRANULARITY|SAMPLE)\s+[0-9\.e\+\-]+)"
+    r"|(?P<string>'[^'\n]*')"
+    r"|(?<![\w\.])(?P<number>[0-9]+(?:\.[0-9]+)?(?:e[\+\-][0-9]+)?)(?![\w\.])"
+)
+
+# Numeric placeholders are numbered from this value, so that they cannot be
+# confused with the other numbers of a template.
+PLACEHOLDER_BASE = 10 ** 12
+
+PLACEHOLDER_RE = re.compile(
+    r"'%(?P<string>[0-9]+)'" r"|(?<![\w\.])(?P<number>[0-9]{13,})(?:\.5)?(?![\w\.])"
+)
+
+
+def _parameter_value(parameter: str) -> Any:
+    if parameter.startswith("'"):
+        return parameter[1:-1]
+    try:
+        return int(parameter)
+    except ValueError:
+        return float(parameter)
+
+
+def _lift_parameters(body: str) -> Tuple[str, Sequence[str]]:
+    """
+    Replaces the string and numeric literals of a query body with
+    placeholders. Returns the body of the template and the literals, in the
+    order of the placeholders.
+
+    String placeholders look like ``'%0'`` (``%`` cannot be part of a
+    column name or of a subscript key.) Numeric placeholders are numbers of
+    the same type as the literal they replace, so the template of a query
+    depends on the type of its literals.
+    """
+    parameters: List[str] = []
+    indexes: MutableMapping[str, int] = {}
+
+    def lift(match: Any) -> str:
+        if match.group("keep") is not None:
+            return str(match.group(0))
+
+        # Identical literals share a placeholder, since the validation of
+        # the aliases depends on which expressions are identical.
+        parameter = match.group("string") or match.group("number")
+        index = indexes.get(parameter)
+        if index is None:
+            index = indexes[parameter] = len(parameters)
+            parameters.append(parameter)
+        if parameter.startswith("'"):
+            return f"'%{index}'"
+        elif isinstance(_parameter_value(parameter), int):
+            return str(PLACEHOLDER_BASE + index)
+        else:
+            return f"{PLACEHOLDER_BASE + index}.5"
+
+    template_body = QUERY_PARAMETER_RE.sub(lift, body)
+    return template_body, parameters
+
+
+def _parse_template(body: str,) -> Union[CompositeQuery[QueryEntity], LogicalQuery]:
+    query = parse_snql_query_initial(body)
+
+    # The phases that depend on the value of the literals are only run
+    # once the placeholders are replaced.
+    _post_process(
+        query,
+        [
+            _validate_aliases,
+            _parse_subscriptables,
+            _apply_column_aliases,
+            _expand_aliases,
+            _mangle_aliases,
+            _qualify_columns,
+        ],
+    )
+
+    return query
+
+
+def _build_from_template(
+    template: Union[CompositeQuery[QueryEntity], LogicalQuery],
+    parameters: Sequence[str],
+) -> Union[CompositeQuery[QueryEntity], LogicalQuery]:
+    placeholders: MutableMapping[Any, Any] = {}
+    for index, parameter in enumerate(parameters):
+        value = _parameter_value(parameter)
+        if isinstance(value, str):
+            placeholders[f"%{index}"] = value
+        else:
+            placeholder: Union[int, float] = PLACEHOLDER_BASE + index
+            if isinstance(value, float):
+                placeholder += 0.5
+            # Negative numbers are parsed as a single literal.
+            placeholders[placeholder] = value
+            placeholders[-placeholder] = -value
+
+    def replace_placeholder(exp: Expression) -> Expression:
+        if (
+            isinstance(exp, Literal)
+            and not isinstance(exp.value, bool)
+            and exp.value in placeholders
+        ):
+            return Literal(exp.alias, placeholders[exp.value])
+        return exp
+
+    def restore_parameter(match: Any) -> str:
+        if match.group("string") is not None:
+            return parameters[int(match.group("string"))]
+        return parameters[int(match.group("number")) - PLACEHOLDER_BASE]
+
+    def bind_parameters(
+        query: Union[CompositeQuery[QueryEntity], LogicalQuery]
+    ) -> None:
+        query.transform_expressions(replace_placeholder)
+        # The names of the selected columns are taken from the query body
+        # when they do not have an alias.
+        query.set_ast_selected_columns(
+            [
+                replace(
+                    selected, name=PLACEHOLDER_RE.sub(restore_parameter, selected.name)
+                )
+                if selected.name is not None
+                else selected
+                for selected in query.get_selected_columns_from_ast()
+            ]
+        )
+
+    query = copy.deepcopy(template)
+    _post_process(
+        query, [bind_parameters, _parse_datetime_literals, _array_join_transformation]
+    )
+    return query
+
+
+def parse_snql_query(
+    body: str, dataset: Dataset
+) -> Union[CompositeQuery[QueryEntity], LogicalQuery]:
+    """
+    Parses a SnQL query. Queries that only differ by the value of their
+    literals share the same template, which is parsed (and cached) the first
+    time a query with its shape is seen. The other queries are built from
+    a copy of the template, which skips the grammar and most of the post
+    processing phases.
+
+    The first query built from a template is compared with the query
+    parsed from its body. If they are different, the queries with this
+    shape are always parsed.
+    """
+    if "\\" in body:
+        # Escaped quotes are not lifted out of the query body. These
+        # queries are rare enough not to be worth caching.
+        return _parse_snql_query(body)
+
+    template_body, parameters = _lift_parameters(body)
+    template = _query_template_cache.get(template_body)
+    if template is not None and template.query is not None:
+        metrics.increment("parsed_query_cache.hit", tags={"parser": "snql"})
+        return _build_from_template(template.query, parameters)
+
+    metrics.increment("parsed_query_cache.miss", tags={"parser": "snql"})
+    query = _parse_snql_query(body)
+    if template is None:
+        template_query: Optional[
+            Union[CompositeQuery[QueryEntity], LogicalQuery]
+        ] = None
+        try:
+            parsed = _parse_template(template_body)
+            if _build_from_template(parsed, parameters) == query:
+                template_query = parsed
+        except Exception:
+            # The template of a valid query may not be valid, e.g. when a
+            # placeholder ends up where the grammar does not expect a
+            # literal.
+            pass
+
+        _query_template_cache.set(template_body, QueryTemplate(template_query))
+
+    return query
@@ -0,0 +1,723 @@
+import re
+from typing import (
+    Any,
+    Callable,
+    List,
+    MutableMapping,
+    Optional,
+    Pattern,
+    Sequence,
+    Tuple,
+    TypeVar,
+    Union,
+)
+
+from snuba.datasets.entities import EntityKey
+from snuba.datasets.entities.factory import get_entity
+from snuba.query import (
+    LimitBy,
+    OrderBy,
+    OrderByDirection,
+    SelectedExpression,
+)
+from snuba.query.composite import CompositeQuery
+from snuba.query.conditions import (
+    OPERATOR_TO_FUNCTION,
+    binary_condition,
+    combine_and_conditions,
+    combine_or_conditions,
+)
+from snuba.query.data_source.join import IndividualNode, JoinClause
+from snuba.query.data_source.simple import Entity as QueryEntity
+from snuba.query.dsl import divide, minus, multiply, plus
+from snuba.query.expressions import (
+    Column,
+    CurriedFunctionCall,
+    Expression,
+    FunctionCall,
+    Literal,
+)
+from snuba.query.logical import Query as LogicalQuery
+from snuba.query.parser.exceptions import ParsingException
+from snuba.query.snql.joins import (
+    RelationshipTuple,
+    build_join_clause,
+    build_relationship_tuple,
+)
+
+# The terminals of the SnQL grammar (see ``snuba.query.snql.parser``).
+SPACES_RE = re.compile(r"\s*")
+FUNCTION_NAME_RE = re.compile(r"[a-zA-Z_][a-zA-Z0-9_]*")
+ENTITY_NAME_RE = re.compile(r"[a-zA-Z_]+")
+COLUMN_NAME_RE = re.compile(r"[a-zA-Z_][a-zA-Z0-9_\.]*")
+STRING_LITERAL_RE = re.compile(r"[a-zA-Z0-9_\.\+\*\/:\-]*")
+QUOTED_LITERAL_RE = re.compile(r"((?<!\\)')((?!(?<!\\)').)*.?'")
+NUMERIC_LITERAL_RE = re.compile(r"-?[0-9]+(\.[0-9]+)?(e[\+\-][0-9]+)?")
+INTEGER_LITERAL_RE = re.compile(r"-?[0-9]+")
+BOOLEAN_LITERAL_RE = re.compile(r"TRUE|FALSE", re.IGNORECASE)
+
+# Same order as the ``condition_op`` rule, since the first one that matches
+# is used.
+CONDITION_OPERATORS = (
+    "!=",
+    ">=",
+    ">",
+    "<=",
+    "<",
+    "=",
+    "NOT IN",
+    "NOT LIKE",
+    "IN",
+    "LIKE",
+)
+
+ARITHMETIC_FUNCTIONS = {
+    "+": plus,
+    "-": minus,
+    "*": multiply,
+    "/": divide,
+}
+
+T = TypeVar("T")
+
+# The result of a rule: the value it produced and the position following
+# the text it matched, or None when it did not match.
+Result = Optional[Tuple[T, int]]
+
+DataSource = Union[
+    CompositeQuery[QueryEntity], LogicalQuery, QueryEntity, JoinClause[QueryEntity]
+]
+
+
+class RecursiveDescentParser:
+    """
+    Parses SnQL queries into the same AST as the grammar in
+    ``snuba.query.snql.parser`` and its visitor, without building a parse
+    tree first.
+
+    Every rule of the grammar is implemented by a method with the same
+    name, which follows the semantics of a parsing expression grammar:
+    choices are attempted in order, repetitions are greedy and a rule that
+    matched is never attempted again with a shorter match. The results of
+    ``low_pri_arithmetic`` (the rule that is attempted again the most when
+    a choice fails) are memoized by position.
+    """
+
+    def __init__(self, body: str) -> None:
+        self.__body = body
+        self.__farthest = 0
+        self.__arithmetic: MutableMapping[int, Result[Expression]] = {}
+
+    def parse(self) -> Union[CompositeQuery[QueryEntity], LogicalQuery]:
+        result = self.query_exp(0)
+        if result is None or result[1] != len(self.__body):
+            position = max(self.__farthest, result[1] if result is not None else 0)
+            raise ParsingException(
+                f"Invalid SnQL query at position {position}: "
+                f"{self.__body[position : position + 20]!r}"
+            )
+        return result[0]
+
+    # Terminals
+
+    def __spaces(self, pos: int) -> int:
+        match = SPACES_RE.match(self.__body, pos)
+        assert match is not None  # mypy
+        return match.end()
+
+    def __required_spaces(self, pos: int) -> Optional[int]:
+        end = self.__spaces(pos)
+        if end == pos:
+            self.__fail(pos)
+            return None
+        return end
+
+    def __string(self, pos: int, string: str) -> Optional[int]:
+        if self.__body.startswith(string, pos):
+            return pos + len(string)
+        self.__fail(pos)
+        return None
+
+    def __keyword(self, pos: int, keyword: str) -> Optional[int]:
+        """
+        Matches ``space+ keyword space+``, which starts most of the clauses.
+        """
+        start = self.__required_spaces(pos)
+        if start is None:
+            return None
+        end = self.__string(start, keyword)
+        if end is None:
+            return None
+        return self.__required_spaces(end)
+
+    def __regex(self, pos: int, pattern: Pattern[str]) -> Result[str]:
+        match = pattern.match(self.__body, pos)
+        if match is None:
+            self.__fail(pos)
+            return None
+        return match.group(0), match.end()
+
+    def __fail(self, pos: int) -> None:
+        # The farthest position where a terminal did not match is where
+        # the query is the most likely to be invalid.
+        if pos > self.__farthest:
+            self.__farthest = pos
+
+    def __list(self, pos: int, rule: Callable[[int], Result[T]]) -> Result[List[T]]:
+        """
+        Matches ``(rule space* comma)* rule``.
+        """
+        items: List[T] = []
+        while True:
+            result = rule(pos)
+            if result is None:
+                return None
+            item, end = result
+            items.append(item)
+            separator = self.__string(self.__spaces(end), ",")
+            if separator is None:
+                return items, end
+            pos = separator
+
+    # Query
+
+    def query_exp(
+        self, pos: int
+    ) -> Result[Union[CompositeQuery[QueryEntity], LogicalQuery]]:
+        match = self.match_clause(pos)
+        if match is None:
+            return None
+        data_source, pos = match
+
+        select = self.select_clause(pos)
+        if select is None:
+            return None
+        selected_columns, pos = select
+
+        clauses: MutableMapping[str, Any] = {}
+        optional_clauses: Sequence[Tuple[str, Callable[[int], Result[Any]]]] = [
+            ("groupby", self.group_by_clause),
+            ("condition", self.where_clause),
+            ("having", self.having_clause),
+            ("order_by", self.order_by_clause),
+            ("limitby", self.limit_by_clause),
+            ("limit", self.limit_clause),
+            ("offset", self.offset_clause),
+            ("granularity", self.granularity_clause),
+            ("totals", self.totals_clause),
+        ]
+        for name, rule in optional_clauses:
+            result = rule(pos)
+            if result is not None:
+                clauses[name], pos = result
+
+        if "groupby" in clauses:
+            selected_columns = [*selected_columns, *clauses["groupby"]]
+            clauses["groupby"] = [gb.expression for gb in clauses["groupby"]]
+
+        query: Union[CompositeQuery[QueryEntity], LogicalQuery]
+        if isinstance(data_source, QueryEntity):
+            query = LogicalQuery(
+                {},
+                data_source,
+                selected_columns=selected_columns,
+                prewhere=None,
+                sample=data_source.sample,
+                **clauses,
+            )
+        else:
+            query = CompositeQuery(
+                from_clause=data_source, selected_columns=selected_columns, **clauses,
+            )
+        return query, self.__spaces(pos)
+
+    def match_clause(self, pos: int) -> Result[DataSource]:
+        pos = self.__spaces(pos)
+        end = self.__string(pos, "MATCH")
+        if end is None:
+            return None
+        end = self.__required_spaces(end)
+        if end is None:
+            return None
+
+        relationships = self.relationships(end)
+        if relationships is not None:
+            relationship_tuples, end = relationships
+            return build_join_clause(relationship_tuples), end
+
+        subquery = self.subquery(end)
+        if subquery is not None:
+            return subquery
+
+        return self.entity_single(end)
+
+    def entity_single(self, pos: int) -> Result[QueryEntity]:
+        end = self.__string(pos, "(")
+        if end is None:
+            return None
+        return self.__entity(self.__spaces(end))
+
+    def entity_match(self, pos: int) -> Result[IndividualNode[QueryEntity]]:
+        end = self.__string(pos, "(")
+        if end is None:
+            return None
+        alias = self.__regex(end, FUNCTION_NAME_RE)
+        if alias is None:
+            return None
+        end = self.__string(alias[1], ":")
+        if end is None:
+            return None
+        entity = self.__entity(self.__spaces(end))
+        if entity is None:
+            return None
+        return IndividualNode(alias[0], entity[0]), entity[1]
+
+    def __entity(self, pos: int) -> Result[QueryEntity]:
+        """
+        Matches ``entity_name sample_clause? space* close_paren``.
+        """
+        name = self.__regex(pos, ENTITY_NAME_RE)
+        if name is None:
+            return None
+        entity_name, end = name
+
+        sample: Optional[float] = None
+        sample_clause = self.sample_clause(end)
+        if sample_clause is not None:
+            sample, end = sample_clause
+
+        close = self.__string(self.__spaces(end), ")")
+        if close is None:
+            return None
+
+        try:
+            key = EntityKey(entity_name)
+        except Exception:
+            raise ParsingException(f"{entity_name} is not a valid entity name")
+        return QueryEntity(key, get_entity(key).get_data_model(), sample), close
+
+    def sample_clause(self, pos: int) -> Result[float]:
+        end = self.__keyword(pos, "SAMPLE")
+        if end is None:
+            return None
+        sample = self.numeric_literal(end)
+        if sample is None:
+            return None
+        if not isinstance(sample[0].value, float):
+            raise ParsingException("The sample rate must be a float")
+        return sample[0].value, sample[1]
+
+    def relationships(self, pos: int) -> Result[Sequence[RelationshipTuple]]:
+        first = self.relationship_match(pos)
+        if first is None:
+            return None
+        relationship, pos = first
+        relationships = [relationship]
+        while True:
+            end = self.__string(pos, ",")
+            if end is None:
+                break
+            other = self.relationship_match(end)
+            if other is None:
+                break
+            relationship, pos = other
+            relationships.append(relationship)
+        return relationships, pos
+
+    def relationship_match(self, pos: int) -> Result[RelationshipTuple]:
+        lhs = self.entity_match(self.__spaces(pos))
+        if lhs is None:
+            return None
+        link = self.relationship_link(self.__spaces(lhs[1]))
+        if link is None:
+            return None
+        rhs = self.entity_match(self.__spaces(link[1]))
+        if rhs is None:
+            return None
+        return build_relationship_tuple(lhs[0], link[0], rhs[0]), rhs[1]
+
+    def relationship_link(self, pos: int) -> Result[str]:
+        end = self.__string(pos, "-[")
+        if end is None:
+            return None
+        name = self.__regex(end, FUNCTION_NAME_RE)
+        if name is None:
+            return None
+        end = self.__string(name[1], "]->")
+        if end is None:
+            return None
+        return name[0], end
+
+    def subquery(
+        self, pos: int
+    ) -> Result[Union[CompositeQuery[QueryEntity], LogicalQuery]]:
+        end = self.__string(pos, "{")
+        if end is None:
+            return None
+        query = self.query_exp(end)
+        if query is None:
+            return None
+        end = self.__string(query[1], "}")
+        if end is None:
+            return None
+        return query[0], end
+
+    # Clauses
+
+    def select_clause(self, pos: int) -> Result[List[SelectedExpression]]:
+        end = self.__keyword(pos, "SELECT")
+        if end is None:
+            return None
+        return self.__list(end, self.selected_expression)
+
+    def group_by_clause(self, pos: int) -> Result[List[SelectedExpression]]:
+        end = self.__keyword(pos, "BY")
+        if end is None:
+            return None
+        return self.__list(end, self.selected_expression)
+
+    def selected_expression(self, pos: int) -> Result[SelectedExpression]:
+        result = self.low_pri_arithmetic(self.__spaces(pos))
+        if result is None:
+            return None
+        exp, end = result
+        name = exp.alias or self.__body[pos:end].strip()
+        return SelectedExpression(name, exp), end
+
+    def where_clause(self, pos: int) -> Result[Expression]:
+        end = self.__keyword(pos, "WHERE")
+        if end is None:
+            return None
+        return self.or_expression(end)
+
+    def having_clause(self, pos: int) -> Result[Expression]:
+        end = self.__keyword(pos, "HAVING")
+        if end is None:
+            return None
+        return self.or_expression(end)
+
+    def order_by_clause(self, pos: int) -> Result[List[OrderBy]]:
+        end = self.__keyword(pos, "ORDER BY")
+        if end is None:
+            return None
+
+        order_by: List[OrderBy] = []
+        while True:
+            result = self.low_pri_arithmetic(end)
+            if result is None:
+                return None
+            exp, end = result
+            direction_start = self.__required_spaces(end)
+            if direction_start is None:
+                return None
+            if self.__body.startswith("ASC", direction_start):
+                direction = OrderByDirection.ASC
+                end = direction_start + 3
+            elif self.__body.startswith("DESC", direction_start):
+                direction = OrderByDirection.DESC
+                end = direction_start + 4
+            else:
+                self.__fail(direction_start)
+                return None
+            order_by.append(OrderBy(direction, exp))
+
+            separator = self.__string(self.__spaces(end), ",")
+            if separator is None:
+                return order_by, end
+            end = self.__spaces(separator)
+
+    def limit_by_clause(self, pos: int) -> Result[LimitBy]:
+        limit = self.__integer_clause(pos, "LIMIT")
+        if limit is None:
+            return None
+        end = self.__keyword(limit[1], "BY")
+        if end is None:
+            return None
+        column = self.column_name(end)
+        if column is None:
+            return None
+        return LimitBy(limit[0], column[0]), column[1]
+
+    def limit_clause(self, pos: int) -> Result[int]:
+        return self.__integer_clause(pos, "LIMIT")
+
+    def offset_clause(self, pos: int) -> Result[int]:
+        return self.__integer_clause(pos, "OFFSET")
+
+    def granularity_clause(self, pos: int) -> Result[int]:
+        return self.__integer_clause(pos, "GRANULARITY")
+
+    def __integer_clause(self, pos: int, keyword: str) -> Result[int]:
+        end = self.__keyword(pos, keyword)
+        if end is None:
+            return None
+        integer = self.__regex(end, INTEGER_LITERAL_RE)
+        if integer is None:
+            return None
+        return int(integer[0]), integer[1]
+
+    def totals_clause(self, pos: int) -> Result[bool]:
+        end = self.__keyword(pos, "TOTALS")
+        if end is None:
+            return None
+        boolean = self.__regex(end, BOOLEAN_LITERAL_RE)
+        if boolean is None:
+            return None
+        return boolean[0].lower() == "true", boolean[1]
+
+    # Conditions
+
+    def or_expression(self, pos: int) -> Result[Expression]:
+        return self.__boolean_expression(
+            pos, "OR", self.and_expression, combine_or_conditions
+        )
+
+    def and_expression(self, pos: int) -> Result[Expression]:
+        return self.__boolean_expression(
+            pos, "AND", self.condition, combine_and_conditions
+        )
+
+    def __boolean_expression(
+        self,
+        pos: int,
+        operator: str,
+        operand: Callable[[int], Result[Expression]],
+        combine: Callable[[Sequence[Expression]], Expression],
+    ) -> Result[Expression]:
+        """
+        Matches ``space* operand (space+ operator operand)*``.
+        """
+        first = operand(self.__spaces(pos))
+        if first is None:
+            return None
+        exp, end = first
+        operands = [exp]
+        while True:
+            start = self.__required_spaces(end)
+            if start is None:
+                break
+            start = self.__string(start, operator)
+            if start is None:
+                break
+            other = operand(start)
+            if other is None:
+                break
+            exp, end = other
+            operands.append(exp)
+        return combine(operands), end
+
+    def condition(self, pos: int) -> Result[Expression]:
+        main_condition = self.main_condition(pos)
+        if main_condition is not None:
+            return main_condition
+        return self.parenthesized_cdn(pos)
+
+    def main_condition(self, pos: int) -> Result[Expression]:
+        lhs = self.low_pri_arithmetic(pos)
+        if lhs is None:
+            return None
+        start = self.__spaces(lhs[1])
+        for operator in CONDITION_OPERATORS:
+            if self.__body.startswith(operator, start):
+                break
+        else:
+            self.__fail(start)
+            return None
+        start = self.__spaces(start + len(operator))
+
+        rhs: Result[Expression] = self.function_call(start)
+        if rhs is None:
+            rhs = self.column_name(start)
+        if rhs is None:
+            rhs = self.quoted_literal(start)
+        if rhs is None:
+            rhs = self.numeric_literal(start)
+        if rhs is None:
+            return None
+
+        return (
+            binary_condition(OPERATOR_TO_FUNCTION[operator], lhs[0], rhs[0]),
+            rhs[1],
+        )
+
+    def parenthesized_cdn(self, pos: int) -> Result[Expression]:
+        end = self.__string(self.__spaces(pos), "(")
+        if end is None:
+            return None
+        condition = self.or_expression(end)
+        if condition is None:
+            return None
+        end = self.__string(condition[1], ")")
+        if end is None:
+            return None
+        return condition[0], end
+
+    # Expressions
+
+    def low_pri_arithmetic(self, pos: int) -> Result[Expression]:
+        if pos not in self.__arithmetic:
+            self.__arithmetic[pos] = self.__arithmetic_expression(
+                pos, "+-", self.high_pri_arithmetic
+            )
+        return self.__arithmetic[pos]
+
+    def high_pri_arithmetic(self, pos: int) -> Result[Expression]:
+        return self.__arithmetic_expression(pos, "/*", self.arithmetic_term)
+
+    def __arithmetic_expression(
+        self, pos: int, operators: str, operand: Callable[[int], Result[Expression]],
+    ) -> Result[Expression]:
+        """
+        Matches ``space* operand (space* operator space* operand)*``. The
+        operations are left associative.
+        """
+        first = operand(self.__spaces(pos))
+        if first is None:
+            return None
+        exp, end = first
+        while True:
+            start = self.__spaces(end)
+            operator = self.__body[start : start + 1]
+            if not operator or operator not in operators:
+                self.__fail(start)
+                break
+            other = operand(self.__spaces(start + 1))
+            if other is None:
+                break
+            exp = ARITHMETIC_FUNCTIONS[operator](exp, other[0], None)
+            end = other[1]
+        return exp, end
+
+    def arithmetic_term(self, pos: int) -> Result[Expression]:
+        pos = self.__spaces(pos)
+        term: Result[Expression] = self.function_call(pos)
+        if term is None:
+            term = self.numeric_literal(pos)
+        if term is None:
+            term = self.subscriptable(pos)
+        if term is None:
+            term = self.column_name(pos)
+        if term is None:
+            term = self.parenthesized_arithm(pos)
+        return term
+
+    def parenthesized_arithm(self, pos: int) -> Result[Expression]:
+        end = self.__string(pos, "(")
+        if end is None:
+            return None
+        exp = self.low_pri_arithmetic(end)
+        if exp is None:
+            return None
+        end = self.__string(exp[1], ")")
+        if end is None:
+            return None
+        return exp[0], end
+
+    def function_call(self, pos: int) -> Result[Expression]:
+        name = self.__regex(pos, FUNCTION_NAME_RE)
+        if name is None:
+            return None
+        parameters = self.__parameters(name[1])
+        if parameters is None:
+            return None
+        params1, end = parameters
+
+        params2: Optional[Sequence[Expression]] = None
+        curried = self.__parameters(end)
+        if curried is not None:
+            params2, end = curried
+
+        alias: Optional[str] = None
+        alias_start = self.__string(self.__spaces(end), "AS")
+        if alias_start is not None:
+            string = self.__regex(self.__spaces(alias_start), STRING_LITERAL_RE)
+            assert string is not None  # The string literal can be empty.
+            alias, end = string
+
+        if params2 is None:
+            return FunctionCall(alias, name[0], tuple(params1)), end
+        return (
+            CurriedFunctionCall(
+                alias, FunctionCall(None, name[0], tuple(params1)), tuple(params2)
+            ),
+            end,
+        )
+
+    def __parameters(self, pos: int) -> Result[Sequence[Expression]]:
+        """
+        Matches ``open_paren parameters_list? close_paren``.
+        """
+        end = self.__string(pos, "(")
+        if end is None:
+            return None
+        parameters: Sequence[Expression] = []
+        parameters_list = self.parameters_list(end)
+        if parameters_list is not None:
+            parameters, end = parameters_list
+        end = self.__string(end, ")")
+        if end is None:
+            return None
+        return parameters, end
+
+    def parameters_list(self, pos: int) -> Result[List[Expression]]:
+        parameters: List[Expression] = []
+        while True:
+            parameter = self.param_expression(pos)
+            if parameter is None:
+                return None
+            exp, end = parameter
+            parameters.append(exp)
+            separator = self.__string(self.__spaces(end), ",")
+            if separator is None:
+                return parameters, end
+            pos = self.__spaces(separator)
+
+    def param_expression(self, pos: int) -> Result[Expression]:
+        exp = self.low_pri_arithmetic(pos)
+        if exp is not None:
+            return exp
+        return self.quoted_literal(pos)
+
+    def subscriptable(self, pos: int) -> Result[Expression]:
+        column = self.__regex(pos, COLUMN_NAME_RE)
+        if column is None:
+            return None
+        end = self.__string(column[1], "[")
+        if end is None:
+            return None
+        key = self.__regex(end, COLUMN_NAME_RE)
+        if key is None:
+            return None
+        end = self.__string(key[1], "]")
+        if end is None:
+            return None
+        return Column(None, None, self.__body[pos:end]), end
+
+    def column_name(self, pos: int) -> Result[Column]:
+        column = self.__regex(pos, COLUMN_NAME_RE)
+        if column is None:
+            return None
+        return Column(None, None, column[0]), column[1]
+
+    def numeric_literal(self, pos: int) -> Result[Literal]:
+        number = self.__regex(pos, NUMERIC_LITERAL_RE)
+        if number is None:
+            return None
+        text, end = number
+        try:
+            return Literal(None, int(text)), end
+        except ValueError:
+            return Literal(None, float(text)), end
+
+    def quoted_literal(self, pos: int) -> Result[Literal]:
+        quoted = self.__regex(pos, QUOTED_LITERAL_RE)
+        if quoted is None:
+            return None
+        text, end = quoted
+        return Literal(None, text[1:-1].replace("\\'", "'")), end
+
+
+def parse_snql_query_recursive_descent(
+    body: str,
+) -> Union[CompositeQuery[QueryEntity], LogicalQuery]:
+    return RecursiveDescentParser(body).parse()
@@ -75,6 +75,35 @@ def transform_nullable(
     return transform_column
 
 
+def build_column_transformer(
+    column_transformations: Sequence[Tuple[Pattern[str], Callable[[Any], Any]]],
+) -> Callable[[Column], Optional[Callable[[Any], Any]]]:
+    """
+    Builds and returns a function that returns the function that has to be
+    applied to the values of a column of a ``Result`` according to its data
+    type, or None if the values of the column do not need to be transformed.
+    """
+
+    def get_column_transformer(column: Column) -> Optional[Callable[[Any], Any]]:
+        is_nullable, type = unwrap_nullable_type(column["type"])
+
+        transformer = next(
+            (
+                transformer
+                for pattern, transformer in column_transformations
+                if pattern.match(type)
+            ),
+            None,
+        )
+
+        if transformer is not None and is_nullable:
+            transformer = transform_nullable(transformer)
+
+        return transformer
+
+    return get_column_transformer
+
+
 def build_result_transformer(
     column_transformations: Sequence[Tuple[Pattern[str], Callable[[Any], Any]]],
 ) -> Callable[[Result], None]:
@@ -83,26 +112,14 @@ def build_result_transformer(
     instance in-place by transforming all values for columns that have a
     transformation function specified for their data type.
     """
+    get_column_transformer = build_column_transformer(column_transformations)
 
     def transform_result(result: Result) -> None:
         for column in result["meta"]:
-            is_nullable, type = unwrap_nullable_type(column["type"])
-
-            transformer = next(
-                (
-                    transformer
-                    for pattern, transformer in column_transformations
-                    if pattern.match(type)
-                ),
-                None,
-            )
-
+            transformer = get_column_transformer(column)
             if transformer is None:
                 continue
 
-            if is_nullable:
-                transformer = transform_nullable(transformer)
-
             name = column["name"]
             for row in iterate_rows(result):
                 row[name] = transformer(row[name])
@@ -1,11 +1,26 @@
+from __future__ import annotations
+
 import logging
 import time
 import simplejson as json
 
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
-from typing import Optional, Sequence
+from functools import partial
+from threading import Semaphore
+from typing import (
+    Any,
+    Callable,
+    Mapping,
+    MutableMapping,
+    Optional,
+    Sequence,
+    TypeVar,
+)
 
-from snuba.clusters.cluster import ClickhouseClientSettings
+from snuba import settings
+from snuba.clusters.cluster import ClickhouseClientSettings, ClickhouseNode
+from snuba.datasets.errors_replacer import ReplacementCountMode
 from snuba.datasets.storage import WritableTableStorage
 from snuba.processor import InvalidMessageVersion
 from snuba.replacers.replacer_processor import Replacement, ReplacementMessage
@@ -18,9 +33,80 @@ from snuba.utils.streams.processing.strategies.batching import AbstractBatchWork
 logger = logging.getLogger("snuba.replacer")
 
 
+T = TypeVar("T")
+
+
+def _is_exact_count() -> bool:
+    # Only exact counts are the number of rows that are replaced, other
+    # modes only tell whether rows may be replaced.
+    return (
+        ReplacementCountMode(settings.REPLACER_COUNT_MODE) == ReplacementCountMode.EXACT
+    )
+
+
+class NodeExecutor:
+    """
+    Runs functions that query ClickHouse nodes in a thread pool, allowing at
+    most ``concurrency`` of them to run at the same time for each node.
+    """
+
+    def __init__(self, nodes: Sequence[ClickhouseNode], concurrency: int) -> None:
+        if not concurrency > 0:
+            raise ValueError("concurrency must be greater than zero")
+
+        self.__executor = ThreadPoolExecutor(
+            max_workers=len(nodes) * concurrency, thread_name_prefix="replacer"
+        )
+        self.__semaphores: Mapping[ClickhouseNode, Semaphore] = {
+            node: Semaphore(concurrency) for node in nodes
+        }
+
+    def submit(self, node: ClickhouseNode, function: Callable[[], T]) -> Future[T]:
+        semaphore = self.__semaphores[node]
+
+        def run() -> T:
+            with semaphore:
+                return function()
+
+        return self.__executor.submit(run)
+
+    def map(
+        self, function: Callable[[ClickhouseNode], T], nodes: Sequence[ClickhouseNode]
+    ) -> Sequence[T]:
+        """
+        Calls the function for each of the nodes concurrently and returns
+        the results in the same order as the nodes.
+        """
+        futures = [self.submit(node, partial(function, node)) for node in nodes]
+        return [future.result() for future in futures]
+
+    def shutdown(self) -> None:
+        self.__executor.shutdown()
+
+
 class ReplacerWorker(AbstractBatchWorker[KafkaPayload, Replacement]):
-    def __init__(self, storage: WritableTableStorage, metrics: MetricsBackend) -> None:
-        self.clickhouse = storage.get_cluster().get_query_connection(
+    """
+    Runs the replacements produced by the replacer processor of a storage.
+
+    By default, replacements are executed one at a time through the query
+    node of the cluster. When ``per_node_concurrency`` is provided, each
+    replacement is instead executed against the local table of every shard
+    concurrently (on the first replica of each shard, since the replicas
+    receive the inserted rows through replication.) Replacements are still
+    applied in order, as each one must complete on every shard before the
+    next one starts. The ``OPTIMIZE`` queries that may follow a batch are
+    run concurrently as well, with at most ``per_node_concurrency`` queries
+    running on each node at a time.
+    """
+
+    def __init__(
+        self,
+        storage: WritableTableStorage,
+        metrics: MetricsBackend,
+        per_node_concurrency: Optional[int] = None,
+    ) -> None:
+        self.__cluster = storage.get_cluster()
+        self.clickhouse = self.__cluster.get_query_connection(
             ClickhouseClientSettings.REPLACE
         )
 
@@ -34,6 +120,37 @@ class ReplacerWorker(AbstractBatchWorker[KafkaPayload, Replacement]):
             storage.get_table_writer().get_schema().get_local_table_name()
         )
 
+        if per_node_concurrency is not None and not per_node_concurrency > 0:
+            raise ValueError("per node concurrency must be greater than zero")
+
+        self.__per_node_concurrency = per_node_concurrency
+        self.__local_nodes: Optional[Sequence[ClickhouseNode]] = None
+        self.__shard_nodes: Sequence[ClickhouseNode] = []
+        self.__node_executor: Optional[NodeExecutor] = None
+
+    def __get_node_executor(self) -> Optional[NodeExecutor]:
+        if self.__per_node_concurrency is None:
+            return None
+
+        if self.__node_executor is None:
+            # The cluster topology is only looked up once, when the first
+            # batch is flushed.
+            self.__local_nodes = self.__cluster.get_local_nodes()
+            shard_nodes: MutableMapping[Optional[int], ClickhouseNode] = {}
+            for node in self.__local_nodes:
+                shard_nodes.setdefault(node.shard, node)
+            self.__shard_nodes = [*shard_nodes.values()]
+            logger.info(
+                "Running replacements on %d shards (%d nodes)",
+                len(self.__shard_nodes),
+                len(self.__local_nodes),
+            )
+            self.__node_executor = NodeExecutor(
+                self.__local_nodes, self.__per_node_concurrency
+            )
+
+        return self.__node_executor
+
     def process_message(self, message: Message[KafkaPayload]) -> Optional[Replacement]:
         seq_message = json.loads(message.payload.value)
         version = seq_message[0]
@@ -46,49 +163,180 @@ class ReplacerWorker(AbstractBatchWorker[KafkaPayload, Replacement]):
             raise InvalidMessageVersion("Unknown message format: " + str(seq_message))
 
     def flush_batch(self, batch: Sequence[Replacement]) -> None:
+        replacements = self.__replacer_processor.coalesce_replacements(batch)
+        self.metrics.timing("replacements.batch_size", len(batch))
+        self.metrics.timing("replacements.coalesced_batch_size", len(replacements))
+
+        node_executor = self.__get_node_executor()
+
         need_optimize = False
-        for replacement in batch:
-            query_args = {
-                **replacement.query_args,
-                "table_name": self.__replacer_processor.get_schema().get_table_name(),
-            }
-
-            if replacement.count_query_template is not None:
-                count = self.clickhouse.execute_robust(
-                    replacement.count_query_template % query_args
-                )[0][0]
-                if count == 0:
-                    continue
+        for replacement in replacements:
+            if node_executor is None:
+                need_optimize = self.__run_replacement(replacement) or need_optimize
             else:
-                count = 0
+                need_optimize = (
+                    self.__run_sharded_replacement(node_executor, replacement)
+                    or need_optimize
+                )
 
-            need_optimize = (
-                self.__replacer_processor.pre_replacement(replacement, count)
-                or need_optimize
-            )
+        if need_optimize:
+            today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+            if node_executor is None:
+                from snuba.optimize import run_optimize
 
-            if replacement.insert_query_template is not None:
-                t = time.time()
-                query = replacement.insert_query_template % query_args
-                logger.debug("Executing replace query: %s" % query)
-                self.clickhouse.execute_robust(query)
-                duration = int((time.time() - t) * 1000)
+                num_dropped = run_optimize(
+                    self.clickhouse, "default", self.__table_name, before=today,
+                )
+                logger.info(
+                    "Optimized %s partitions on %s"
+                    % (num_dropped, self.clickhouse.host)
+                )
+            else:
+                num_dropped = self.__run_sharded_optimize(node_executor, today)
+                logger.info(
+                    "Optimized %s partitions on %s shards"
+                    % (num_dropped, len(self.__shard_nodes))
+                )
+
+    def __run_replacement(self, replacement: Replacement) -> bool:
+        query_args = {
+            **replacement.query_args,
+            "table_name": self.__replacer_processor.get_schema().get_table_name(),
+        }
+
+        if replacement.count_query_template is not None:
+            count = self.clickhouse.execute_robust(
+                replacement.count_query_template % query_args
+            )[0][0]
+            if count == 0:
+                return False
+        else:
+            count = 0
 
+        need_optimize = self.__replacer_processor.pre_replacement(replacement, count)
+
+        if replacement.insert_query_template is not None:
+            t = time.time()
+            query = replacement.insert_query_template % query_args
+            logger.debug("Executing replace query: %s" % query)
+            self.clickhouse.execute_robust(query)
+            duration = int((time.time() - t) * 1000)
+
+            if _is_exact_count():
                 logger.info("Replacing %s rows took %sms" % (count, duration))
                 self.metrics.timing("replacements.count", count)
-                self.metrics.timing("replacements.duration", duration)
             else:
-                count = duration = 0
+                logger.info("Replacing rows took %sms" % duration)
+            self.metrics.timing("replacements.duration", duration)
+        else:
+            count = duration = 0
 
-            self.__replacer_processor.post_replacement(replacement, duration, count)
+        self.__replacer_processor.post_replacement(replacement, duration, count)
 
-        if need_optimize:
-            from snuba.optimize import run_optimize
+        return need_optimize
 
-            today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
-            num_dropped = run_optimize(
-                self.clickhouse, "default", self.__table_name, before=today,
+    def __execute_on_node(self, query: str, node: ClickhouseNode) -> Any:
+        return self.__cluster.get_node_connection(
+            ClickhouseClientSettings.REPLACE, node
+        ).execute_robust(query)
+
+    def __run_sharded_replacement(
+        self, node_executor: NodeExecutor, replacement: Replacement
+    ) -> bool:
+        query_args = {
+            **replacement.query_args,
+            "table_name": self.__table_name,
+        }
+
+        nodes = self.__shard_nodes
+        if replacement.count_query_template is not None:
+            counts = [
+                result[0][0]
+                for result in node_executor.map(
+                    partial(
+                        self.__execute_on_node,
+                        replacement.count_query_template % query_args,
+                    ),
+                    nodes,
+                )
+            ]
+            count = sum(counts)
+            if count == 0:
+                return False
+
+            # Shards that have no matching rows can be skipped.
+            nodes = [node for node, c in zip(nodes, counts) if c > 0]
+        else:
+            count = 0
+
+        need_optimize = self.__replacer_processor.pre_replacement(replacement, count)
+
+        if replacement.insert_query_template is not None:
+            t = time.time()
+            query = replacement.insert_query_template % query_args
+            logger.debug("Executing replace query on %d shards: %s", len(nodes), query)
+            node_executor.map(partial(self.__execute_on_node, query), nodes)
+            duration = int((time.time() - t) * 1000)
+
+            if _is_exact_count():
+                logger.info(
+                    "Replacing %s rows on %s shards took %sms"
+                    % (count, len(nodes), duration)
+                )
+                self.metrics.timing("replacements.count", count)
+            else:
+                logger.info(
+                    "Replacing rows on %s shards took %sms" % (len(nodes), duration)
+                )
+            self.metrics.timing("replacements.duration", duration)
+            self.metrics.timing("replacements.shards", len(nodes))
+        else:
+            count = duration = 0
+
+        self.__replacer_processor.post_replacement(replacement, duration, count)
+
+        return need_optimize
+
+    def __run_sharded_optimize(
+        self, node_executor: NodeExecutor, before: datetime
+    ) -> int:
+        from snuba.optimize import get_partitions_to_optimize, optimize_partitions
+
+        # Merges are replicated, so partitions only need to be optimized on
+        # one replica of each shard.
+        nodes = self.__shard_nodes
+        connections = {
+            node: self.__cluster.get_node_connection(
+                ClickhouseClientSettings.OPTIMIZE, node
             )
-            logger.info(
-                "Optimized %s partitions on %s" % (num_dropped, self.clickhouse.host)
+            for node in nodes
+        }
+
+        partitions = node_executor.map(
+            lambda node: get_partitions_to_optimize(
+                connections[node], "default", self.__table_name, before
+            ),
+            nodes,
+        )
+
+        # Each partition is optimized separately, so that several partitions
+        # of the same node can be optimized at a time.
+        futures = [
+            node_executor.submit(
+                node,
+                partial(
+                    optimize_partitions,
+                    connections[node],
+                    "default",
+                    self.__table_name,
+                    [partition],
+                ),
             )
+            for node, node_partitions in zip(nodes, partitions)
+            for partition in node_partitions
+        ]
+
+        for future in futures:
+            future.result()
+
+        return len(futures)
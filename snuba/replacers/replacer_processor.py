@@ -1,6 +1,6 @@
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
-from typing import Any, Mapping, NamedTuple, Optional
+from typing import Any, Mapping, NamedTuple, Optional, Sequence
 
 from snuba.datasets.schemas.tables import WritableTableSchema
 
@@ -44,6 +44,16 @@ class ReplacerProcessor(ABC):
         """
         raise NotImplementedError
 
+    def coalesce_replacements(
+        self, replacements: Sequence[Replacement]
+    ) -> Sequence[Replacement]:
+        """
+        Combines the replacements produced from one batch of messages into
+        fewer replacements where possible, preserving their order. The
+        replacements are returned unchanged by default.
+        """
+        return replacements
+
     def get_schema(self) -> WritableTableSchema:
         return self.__schema
 
@@ -3,12 +3,13 @@ from __future__ import annotations
 from enum import Enum
 import itertools
 import uuid
-from typing import Any, Mapping, Type
+from typing import Any, Mapping, MutableMapping, Tuple, Type
 
 import jsonschema
 
 from snuba import environment
 from snuba.datasets.dataset import Dataset
+from snuba.datasets.entity import Entity
 from snuba.query.extensions import QueryExtension
 from snuba.query.parser import parse_query
 from snuba.query.schema import GENERIC_QUERY_SCHEMA
@@ -21,7 +22,7 @@ from snuba.request.request_settings import (
     RequestSettings,
     SubscriptionRequestSettings,
 )
-from snuba.schemas import Schema, validate_jsonschema
+from snuba.schemas import Schema, SchemaValidator
 from snuba.utils.metrics.wrapper import MetricsWrapper
 
 metrics = MetricsWrapper(environment.metrics, "parser")
@@ -84,6 +85,7 @@ class RequestSchema:
                 ] = definition_schema
 
         self.__composite_schema["required"] = set(self.__composite_schema["required"])
+        self.__validator = SchemaValidator(self.__composite_schema)
 
     @classmethod
     def build_with_extensions(
@@ -107,7 +109,7 @@ class RequestSchema:
 
     def validate(self, value, dataset: Dataset, referrer: str) -> Request:
         try:
-            value = validate_jsonschema(value, self.__composite_schema)
+            value = self.__validator.validate(value)
         except jsonschema.ValidationError as error:
             raise JsonSchemaValidationException(str(error)) from error
 
@@ -164,6 +166,28 @@ class RequestSchema:
         return self.__generate_template_impl(self.__composite_schema)
 
 
+_REQUEST_SCHEMAS: MutableMapping[
+    Tuple[Entity, Type[RequestSettings], Language], RequestSchema
+] = {}
+
+
+def get_request_schema(
+    entity: Entity, settings_class: Type[RequestSettings], language: Language
+) -> RequestSchema:
+    """
+    Returns the request schema for the extensions of an entity. Building a
+    schema (and compiling its validator) is not free, so schemas are built
+    once per entity, settings class and language and then reused.
+    """
+    key = (entity, settings_class, language)
+    schema = _REQUEST_SCHEMAS.get(key)
+    if schema is None:
+        schema = _REQUEST_SCHEMAS[key] = RequestSchema.build_with_extensions(
+            entity.get_extensions(), settings_class, language
+        )
+    return schema
+
+
 SETTINGS_SCHEMAS: Mapping[Type[RequestSettings], Schema] = {
     HTTPRequestSettings: {
         "type": "object",
@@ -7,49 +7,69 @@ import jsonschema
 Schema = Mapping[str, Any]  # placeholder for JSON schema
 
 
-def validate_jsonschema(value, schema, set_defaults=True):
+def _validate_and_default(
+    validator,
+    properties: Mapping[str, Any],
+    instance: MutableMapping[str, Any],
+    schema,
+):
+    for property, subschema in properties.items():
+        if property not in instance and "default" in subschema:
+            if callable(subschema["default"]):
+                default_value = subschema["default"]()
+            else:
+                default_value = copy.deepcopy(subschema["default"])
+            instance[property] = default_value
+
+    for error in jsonschema.Draft6Validator.VALIDATORS["properties"](
+        validator, properties, instance, schema
+    ):
+        yield error
+
+
+DefaultingValidator = jsonschema.validators.extend(
+    jsonschema.Draft4Validator, {"properties": _validate_and_default}
+)
+
+
+class SchemaValidator:
     """
-    Validates a value against the provided schema, returning the validated
-    value if the value conforms to the schema, otherwise raising a
-    ``jsonschema.ValidationError``.
+    Validates values against a schema. The underlying validator is built
+    once, so instances should be reused when the same schema is validated
+    repeatedly.
     """
-    orig = jsonschema.Draft6Validator.VALIDATORS["properties"]
 
-    def validate_and_default(
-        validator,
-        properties: Mapping[str, Any],
-        instance: MutableMapping[str, Any],
-        schema,
-    ):
-        for property, subschema in properties.items():
-            if property not in instance and "default" in subschema:
-                if callable(subschema["default"]):
-                    default_value = subschema["default"]()
-                else:
-                    default_value = copy.deepcopy(subschema["default"])
-                instance[property] = default_value
-
-        for error in orig(validator, properties, instance, schema):
-            yield error
-
-    # Using schema defaults during validation will cause the input value to be
-    # mutated, so to be on the safe side we create a deep copy of that value to
-    # avoid unwanted side effects for the calling function.
-    if set_defaults:
-        value = copy.deepcopy(value)
-
-    validator_cls = (
-        jsonschema.validators.extend(
-            jsonschema.Draft4Validator, {"properties": validate_and_default}
+    def __init__(self, schema: Schema, set_defaults: bool = True) -> None:
+        self.__set_defaults = set_defaults
+        validator_cls = (
+            DefaultingValidator if set_defaults else jsonschema.Draft6Validator
         )
-        if set_defaults
-        else jsonschema.Draft6Validator
-    )
+        self.__validator = validator_cls(
+            schema,
+            types={"array": (list, tuple)},
+            format_checker=jsonschema.FormatChecker(),
+        )
+
+    def validate(self, value: Any) -> Any:
+        """
+        Returns the validated value if the value conforms to the schema,
+        otherwise raises a ``jsonschema.ValidationError``.
+        """
+        # Using schema defaults during validation will cause the input value to be
+        # mutated, so to be on the safe side we create a deep copy of that value to
+        # avoid unwanted side effects for the calling function.
+        if self.__set_defaults:
+            value = copy.deepcopy(value)
+
+        self.__validator.validate(value)
 
-    validator_cls(
-        schema,
-        types={"array": (list, tuple)},
-        format_checker=jsonschema.FormatChecker(),
-    ).validate(value, schema)
+        return value
 
-    return value
+
+def validate_jsonschema(value, schema, set_defaults=True):
+    """
+    Validates a value against the provided schema, returning the validated
+    value if the value conforms to the schema, otherwise raising a
+    ``jsonschema.ValidationError``.
+    """
+    return SchemaValidator(schema, set_defaults).validate(value)
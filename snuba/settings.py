@@ -52,6 +52,22 @@ REDIS_PASSWORD = None
 REDIS_DB = 1
 
 USE_RESULT_CACHE = True
+# Maximum size (in bytes, estimated from the number of rows and columns) of
+# the query results that each API process keeps in memory in front of the
+# Redis result cache. 0 disables the local cache.
+RESULT_CACHE_LOCAL_MAX_SIZE = 0
+# Compression of the query results stored in Redis ("lz4" or "zstd", which
+# requires the ``zstandard`` package.) Only results that are at least
+# RESULT_CACHE_COMPRESSION_MIN_SIZE bytes once encoded are compressed.
+# Disabled when ``None``.
+RESULT_CACHE_COMPRESSION: Optional[str] = None
+RESULT_CACHE_COMPRESSION_MIN_SIZE = 16 * 1024
+# Number of result rows encoded at a time when a large query response is
+# streamed to the client.
+RESPONSE_STREAMING_CHUNK_SIZE = 1000
+# Maximum number of parsed queries (and SnQL query templates) that each
+# process keeps in memory. 0 disables the parsed query cache.
+PARSED_QUERY_CACHE_SIZE = 1000
 
 # Query Recording Options
 RECORD_QUERIES = False
@@ -59,6 +75,9 @@ QUERIES_TOPIC = "snuba-queries"
 
 # Runtime Config Options
 CONFIG_MEMOIZE_TIMEOUT = 10
+# The runtime config is read again after this many seconds even if its
+# version did not change.
+CONFIG_SNAPSHOT_MAX_AGE = 60
 
 # Sentry Options
 SENTRY_DSN = None
@@ -85,10 +104,18 @@ STORAGE_TOPICS: Mapping[str, Mapping[str, Any]] = defaultdict(dict)
 
 DEFAULT_MAX_BATCH_SIZE = 50000
 DEFAULT_MAX_BATCH_TIME_MS = 2 * 1000
+DEFAULT_MIN_BATCH_SIZE = 1000
+# Inserts rejected because the table has too many parts are retried when the
+# consumer adjusts its batch size automatically.
+TOO_MANY_PARTS_MAX_RETRIES = 5
+TOO_MANY_PARTS_RETRY_DELAY = 1.0
 DEFAULT_QUEUED_MAX_MESSAGE_KBYTES = 10000
 DEFAULT_QUEUED_MIN_MESSAGES = 10000
 DISCARD_OLD_EVENTS = True
 CLICKHOUSE_HTTP_CHUNK_SIZE = 8192
+# Content-Encoding used to compress insert request bodies ("gzip", "lz4" or
+# "zstd", which requires the ``zstandard`` package.) Disabled when ``None``.
+CLICKHOUSE_HTTP_COMPRESSION: Optional[str] = None
 
 DEFAULT_RETENTION_DAYS = 90
 RETENTION_OVERRIDES: Mapping[int, int] = {}
@@ -107,6 +134,13 @@ REPLACER_MAX_MEMORY_USAGE = 10 * (1024 ** 3)  # 10GB
 REPLACER_KEY_TTL = 12 * 60 * 60
 REPLACER_MAX_GROUP_IDS_TO_EXCLUDE = 256
 REPLACER_IMMEDIATE_OPTIMIZE = False
+# How the replacer checks whether a replacement matches any rows before
+# running it: "exact" counts the rows, "exists" only looks for one matching
+# row and "approximate" counts the rows without FINAL.
+REPLACER_COUNT_MODE = "exact"
+# Maximum number of replacements from a batch that can be combined into a
+# single replacement query.
+REPLACER_MAX_COALESCED_REPLACEMENTS = 100
 
 TURBO_SAMPLE_RATE = 0.1
 
@@ -4,6 +4,7 @@ import logging
 import random
 import re
 import time
+import uuid
 from functools import partial
 from typing import Any, Iterable, Mapping, Optional, Sequence, Tuple
 
@@ -27,6 +28,7 @@ kfk = None
 ratelimit_prefix = "snuba-ratelimit:"
 query_lock_prefix = "snuba-query-lock:"
 config_hash = "snuba-config"
+config_version_key = "snuba-config-version"
 config_history_hash = "snuba-config-history"
 config_changes_list = "snuba-config-changes"
 config_changes_list_limit = 25
@@ -91,6 +93,32 @@ def numeric(value: Optional[Any]) -> Optional[Any]:
 
 ABTEST_RE = re.compile("(?:(-?\d+\.?\d*)(?:\:(\d+))?\/?)")
 
+ABTest = Sequence[Tuple[Any, int]]
+
+
+def parse_abtest(value: Optional[Any]) -> Optional[ABTest]:
+    """
+    Returns the weighted values of an A/B test value (see ``abtest``), or
+    None if the value is not one.
+    """
+    if isinstance(value, str) and ABTEST_RE.match(value):
+        return [
+            (numeric(v), int(weight or 1)) for (v, weight) in ABTEST_RE.findall(value)
+        ]
+    else:
+        return None
+
+
+def sample_abtest(values: ABTest) -> Optional[Any]:
+    total_weight = sum(weight for (_, weight) in values)
+    r = random.randint(1, total_weight)
+    i = 0
+    for (v, weight) in values:
+        i += weight
+        if i >= r:
+            return v
+    return None
+
 
 def abtest(value: Optional[Any]) -> Optional[Any]:
     """
@@ -102,19 +130,104 @@ def abtest(value: Optional[Any]) -> Optional[Any]:
     1000:1/2000:1 => returns 1000 or 2000 with equal weight
     1000:2/2000:1 => returns 1000 twice as often as 2000
     """
-    if isinstance(value, str) and ABTEST_RE.match(value):
-        values = ABTEST_RE.findall(value)
-        total_weight = sum(int(weight or 1) for (_, weight) in values)
-        r = random.randint(1, total_weight)
-        i = 0
-        for (v, weight) in values:
-            i += int(weight or 1)
-            if i >= r:
-                return numeric(v)
+    values = parse_abtest(value)
+    if values is not None:
+        return sample_abtest(values)
     else:
         return value
 
 
+class ConfigSnapshot:
+    """
+    The runtime configuration as of a version of the config hash. The A/B
+    test values are parsed once, when the snapshot is created, so that
+    looking up a value does not require parsing or copying the other ones.
+    """
+
+    def __init__(
+        self,
+        version: Optional[bytes],
+        raw_configs: Mapping[str, Optional[Any]],
+        loaded_at: float,
+    ) -> None:
+        self.version = version
+        self.raw_configs = raw_configs
+        self.loaded_at = loaded_at
+        parsed = {key: parse_abtest(value) for key, value in raw_configs.items()}
+        self.__abtests: Mapping[str, ABTest] = {
+            key: values for key, values in parsed.items() if values is not None
+        }
+
+    def get(self, key: str, default: Optional[Any] = None) -> Optional[Any]:
+        values = self.__abtests.get(key)
+        if values is not None:
+            return sample_abtest(values)
+        return self.raw_configs.get(key, default)
+
+    def get_all(self) -> Mapping[str, Optional[Any]]:
+        if not self.__abtests:
+            return self.raw_configs
+        return {
+            **self.raw_configs,
+            **{key: sample_abtest(values) for key, values in self.__abtests.items()},
+        }
+
+
+_config_snapshot: Optional[ConfigSnapshot] = None
+_config_checked_at = 0.0
+
+
+def _load_config_snapshot(version: Optional[bytes], now: float) -> ConfigSnapshot:
+    all_configs = rds.hgetall(config_hash)
+    return ConfigSnapshot(
+        version,
+        {
+            k.decode("utf-8"): numeric(v.decode("utf-8"))
+            for k, v in all_configs.items()
+            if v is not None
+        },
+        now,
+    )
+
+
+def get_config_snapshot() -> ConfigSnapshot:
+    """
+    Returns the latest snapshot of the runtime configuration. Every change
+    made with ``set_config`` updates the version of the configuration, which
+    is checked at most every ``CONFIG_MEMOIZE_TIMEOUT`` seconds. The
+    whole configuration is only read again when its version changes (or
+    after ``CONFIG_SNAPSHOT_MAX_AGE`` seconds, to pick up changes that did
+    not update the version.)
+    """
+    global _config_snapshot, _config_checked_at
+
+    now = time.monotonic()
+    snapshot = _config_snapshot
+    if (
+        snapshot is not None
+        and now < _config_checked_at + settings.CONFIG_MEMOIZE_TIMEOUT
+    ):
+        return snapshot
+
+    try:
+        # The version is read before the configuration, so a snapshot is
+        # never older than its version.
+        version = rds.get(config_version_key)
+        if (
+            snapshot is None
+            or snapshot.version != version
+            or now >= snapshot.loaded_at + settings.CONFIG_SNAPSHOT_MAX_AGE
+        ):
+            snapshot = _load_config_snapshot(version, now)
+    except Exception as ex:
+        logger.exception(ex)
+        if snapshot is None:
+            snapshot = ConfigSnapshot(None, {}, now)
+
+    _config_snapshot, _config_checked_at = snapshot, now
+    return snapshot
+
+
 def set_config(key: str, value: Optional[Any], user: Optional[str] = None) -> None:
     if value is not None:
         value = "{}".format(value).encode("utf-8")
@@ -131,6 +244,9 @@ def set_config(key: str, value: Optional[Any], user: Optional[str] = None) -> No
         else:
             rds.hset(config_hash, key, value)
             rds.hset(config_history_hash, key, json.dumps(change_record))
+        # A random version (rather than a counter) can't be reused if the
+        # version key is lost.
+        rds.set(config_version_key, uuid.uuid4().hex)
         rds.lpush(config_changes_list, json.dumps((key, change_record)))
         rds.ltrim(config_changes_list, 0, config_changes_list_limit)
     except Exception as ex:
@@ -145,32 +261,22 @@ def set_configs(
 
 
 def get_config(key: str, default: Optional[Any] = None) -> Optional[Any]:
-    return get_all_configs().get(key, default)
+    return get_config_snapshot().get(key, default)
 
 
 def get_configs(
     key_defaults: Iterable[Tuple[str, Optional[Any]]]
 ) -> Sequence[Optional[Any]]:
-    all_confs = get_all_configs()
-    return [all_confs.get(k, d) for k, d in key_defaults]
+    snapshot = get_config_snapshot()
+    return [snapshot.get(k, d) for k, d in key_defaults]
 
 
 def get_all_configs() -> Mapping[str, Optional[Any]]:
-    return {k: abtest(v) for k, v in get_raw_configs().items()}
+    return get_config_snapshot().get_all()
 
 
-@memoize(settings.CONFIG_MEMOIZE_TIMEOUT)
 def get_raw_configs() -> Mapping[str, Optional[Any]]:
-    try:
-        all_configs = rds.hgetall(config_hash)
-        return {
-            k.decode("utf-8"): numeric(v.decode("utf-8"))
-            for k, v in all_configs.items()
-            if v is not None
-        }
-    except Exception as ex:
-        logger.exception(ex)
-        return {}
+    return get_config_snapshot().raw_configs
 
 
 def delete_config(key: str, user: Optional[Any] = None) -> None:
@@ -37,6 +37,8 @@ class Cache(Generic[TValue], ABC):
         function: Callable[[], TValue],
         timeout: int,
         timer: Optional[Timer] = None,
+        stale_ttl: Optional[int] = None,
+        refresh_function: Optional[Callable[[], TValue]] = None,
     ) -> TValue:
         """
         Implements a read-through caching pattern for the value at the given
@@ -68,5 +70,13 @@ class Cache(Generic[TValue], ABC):
         will be blocked -- they will likely get a result or throw a
         ``ExecutionTimeoutError`` in a time window substantially shorter than
         the full timeout duration.
+
+        When ``stale_ttl`` is provided, values are kept in the cache for
+        ``stale_ttl`` more seconds after they expire. Such stale values are
+        still returned immediately, while a single client executes the
+        function in the background to refresh them. If ``refresh_function``
+        is provided, it is executed to refresh stale values instead of
+        ``function``, since the caller that received the stale value may
+        still be using any state that ``function`` shares with it.
         """
         raise NotImplementedError
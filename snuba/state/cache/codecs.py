@@ -0,0 +1,101 @@
+import time
+from enum import Enum
+from typing import Callable, Mapping
+
+import lz4.frame
+
+from snuba.state.cache.abstract import TValue
+from snuba.utils.codecs import Codec
+from snuba.utils.metrics import MetricsBackend
+
+
+class CacheCompression(Enum):
+    LZ4 = "lz4"
+    ZSTD = "zstd"
+
+
+def _zstd_compress(data: bytes) -> bytes:
+    # ``zstandard`` is an optional dependency, only required when zstd
+    # compression is enabled.
+    import zstandard
+
+    return zstandard.ZstdCompressor().compress(data)
+
+
+def _zstd_decompress(data: bytes) -> bytes:
+    import zstandard
+
+    # The content size is stored in the frame header by ``compress``, which
+    # allows decompressing the frame in a single call.
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+_COMPRESSORS: Mapping[CacheCompression, Callable[[bytes], bytes]] = {
+    CacheCompression.LZ4: lz4.frame.compress,
+    CacheCompression.ZSTD: _zstd_compress,
+}
+
+_DECOMPRESSORS: Mapping[CacheCompression, Callable[[bytes], bytes]] = {
+    CacheCompression.LZ4: lz4.frame.decompress,
+    CacheCompression.ZSTD: _zstd_decompress,
+}
+
+# The magic numbers that start the frames of each compression format.
+_MAGIC_NUMBERS: Mapping[CacheCompression, bytes] = {
+    CacheCompression.LZ4: b"\x04\x22\x4d\x18",
+    CacheCompression.ZSTD: b"\x28\xb5\x2f\xfd",
+}
+
+
+class CompressingCodec(Codec[bytes, TValue]):
+    """
+    Compresses the values encoded by another codec when their encoded size
+    is at least ``min_size`` bytes (small values are not worth the time it
+    takes to compress them.)
+
+    Compressed values are identified by the magic number that starts their
+    frame, so values stored without compression (or with another
+    compression) can still be decoded. This requires the encoded values of
+    the wrapped codec never to start with one of these magic numbers, which
+    is the case for JSON.
+    """
+
+    def __init__(
+        self,
+        codec: Codec[bytes, TValue],
+        compression: CacheCompression,
+        min_size: int,
+        metrics: MetricsBackend,
+    ) -> None:
+        self.__codec = codec
+        self.__compression = compression
+        self.__min_size = min_size
+        self.__metrics = metrics
+
+    def encode(self, value: TValue) -> bytes:
+        data = self.__codec.encode(value)
+        if len(data) < self.__min_size:
+            return data
+
+        start = time.time()
+        compressed = _COMPRESSORS[self.__compression](data)
+        tags = {"compression": self.__compression.value}
+        self.__metrics.timing("compress", (time.time() - start) * 1000, tags=tags)
+        self.__metrics.timing(
+            "compression_ratio", len(data) / len(compressed), tags=tags
+        )
+        return compressed
+
+    def decode(self, value: bytes) -> TValue:
+        for compression, magic_number in _MAGIC_NUMBERS.items():
+            if value.startswith(magic_number):
+                start = time.time()
+                value = _DECOMPRESSORS[compression](value)
+                self.__metrics.timing(
+                    "decompress",
+                    (time.time() - start) * 1000,
+                    tags={"compression": compression.value},
+                )
+                break
+
+        return self.__codec.decode(value)
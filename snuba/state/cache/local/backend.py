@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from threading import Lock
+from typing import Callable, Generic, Optional
+
+from snuba.state import get_config
+from snuba.state.cache.abstract import Cache, TValue
+from snuba.utils.metrics import MetricsBackend
+from snuba.utils.metrics.timer import Timer
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class CacheEntry(Generic[TValue]):
+    value: TValue
+    size: int
+    expires_at: float
+
+
+class LocalCache(Cache[TValue]):
+    """
+    Keeps recently used values in process memory, in front of another
+    (typically shared) cache backend. Reading a value that was recently
+    stored or read by the same process avoids the round trip to the backend
+    and decoding the value again.
+
+    Values expire after ``cache_expiry_sec`` seconds, like the values stored
+    in the backend. The least recently used values are evicted when the size
+    of the cached values (as returned by ``get_size``) exceeds ``max_size``.
+    Values that are larger than ``max_size`` are not cached locally at all.
+
+    Since callers may modify the values they get from or put in the cache,
+    the values are copied with ``copy`` before being stored and returned.
+    """
+
+    def __init__(
+        self,
+        backend: Cache[TValue],
+        max_size: int,
+        get_size: Callable[[TValue], int],
+        copy: Callable[[TValue], TValue],
+        metrics: MetricsBackend,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.__backend = backend
+        self.__max_size = max_size
+        self.__get_size = get_size
+        self.__copy = copy
+        self.__metrics = metrics
+        self.__clock = clock
+
+        self.__lock = Lock()
+        self.__entries: OrderedDict[str, CacheEntry[TValue]] = OrderedDict()
+        self.__size = 0
+
+    def __get_local(self, key: str) -> Optional[TValue]:
+        with self.__lock:
+            entry = self.__entries.get(key)
+            if entry is not None:
+                if entry.expires_at > self.__clock():
+                    self.__entries.move_to_end(key)
+                else:
+                    del self.__entries[key]
+                    self.__size -= entry.size
+                    entry = None
+
+        if entry is None:
+            self.__metrics.increment("local_cache.miss")
+            return None
+
+        self.__metrics.increment("local_cache.hit")
+        return self.__copy(entry.value)
+
+    def __set_local(self, key: str, value: TValue) -> None:
+        size = self.__get_size(value)
+        if size > self.__max_size:
+            return
+
+        ttl = get_config("cache_expiry_sec", 1)
+        assert isinstance(ttl, (int, float))
+        entry = CacheEntry(self.__copy(value), size, self.__clock() + ttl)
+
+        with self.__lock:
+            previous = self.__entries.pop(key, None)
+            if previous is not None:
+                self.__size -= previous.size
+
+            self.__entries[key] = entry
+            self.__size += size
+
+            evictions = 0
+            while self.__size > self.__max_size:
+                _, evicted = self.__entries.popitem(last=False)
+                self.__size -= evicted.size
+                evictions += 1
+
+            self.__metrics.gauge("local_cache.size", self.__size)
+
+        if evictions:
+            self.__metrics.increment("local_cache.evictions", evictions)
+
+    def get(self, key: str) -> Optional[TValue]:
+        value = self.__get_local(key)
+        if value is not None:
+            return value
+
+        value = self.__backend.get(key)
+        if value is not None:
+            self.__set_local(key, value)
+
+        return value
+
+    def set(self, key: str, value: TValue) -> None:
+        self.__backend.set(key, value)
+        self.__set_local(key, value)
+
+    def get_readthrough(
+        self,
+        key: str,
+        function: Callable[[], TValue],
+        timeout: int,
+        timer: Optional[Timer] = None,
+        stale_ttl: Optional[int] = None,
+        refresh_function: Optional[Callable[[], TValue]] = None,
+    ) -> TValue:
+        value = self.__get_local(key)
+        if value is not None:
+            if timer is not None:
+                timer.mark("cache_get")
+            return value
+
+        value = self.__backend.get_readthrough(
+            key, function, timeout, timer, stale_ttl, refresh_function
+        )
+        self.__set_local(key, value)
+        return value
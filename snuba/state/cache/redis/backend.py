@@ -1,6 +1,6 @@
 import logging
 import uuid
-from typing import Callable, Optional
+from typing import Any, Callable, Optional
 
 import concurrent.futures
 from concurrent.futures import ThreadPoolExecutor
@@ -34,11 +34,17 @@ class RedisCache(Cache[TValue]):
         prefix: str,
         codec: Codec[bytes, TValue],
         executor: ThreadPoolExecutor,
+        expiry_config_key: str = "cache_expiry_sec",
+        default_expiry: int = 1,
     ) -> None:
         self.__client = client
         self.__prefix = prefix
         self.__codec = codec
         self.__executor = executor
+        # The runtime config key of the time (in seconds) values are kept in
+        # the cache for.
+        self.__expiry_config_key = expiry_config_key
+        self.__default_expiry = default_expiry
 
         # TODO: This should probably be lazily instantiated, rather than
         # automatically happening at startup.
@@ -56,6 +62,9 @@ class RedisCache(Cache[TValue]):
             [bit for bit in [prefix, f"{{{key}}}", suffix] if bit is not None]
         )
 
+    def __get_expiry(self) -> Any:
+        return get_config(self.__expiry_config_key, self.__default_expiry)
+
     def get(self, key: str) -> Optional[TValue]:
         value = self.__client.get(self.__build_key(key))
         if value is None:
@@ -65,17 +74,43 @@ class RedisCache(Cache[TValue]):
 
     def set(self, key: str, value: TValue) -> None:
         self.__client.set(
-            self.__build_key(key),
-            self.__codec.encode(value),
-            ex=get_config("cache_expiry_sec", 1),
+            self.__build_key(key), self.__codec.encode(value), ex=self.__get_expiry(),
         )
 
+    def __refresh(
+        self, key: str, function: Callable[[], TValue], timeout: int, stale_ttl: int,
+    ) -> None:
+        # Only one client refreshes a stale value at a time (up to the
+        # timeout, after which another client may try again.)
+        refresh_key = self.__build_key(key, "tasks", "refresh")
+        if not self.__client.set(refresh_key, b"", nx=True, ex=timeout):
+            return
+
+        logger.debug("Refreshing stale value in the background...")
+
+        def refresh() -> None:
+            try:
+                value = function()
+                self.__client.set(
+                    self.__build_key(key),
+                    self.__codec.encode(value),
+                    ex=self.__get_expiry() + stale_ttl,
+                )
+            except Exception:
+                logger.warning("Error refreshing stale cache value!", exc_info=True)
+            finally:
+                self.__client.delete(refresh_key)
+
+        self.__executor.submit(refresh)
+
     def get_readthrough(
         self,
         key: str,
         function: Callable[[], TValue],
         timeout: int,
         timer: Optional[Timer] = None,
+        stale_ttl: Optional[int] = None,
+        refresh_function: Optional[Callable[[], TValue]] = None,
     ) -> TValue:
         # This method is designed with the following goals in mind:
         # 1. The value generation function is only executed when no value
@@ -132,7 +167,17 @@ class RedisCache(Cache[TValue]):
             timer.mark("cache_get")
 
         if result[0] == RESULT_VALUE:
-            # If we got a cache hit, this is easy -- we just return it.
+            # If we got a cache hit, this is easy -- we just return it. Values
+            # are kept for ``stale_ttl`` seconds after they expire, so a
+            # value with less time than that left to live is stale and needs
+            # to be refreshed (but can still be returned.)
+            if stale_ttl is not None and 0 <= int(result[2]) <= stale_ttl:
+                self.__refresh(
+                    key,
+                    refresh_function if refresh_function is not None else function,
+                    timeout,
+                    stale_ttl,
+                )
             logger.debug("Immediately returning result from cache hit.")
             return self.__codec.decode(result[1])
         elif result[0] == RESULT_EXECUTE:
@@ -150,13 +195,14 @@ class RedisCache(Cache[TValue]):
             )
 
             argv = [task_ident, 60]
+            expiry = self.__get_expiry()
+            if stale_ttl is not None:
+                expiry += stale_ttl
             try:
                 # The task is run in a thread pool so that we can return
                 # control to the caller once the timeout is reached.
                 value = self.__executor.submit(function).result(task_timeout)
-                argv.extend(
-                    [self.__codec.encode(value), get_config("cache_expiry_sec", 1)]
-                )
+                argv.extend([self.__codec.encode(value), expiry])
             except concurrent.futures.TimeoutError as error:
                 raise TimeoutError("timed out waiting for value") from error
             finally:
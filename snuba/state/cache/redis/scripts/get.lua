@@ -5,10 +5,11 @@
 -- ARGV[2]: The task unique ID. Only used when creating a new task.
 
 -- Check to see if a value already exists at the result key. If one does, we
--- don't have to do anything other than return it and exit.
+-- don't have to do anything other than return it (and its remaining TTL, to
+-- tell whether it is stale) and exit.
 local value = redis.call('GET', KEYS[1])
 if value then
-    return {0, value}
+    return {0, value, redis.call('TTL', KEYS[1])}
 end
 
 -- Check to see if a waiting queue has already been established. If we are the
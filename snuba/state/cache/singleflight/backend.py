@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import concurrent.futures
+import logging
+from concurrent.futures import Future
+from threading import Lock
+from typing import Callable, MutableMapping, Optional
+
+from snuba.state.cache.abstract import (
+    Cache,
+    ExecutionError,
+    ExecutionTimeoutError,
+    TValue,
+)
+from snuba.utils.metrics import MetricsBackend
+from snuba.utils.metrics.timer import Timer
+
+
+logger = logging.getLogger(__name__)
+
+
+class SingleflightCache(Cache[TValue]):
+    """
+    Coalesces the concurrent read-through calls for the same key within a
+    process, in front of another cache backend. Only the first caller
+    reads the value from the backend (and executes the function on a cache
+    miss), while the other callers wait for its result instead of waiting
+    on the backend themselves. This avoids decoding the same value once per
+    caller.
+
+    Since callers may modify the values they get from the cache, each
+    waiting caller receives its own copy of the value (made with ``copy``.)
+    Like with the other implementations, waiting callers raise an
+    ``ExecutionError`` if the first caller fails, and a ``TimeoutError`` if
+    no result is available before their own timeout.
+    """
+
+    def __init__(
+        self,
+        backend: Cache[TValue],
+        copy: Callable[[TValue], TValue],
+        metrics: MetricsBackend,
+    ) -> None:
+        self.__backend = backend
+        self.__copy = copy
+        self.__metrics = metrics
+
+        self.__lock = Lock()
+        self.__calls: MutableMapping[str, Future[TValue]] = {}
+
+    def get(self, key: str) -> Optional[TValue]:
+        return self.__backend.get(key)
+
+    def set(self, key: str, value: TValue) -> None:
+        self.__backend.set(key, value)
+
+    def get_readthrough(
+        self,
+        key: str,
+        function: Callable[[], TValue],
+        timeout: int,
+        timer: Optional[Timer] = None,
+        stale_ttl: Optional[int] = None,
+        refresh_function: Optional[Callable[[], TValue]] = None,
+    ) -> TValue:
+        with self.__lock:
+            call = self.__calls.get(key)
+            if call is None:
+                call = self.__calls[key] = Future()
+                waiting = False
+            else:
+                waiting = True
+
+        if waiting:
+            self.__metrics.increment("singleflight.shared")
+            logger.debug("Waiting for the result of an in flight call for %r", key)
+            try:
+                value = call.result(timeout)
+            except concurrent.futures.TimeoutError as error:
+                raise TimeoutError("timed out waiting for result") from error
+            finally:
+                if timer is not None:
+                    timer.mark("dedupe_wait")
+            return self.__copy(value)
+
+        try:
+            value = self.__backend.get_readthrough(
+                key, function, timeout, timer, stale_ttl, refresh_function
+            )
+        except BaseException as error:
+            waiting_error = (
+                ExecutionTimeoutError("result not available before execution deadline")
+                if isinstance(error, TimeoutError)
+                else ExecutionError("in flight call failed")
+            )
+            waiting_error.__cause__ = error
+            call.set_exception(waiting_error)
+            raise
+        else:
+            # The value is copied before this caller gets a chance to modify
+            # it, and the waiting callers copy it again.
+            call.set_result(self.__copy(value))
+        finally:
+            with self.__lock:
+                del self.__calls[key]
+
+        return value
@@ -3,19 +3,25 @@ from contextlib import contextmanager, AbstractContextManager, ExitStack
 from dataclasses import dataclass
 import logging
 import time
+from threading import Lock
 from types import TracebackType
 from typing import (
+    Any,
     ChainMap as TypingChainMap,
     Iterator,
     Mapping,
     MutableMapping,
+    MutableSequence,
     Optional,
     Sequence,
+    Tuple,
     Type,
 )
 import uuid
 
-from snuba import state
+from pkg_resources import resource_string
+
+from snuba import settings, state
 
 logger = logging.getLogger("snuba.state.rate_limit")
 
@@ -87,6 +93,225 @@ class RateLimitStatsContainer:
         return ChainMap(*grouped_stats)
 
 
+@dataclass
+class _LocalQuery:
+    query_id: str
+    start: float
+    end: Optional[float] = None
+
+
+class LocalBucket:
+    """
+    Keeps an approximate count of the queries of a rate limiting bucket in
+    process, to avoid going through Redis for every query while the bucket
+    is far from its limits.
+
+    The counts read from Redis the last time the bucket was synced are
+    updated with the queries started by this process since then. Queries
+    are only admitted without going through Redis when the bucket was
+    synced less than ``sync_interval`` seconds ago and these estimated
+    counts remain below ``headroom`` (a fraction) of the limits, which
+    bounds the queries of other processes that can be missed. The queries
+    admitted this way are written to Redis the next time the bucket is
+    synced.
+    """
+
+    def __init__(self) -> None:
+        self.__lock = Lock()
+        self.__synced_at: Optional[float] = None
+        self.__historical = 0
+        self.__concurrent = 0
+        # The queries admitted since the last sync, which are not in Redis
+        # yet.
+        self.__pending: MutableMapping[str, _LocalQuery] = {}
+        # The queries admitted locally that were written to Redis while they
+        # were running, and have finished since.
+        self.__finished: MutableSequence[str] = []
+
+    def try_acquire(
+        self,
+        query_id: str,
+        now: float,
+        rate_limit_params: RateLimitParameters,
+        sync_interval: float,
+        headroom: float,
+    ) -> Optional[RateLimitStats]:
+        """
+        Admits the query and returns the estimated stats of the bucket if it
+        is far enough from its limits, otherwise returns None (in which case
+        the query has to go through Redis.)
+        """
+        with self.__lock:
+            if self.__synced_at is None or not now - self.__synced_at < sync_interval:
+                return None
+
+            historical = self.__historical + len(self.__pending) + 1
+            concurrent = (
+                self.__concurrent
+                + sum(1 for query in self.__pending.values() if query.end is None)
+                + 1
+            )
+            per_second = historical / float(state.rate_lookback_s)
+
+            for value, limit in [
+                (concurrent, rate_limit_params.concurrent_limit),
+                (per_second, rate_limit_params.per_second_limit),
+            ]:
+                if limit is not None and value > limit * headroom:
+                    return None
+
+            self.__pending[query_id] = _LocalQuery(query_id, now)
+            return RateLimitStats(rate=per_second, concurrent=concurrent)
+
+    def release(self, query_id: str, now: float) -> None:
+        with self.__lock:
+            query = self.__pending.get(query_id)
+            if query is not None:
+                query.end = now
+            else:
+                # The query was written to Redis while it was running, so it
+                # was counted as concurrent when the bucket was synced.
+                self.__finished.append(query_id)
+                self.__concurrent = max(self.__concurrent - 1, 0)
+
+    def discard(self, query_id: str, now: float) -> None:
+        """
+        Forgets a query admitted locally that did not run after all.
+        """
+        with self.__lock:
+            if self.__pending.pop(query_id, None) is not None:
+                return
+
+        self.release(query_id, now)
+
+    def release_synced(self) -> None:
+        """
+        Releases a query that went through Redis, which was counted as
+        concurrent when the bucket was synced.
+        """
+        with self.__lock:
+            self.__concurrent = max(self.__concurrent - 1, 0)
+
+    def is_sync_due(self, now: float, sync_interval: float) -> bool:
+        return self.__synced_at is None or not now - self.__synced_at < sync_interval
+
+    def drain(self, pipe: Any, bucket: str) -> None:
+        """
+        Adds the commands that write the queries admitted locally to Redis
+        to the pipeline.
+        """
+        with self.__lock:
+            pending, self.__pending = self.__pending, {}
+            finished, self.__finished = self.__finished, []
+
+        scores: MutableSequence[Any] = []
+        for query in pending.values():
+            if query.end is None:
+                # The query is still running, it is returned to its start
+                # time once it finishes (like the other running queries.)
+                scores.extend(
+                    [query.start + state.max_query_duration_s, query.query_id]
+                )
+            else:
+                scores.extend([query.start, query.query_id])
+        if scores:
+            pipe.zadd(bucket, *scores)
+
+        for query_id in finished:
+            pipe.zincrby(bucket, query_id, -float(state.max_query_duration_s))
+
+    def sync(self, now: float, historical: int, concurrent: int) -> None:
+        with self.__lock:
+            self.__synced_at = now
+            self.__historical = historical
+            self.__concurrent = concurrent
+
+    def is_idle(self) -> bool:
+        return not self.__pending and not self.__finished
+
+
+# The maximum number of buckets kept in process, after which the idle ones
+# are dropped.
+MAX_LOCAL_BUCKETS = 10000
+
+_local_buckets: MutableMapping[str, LocalBucket] = {}
+_local_buckets_lock = Lock()
+
+
+def get_local_bucket(bucket: str) -> LocalBucket:
+    with _local_buckets_lock:
+        local_bucket = _local_buckets.get(bucket)
+        if local_bucket is None:
+            if len(_local_buckets) >= MAX_LOCAL_BUCKETS:
+                for key in [k for k, v in _local_buckets.items() if v.is_idle()]:
+                    del _local_buckets[key]
+            local_bucket = _local_buckets[bucket] = LocalBucket()
+        return local_bucket
+
+
+def _flush_local_bucket(local_bucket: LocalBucket, bucket: str) -> None:
+    pipe = state.rds.pipeline(transaction=False)
+    local_bucket.drain(pipe, bucket)
+    try:
+        pipe.execute()
+    except Exception as ex:
+        logger.exception(ex)
+
+
+def _get_configs() -> Tuple[bool, int, float, float]:
+    """
+    Returns whether rate limits are bypassed, the history kept in the
+    buckets, and the sync interval and headroom of the local buckets.
+    """
+    bypass_rate_limit, rate_history_s, sync_interval, headroom = state.get_configs(
+        [
+            ("bypass_rate_limit", 0),
+            ("rate_history_sec", 3600),
+            ("rate_limit_local_sync_sec", 0),
+            ("rate_limit_local_headroom", 0.5),
+        ]
+    )
+    assert isinstance(rate_history_s, int)
+    assert isinstance(sync_interval, (int, float))
+    assert isinstance(headroom, (int, float))
+    return bypass_rate_limit == 1, rate_history_s, sync_interval, headroom
+
+
+def _check_limits(
+    rate_limit_params: RateLimitParameters, per_second: float, concurrent: int
+) -> None:
+    """
+    Raises ``RateLimitExceeded`` if the rate or the number of concurrent
+    queries of the bucket exceed its limits.
+    """
+    rate_limit_name = rate_limit_params.rate_limit_name
+
+    Reason = namedtuple("reason", "scope name val limit")
+    reasons = [
+        Reason(
+            rate_limit_name,
+            "concurrent",
+            concurrent,
+            rate_limit_params.concurrent_limit,
+        ),
+        Reason(
+            rate_limit_name,
+            "per-second",
+            per_second,
+            rate_limit_params.per_second_limit,
+        ),
+    ]
+
+    reason = next((r for r in reasons if r.limit is not None and r.val > r.limit), None)
+
+    if reason:
+        raise RateLimitExceeded(
+            "{r.scope} {r.name} of {r.val:.0f} exceeds limit of {r.limit:.0f}".format(
+                r=reason
+            )
+        )
+
+
 @contextmanager
 def rate_limit(
     rate_limit_params: RateLimitParameters,
@@ -108,24 +333,45 @@ def rate_limit(
     +-----------------------------+--------------------------------+
                                   ^
                                  now
+
+    When ``rate_limit_local_sync_sec`` is set, queries can also be admitted
+    by the process without going through Redis while the bucket is far from
+    its limits (see ``LocalBucket``.)
     """
 
     bucket = "{}{}".format(state.ratelimit_prefix, rate_limit_params.bucket)
-    query_id = uuid.uuid4()
+    query_id = str(uuid.uuid4())
 
     now = time.time()
-    bypass_rate_limit, rate_history_s = state.get_configs(
-        [("bypass_rate_limit", 0), ("rate_history_sec", 3600)]
-    )
+    bypass_rate_limit, rate_history_s, sync_interval, headroom = _get_configs()
 
-    if bypass_rate_limit == 1:
+    if bypass_rate_limit:
         yield None
         return
 
+    local_bucket = get_local_bucket(bucket) if sync_interval > 0 else None
+    if local_bucket is not None:
+        local_stats = local_bucket.try_acquire(
+            query_id, now, rate_limit_params, sync_interval, headroom
+        )
+        if local_stats is not None:
+            try:
+                yield local_stats
+            finally:
+                finished_at = time.time()
+                local_bucket.release(query_id, finished_at)
+                # Processes that stopped receiving queries still write the
+                # queries they admitted to Redis.
+                if local_bucket.is_sync_due(finished_at, sync_interval):
+                    _flush_local_bucket(local_bucket, bucket)
+            return
+
     pipe = state.rds.pipeline(transaction=False)
     pipe.zremrangebyscore(
         bucket, "-inf", "({:f}".format(now - rate_history_s)
     )  # cleanup
+    if local_bucket is not None:
+        local_bucket.drain(pipe, bucket)
     pipe.zadd(bucket, now + state.max_query_duration_s, query_id)  # add query
     if rate_limit_params.per_second_limit is None:
         pipe.exists("nosuchkey")  # no-op if we don't need per-second
@@ -137,7 +383,7 @@ def rate_limit(
         pipe.zcount(bucket, "({:f}".format(now), "+inf")  # get concurrent
 
     try:
-        _, _, historical, concurrent = pipe.execute()
+        *_, historical, concurrent = pipe.execute()
         historical = int(historical)
         concurrent = int(concurrent)
     except Exception as ex:
@@ -145,45 +391,27 @@ def rate_limit(
         yield None  # fail open if redis is having issues
         return
 
+    if local_bucket is not None:
+        local_bucket.sync(now, historical, concurrent)
+
     per_second = historical / float(state.rate_lookback_s)
 
     stats = RateLimitStats(rate=per_second, concurrent=concurrent)
 
-    rate_limit_name = rate_limit_params.rate_limit_name
-
-    Reason = namedtuple("reason", "scope name val limit")
-    reasons = [
-        Reason(
-            rate_limit_name,
-            "concurrent",
-            concurrent,
-            rate_limit_params.concurrent_limit,
-        ),
-        Reason(
-            rate_limit_name,
-            "per-second",
-            per_second,
-            rate_limit_params.per_second_limit,
-        ),
-    ]
-
-    reason = next((r for r in reasons if r.limit is not None and r.val > r.limit), None)
-
-    if reason:
+    try:
+        _check_limits(rate_limit_params, per_second, concurrent)
+    except RateLimitExceeded:
         try:
             state.rds.zrem(bucket, query_id)  # not allowed / not counted
         except Exception as ex:
             logger.exception(ex)
-
-        raise RateLimitExceeded(
-            "{r.scope} {r.name} of {r.val:.0f} exceeds limit of {r.limit:.0f}".format(
-                r=reason
-            )
-        )
+        raise
 
     try:
         yield stats
     finally:
+        if local_bucket is not None:
+            local_bucket.release_synced()
         try:
             # return the query to its start time
             state.rds.zincrby(bucket, query_id, -float(state.max_query_duration_s))
@@ -208,11 +436,22 @@ def get_global_rate_limit_params() -> RateLimitParameters:
     )
 
 
+_rate_limit_script = state.rds.register_script(
+    resource_string("snuba", "state/scripts/rate_limit.lua")
+)
+
+
 class RateLimitAggregator(AbstractContextManager):
     """
     Runs the rate limits provided by the `rate_limit_params` configuration object.
 
     It runs the rate limits in the order described by `rate_limit_params`.
+
+    The rate limits that are not checked locally (see ``LocalBucket``) are
+    all checked at once by a Redis script, which only adds the query to the
+    buckets if none of their limits is exceeded. This is not possible with
+    Redis Cluster (the buckets are stored on different nodes), in which case
+    each rate limit is checked separately (see ``rate_limit``.)
     """
 
     def __init__(self, rate_limit_params: Sequence[RateLimitParameters]) -> None:
@@ -222,13 +461,146 @@ class RateLimitAggregator(AbstractContextManager):
     def __enter__(self) -> RateLimitStatsContainer:
         stats = RateLimitStatsContainer()
 
-        for rate_limit_param in self.rate_limit_params:
-            child_stats = self.stack.enter_context(rate_limit(rate_limit_param))
-            if child_stats:
-                stats.add_stats(rate_limit_param.rate_limit_name, child_stats)
+        if settings.USE_REDIS_CLUSTER:
+            for rate_limit_param in self.rate_limit_params:
+                child_stats = self.stack.enter_context(rate_limit(rate_limit_param))
+                if child_stats:
+                    stats.add_stats(rate_limit_param.rate_limit_name, child_stats)
+        else:
+            self.__enter_all(stats)
 
         return stats
 
+    def __enter_all(self, stats: RateLimitStatsContainer) -> None:
+        query_id = str(uuid.uuid4())
+
+        now = time.time()
+        bypass_rate_limit, rate_history_s, sync_interval, headroom = _get_configs()
+
+        if bypass_rate_limit:
+            return
+
+        pipe = state.rds.pipeline(transaction=False)
+        # The rate limits checked locally, and the rate limits checked in Redis
+        # (with their local bucket, if any.)
+        local_params: MutableSequence[Tuple[RateLimitParameters, LocalBucket]] = []
+        redis_params: MutableSequence[
+            Tuple[RateLimitParameters, Optional[LocalBucket]]
+        ] = []
+        for rate_limit_param in self.rate_limit_params:
+            bucket = "{}{}".format(state.ratelimit_prefix, rate_limit_param.bucket)
+            local_bucket = get_local_bucket(bucket) if sync_interval > 0 else None
+            if local_bucket is not None:
+                local_stats = local_bucket.try_acquire(
+                    query_id, now, rate_limit_param, sync_interval, headroom
+                )
+                if local_stats is not None:
+                    stats.add_stats(rate_limit_param.rate_limit_name, local_stats)
+                    local_params.append((rate_limit_param, local_bucket))
+                    continue
+
+                local_bucket.drain(pipe, bucket)
+            redis_params.append((rate_limit_param, local_bucket))
+
+        if not redis_params:
+            self.stack.callback(
+                self.__exit_local, query_id, local_params, sync_interval
+            )
+            return
+
+        _rate_limit_script(
+            [
+                "{}{}".format(state.ratelimit_prefix, rate_limit_param.bucket)
+                for rate_limit_param, _ in redis_params
+            ],
+            [
+                query_id,
+                now,
+                state.max_query_duration_s,
+                state.rate_lookback_s,
+                rate_history_s,
+                *(
+                    "" if limit is None else limit
+                    for rate_limit_param, _ in redis_params
+                    for limit in [
+                        rate_limit_param.per_second_limit,
+                        rate_limit_param.concurrent_limit,
+                    ]
+                ),
+            ],
+            client=pipe,
+        )
+
+        try:
+            rejected, *counts = pipe.execute()[-1]
+        except Exception as ex:
+            logger.exception(ex)
+            # fail open if redis is having issues
+            self.stack.callback(
+                self.__exit_local, query_id, local_params, sync_interval
+            )
+            return
+
+        for i, (rate_limit_param, local_bucket) in enumerate(redis_params):
+            historical, concurrent = int(counts[2 * i]), int(counts[2 * i + 1])
+            if local_bucket is not None:
+                local_bucket.sync(now, historical, concurrent)
+
+            per_second = historical / float(state.rate_lookback_s)
+            stats.add_stats(
+                rate_limit_param.rate_limit_name,
+                RateLimitStats(rate=per_second, concurrent=concurrent),
+            )
+
+            if rejected == i + 1:
+                # The query was not added to any of the buckets.
+                for _, local_bucket in local_params:
+                    local_bucket.discard(query_id, now)
+                _check_limits(rate_limit_param, per_second, concurrent)
+                raise RateLimitExceeded(f"{rate_limit_param.rate_limit_name} limit")
+
+        self.stack.callback(self.__exit_local, query_id, local_params, sync_interval)
+        self.stack.callback(self.__exit_redis, query_id, redis_params)
+
+    def __exit_redis(
+        self,
+        query_id: str,
+        redis_params: Sequence[Tuple[RateLimitParameters, Optional[LocalBucket]]],
+    ) -> None:
+        # The query was added to every bucket checked in Redis, so they are
+        # all returned to its start time at once.
+        pipe = state.rds.pipeline(transaction=False)
+        for rate_limit_param, local_bucket in redis_params:
+            if local_bucket is not None:
+                local_bucket.release_synced()
+            pipe.zincrby(
+                "{}{}".format(state.ratelimit_prefix, rate_limit_param.bucket),
+                query_id,
+                -float(state.max_query_duration_s),
+            )
+
+        try:
+            pipe.execute()
+        except Exception as ex:
+            logger.exception(ex)
+
+    def __exit_local(
+        self,
+        query_id: str,
+        local_params: Sequence[Tuple[RateLimitParameters, LocalBucket]],
+        sync_interval: float,
+    ) -> None:
+        finished_at = time.time()
+        for rate_limit_param, local_bucket in local_params:
+            local_bucket.release(query_id, finished_at)
+            # Processes that stopped receiving queries still write the
+            # queries they admitted to Redis.
+            if local_bucket.is_sync_due(finished_at, sync_interval):
+                _flush_local_bucket(
+                    local_bucket,
+                    "{}{}".format(state.ratelimit_prefix, rate_limit_param.bucket),
+                )
+
     def __exit__(
         self,
         exc_type: Optional[Type[BaseException]],
@@ -0,0 +1,48 @@
+-- Evaluates the rate limits of several buckets at once, and only adds the
+-- query to the buckets if none of their limits is exceeded.
+--
+-- KEYS[n]: The sorted set of each rate limiting bucket.
+-- ARGV[1]: The query ID.
+-- ARGV[2]: The current time.
+-- ARGV[3]: The maximum query duration (how far ahead running queries go.)
+-- ARGV[4]: The window used to compute the per-second rate.
+-- ARGV[5]: The history kept in the buckets.
+-- ARGV[4 + 2n]: The per-second limit of each bucket (empty if none.)
+-- ARGV[5 + 2n]: The concurrent limit of each bucket (empty if none.)
+--
+-- Returns the index of the first bucket whose limit was exceeded (0 if
+-- none), followed by the historical and concurrent counts of each bucket
+-- (including the query itself in the concurrent count.)
+
+local query_id = ARGV[1]
+local now = tonumber(ARGV[2])
+local max_query_duration = tonumber(ARGV[3])
+local rate_lookback = tonumber(ARGV[4])
+local rate_history = tonumber(ARGV[5])
+
+local result = {0}
+for i, bucket in ipairs(KEYS) do
+    redis.call('ZREMRANGEBYSCORE', bucket, '-inf', string.format('(%f', now - rate_history))
+
+    local historical = redis.call('ZCOUNT', bucket, now - rate_lookback, now)
+    local concurrent = redis.call('ZCOUNT', bucket, string.format('(%f', now), '+inf') + 1
+    table.insert(result, historical)
+    table.insert(result, concurrent)
+
+    local per_second_limit = tonumber(ARGV[4 + 2 * i])
+    local concurrent_limit = tonumber(ARGV[5 + 2 * i])
+    if result[1] == 0 and (
+        (concurrent_limit and concurrent > concurrent_limit) or
+        (per_second_limit and historical / rate_lookback > per_second_limit)
+    ) then
+        result[1] = i
+    end
+end
+
+if result[1] == 0 then
+    for _, bucket in ipairs(KEYS) do
+        redis.call('ZADD', bucket, now + max_query_duration, query_id)
+    end
+end
+
+return result
@@ -10,7 +10,7 @@ from snuba.query.logical import Aggregation
 from snuba.query.types import Condition
 from snuba.request import Request
 from snuba.request.request_settings import SubscriptionRequestSettings
-from snuba.request.schema import Language, RequestSchema
+from snuba.request.schema import Language, get_request_schema
 from snuba.request.validation import build_request
 from snuba.utils.metrics.timer import Timer
 
@@ -77,10 +77,8 @@ class SubscriptionData:
         :param timestamp: Date that the query should run up until
         :param offset: Maximum offset we should query for
         """
-        schema = RequestSchema.build_with_extensions(
-            dataset.get_default_entity().get_extensions(),
-            SubscriptionRequestSettings,
-            Language.LEGACY,
+        schema = get_request_schema(
+            dataset.get_default_entity(), SubscriptionRequestSettings, Language.LEGACY,
         )
         extra_conditions: Sequence[Condition] = []
         if offset is not None:
@@ -47,3 +47,11 @@ class JSONCodec(Codec[str, JSONData]):
 
     def decode(self, value: str) -> JSONData:
         return rapidjson.loads(value)
+
+
+class JSONBytesCodec(Codec[bytes, JSONData]):
+    def encode(self, value: JSONData) -> bytes:
+        return rapidjson.dumps(value).encode("utf-8")
+
+    def decode(self, value: bytes) -> JSONData:
+        return rapidjson.loads(value)
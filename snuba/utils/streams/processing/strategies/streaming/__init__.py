@@ -1,10 +1,12 @@
 from .collect import CollectStep
 from .filter import FilterStep
+from .instrument import InstrumentedStep
 from .transform import ParallelTransformStep, TransformStep
 
 __all__ = [
     "CollectStep",
     "FilterStep",
+    "InstrumentedStep",
     "ParallelTransformStep",
     "TransformStep",
 ]
@@ -1,7 +1,18 @@
 import logging
 import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import Callable, Generic, Mapping, MutableMapping, Optional
+from typing import (
+    Callable,
+    Deque,
+    Generic,
+    Mapping,
+    MutableMapping,
+    Optional,
+    Tuple,
+    Union,
+)
 
 from snuba.utils.streams.processing.strategies.abstract import (
     ProcessingStrategy as ProcessingStep,
@@ -71,6 +82,17 @@ class Batch(Generic[TPayload]):
 
     def join(self, timeout: Optional[float] = None) -> None:
         self.__step.join(timeout)
+        self.commit()
+
+    def flush(self) -> None:
+        """
+        Close the batch and wait for the step to finish processing it,
+        without committing the offsets of the batch.
+        """
+        self.close()
+        self.__step.join()
+
+    def commit(self) -> None:
         offsets = {
             partition: offsets.hi for partition, offsets in self.__offsets.items()
         }
@@ -82,14 +104,27 @@ class CollectStep(ProcessingStep[TPayload]):
     """
     Collects messages into batches, periodically closing the batch and
     committing the offsets once the batch has successfully been closed.
+
+    By default, closing a batch blocks until the step of the batch has
+    finished processing it. If ``max_pending_batches`` is greater than zero,
+    closed batches are flushed in background threads instead, so that a new
+    batch can be collected while up to ``max_pending_batches`` previous
+    batches are still being processed. The offsets of pending batches are
+    committed in the order the batches were closed, and only after the
+    batch has been completely processed.
+
+    The maximum batch size can be provided as a function instead of a
+    constant, in which case it is evaluated whenever the size of the current
+    batch is checked, allowing the batch size to be adjusted over time.
     """
 
     def __init__(
         self,
         step_factory: Callable[[], ProcessingStep[TPayload]],
         commit_function: Callable[[Mapping[Partition, int]], None],
-        max_batch_size: int,
+        max_batch_size: Union[int, Callable[[], int]],
         max_batch_time: float,
+        max_pending_batches: int = 0,
     ) -> None:
         self.__step_factory = step_factory
         self.__commit_function = commit_function
@@ -99,14 +134,52 @@ class CollectStep(ProcessingStep[TPayload]):
         self.__batch: Optional[Batch[TPayload]] = None
         self.__closed = False
 
+        self.__max_pending_batches = max_pending_batches
+        self.__pending: Deque[Tuple[Batch[TPayload], Future[None]]] = deque()
+        self.__executor = (
+            ThreadPoolExecutor(max_workers=max_pending_batches)
+            if max_pending_batches > 0
+            else None
+        )
+
     def __close_and_reset_batch(self) -> None:
         assert self.__batch is not None
-        self.__batch.close()
-        self.__batch.join()
-        logger.info("Completed processing %r.", self.__batch)
+        if self.__executor is None:
+            self.__batch.close()
+            self.__batch.join()
+            logger.info("Completed processing %r.", self.__batch)
+        else:
+            # Wait for a slot to become available before starting to flush
+            # the batch, which limits the number of batches in flight.
+            while len(self.__pending) >= self.__max_pending_batches:
+                self.__commit_pending_batch()
+
+            self.__pending.append(
+                (self.__batch, self.__executor.submit(self.__batch.flush))
+            )
         self.__batch = None
 
+    def __commit_pending_batch(self, timeout: Optional[float] = None) -> None:
+        batch, future = self.__pending[0]
+        # This raises any exception that was raised while flushing the batch.
+        future.result(timeout)
+        batch.commit()
+        logger.info("Completed processing %r.", batch)
+        self.__pending.popleft()
+
+    def __commit_completed_batches(self) -> None:
+        while self.__pending and self.__pending[0][1].done():
+            self.__commit_pending_batch()
+
+    def __get_max_batch_size(self) -> int:
+        if isinstance(self.__max_batch_size, int):
+            return self.__max_batch_size
+        else:
+            return self.__max_batch_size()
+
     def poll(self) -> None:
+        self.__commit_completed_batches()
+
         if self.__batch is None:
             return
 
@@ -114,7 +187,7 @@ class CollectStep(ProcessingStep[TPayload]):
 
         # XXX: This adds a substantially blocking operation to the ``poll``
         # method which is bad.
-        if len(self.__batch) >= self.__max_batch_size:
+        if len(self.__batch) >= self.__get_max_batch_size():
             logger.debug("Size limit reached, closing %r...", self.__batch)
             self.__close_and_reset_batch()
         elif self.__batch.duration() >= self.__max_batch_time:
@@ -134,7 +207,10 @@ class CollectStep(ProcessingStep[TPayload]):
 
         if self.__batch is not None:
             logger.debug("Closing %r...", self.__batch)
-            self.__batch.close()
+            if self.__executor is None:
+                self.__batch.close()
+            else:
+                self.__close_and_reset_batch()
 
     def terminate(self) -> None:
         self.__closed = True
@@ -142,8 +218,26 @@ class CollectStep(ProcessingStep[TPayload]):
         if self.__batch is not None:
             self.__batch.terminate()
 
+        for batch, _ in self.__pending:
+            batch.terminate()
+
+        if self.__executor is not None:
+            self.__executor.shutdown(wait=False)
+
     def join(self, timeout: Optional[float] = None) -> None:
+        deadline = time.time() + timeout if timeout is not None else None
+
+        while self.__pending:
+            self.__commit_pending_batch(
+                max(deadline - time.time(), 0) if deadline is not None else None
+            )
+
+        if self.__executor is not None:
+            self.__executor.shutdown()
+
         if self.__batch is not None:
-            self.__batch.join(timeout)
+            self.__batch.join(
+                max(deadline - time.time(), 0) if deadline is not None else None
+            )
             logger.info("Completed processing %r.", self.__batch)
             self.__batch = None
@@ -0,0 +1,95 @@
+import time
+from typing import Callable, MutableMapping, Optional
+
+from snuba.utils.metrics import MetricsBackend
+from snuba.utils.streams.processing.strategies.abstract import (
+    ProcessingStrategy as ProcessingStep,
+)
+from snuba.utils.streams.types import Message, TPayload
+
+
+class InstrumentedStep(ProcessingStep[TPayload]):
+    """
+    Measures the number of messages submitted to a processing step and the
+    time spent in each of its methods.
+
+    Since steps are typically called for every message, measurements are
+    accumulated in memory and only reported every ``interval`` seconds (and
+    when the step is joined or terminated) rather than for every call. Each
+    report includes the number of messages submitted (``messages``), the
+    throughput (``messages_per_second``) and, for each method, the fraction
+    of time that was spent in it (``<method>.utilization``) since the
+    previous report.
+    """
+
+    def __init__(
+        self,
+        step: ProcessingStep[TPayload],
+        metrics: MetricsBackend,
+        interval: float = 10.0,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.__step = step
+        self.__metrics = metrics
+        self.__interval = interval
+        self.__clock = clock
+
+        self.__messages = 0
+        self.__durations: MutableMapping[str, float] = {}
+        self.__last_report = clock()
+
+    def __record(self, method: str, start: float) -> None:
+        finish = self.__clock()
+        self.__durations[method] = self.__durations.get(method, 0.0) + (finish - start)
+        if finish - self.__last_report >= self.__interval:
+            self.__report(finish)
+
+    def __report(self, now: float) -> None:
+        elapsed = now - self.__last_report
+        if not elapsed > 0:
+            return
+
+        self.__metrics.increment("messages", self.__messages)
+        self.__metrics.gauge("messages_per_second", self.__messages / elapsed)
+        for method, duration in self.__durations.items():
+            self.__metrics.gauge(f"{method}.utilization", duration / elapsed)
+
+        self.__messages = 0
+        self.__durations.clear()
+        self.__last_report = now
+
+    def poll(self) -> None:
+        start = self.__clock()
+        try:
+            self.__step.poll()
+        finally:
+            self.__record("poll", start)
+
+    def submit(self, message: Message[TPayload]) -> None:
+        start = self.__clock()
+        try:
+            self.__step.submit(message)
+            self.__messages += 1
+        finally:
+            self.__record("submit", start)
+
+    def close(self) -> None:
+        start = self.__clock()
+        try:
+            self.__step.close()
+        finally:
+            self.__record("close", start)
+
+    def terminate(self) -> None:
+        self.__step.terminate()
+        self.__report(self.__clock())
+
+    def join(self, timeout: Optional[float] = None) -> None:
+        start = self.__clock()
+        try:
+            self.__step.join(timeout)
+        finally:
+            self.__durations["join"] = self.__durations.get("join", 0.0) + (
+                self.__clock() - start
+            )
+            self.__report(self.__clock())
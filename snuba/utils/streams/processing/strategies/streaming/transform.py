@@ -1,14 +1,17 @@
+import ctypes
 import logging
 import multiprocessing
 import pickle
 import signal
 import time
+import weakref
 from collections import deque
 from multiprocessing.managers import SharedMemoryManager
 from multiprocessing.pool import AsyncResult, Pool
 from multiprocessing.shared_memory import SharedMemory
 from pickle import PickleBuffer
 from typing import (
+    Any,
     Callable,
     Deque,
     Generic,
@@ -109,6 +112,13 @@ class MessageBatch(Generic[TPayload]):
     def __len__(self) -> int:
         return len(self.__items)
 
+    def get_content_size(self) -> int:
+        """
+        Get the number of bytes of the shared memory block that are used by
+        the messages in this batch.
+        """
+        return self.__offset
+
     def __getitem__(self, index: int) -> Message[TPayload]:
         """
         Get a message in this batch by its index.
@@ -116,9 +126,12 @@ class MessageBatch(Generic[TPayload]):
         The message returned by this method is effectively a copy of the
         original message within this batch, and may be safely passed
         around without requiring any special accomodation to keep the shared
-        block open or free from conflicting updates.
+        block open or free from conflicting updates. (See ``iter_views`` to
+        access messages without copying them.)
         """
         data, buffers = self.__items[index]
+        buf = self.block.buf
+        assert buf is not None
         # The buffers read from the shared memory block are converted to
         # ``bytes`` rather than being forwarded as ``memoryview`` for two
         # reasons. First, true buffer support protocol is still pretty rare (at
@@ -136,8 +149,7 @@ class MessageBatch(Generic[TPayload]):
         return pickle.loads(
             data,
             buffers=[
-                self.block.buf[offset : offset + length].tobytes()
-                for offset, length in buffers
+                buf[offset : offset + length].tobytes() for offset, length in buffers
             ],
         )
 
@@ -151,7 +163,48 @@ class MessageBatch(Generic[TPayload]):
         for i in range(len(self.__items)):
             yield self[i]
 
-    def append(self, message: Message[TPayload]) -> None:
+    def iter_views(self, release: Callable[[], None]) -> Iterator[Message[TPayload]]:
+        """
+        Iterate through the messages contained in this batch without copying
+        their out-of-band buffers out of the shared memory block.
+
+        Unlike ``__getitem__``, the buffers of the messages yielded by the
+        iterator returned by this method are ``memoryview`` instances that
+        reference the shared memory block directly. The block must not be
+        written to until all of these buffers (and any ``memoryview`` derived
+        from them) have been garbage collected, at which point the
+        ``release`` callback is invoked. The callback may be invoked from any
+        thread that drops the last reference to a buffer.
+        """
+        if self.__offset == 0:
+            # Nothing was written to the shared memory block, so every
+            # message is already a copy of the original.
+            release()
+            yield from self
+            return
+
+        # All buffers are sliced from a single ``ctypes`` array that exports
+        # the used region of the block. The array is kept alive by every
+        # ``memoryview`` that is derived from it (unlike a ``memoryview``,
+        # which can be collected while views derived from it are still in
+        # use), so its finalizer is only invoked once nothing can read the
+        # block anymore.
+        buf = self.block.buf
+        assert buf is not None
+        region = (ctypes.c_char * self.__offset).from_buffer(buf)
+        finalizer = weakref.finalize(region, release)
+        finalizer.atexit = False
+
+        view = memoryview(region).cast("B")  # type: ignore
+        del region
+
+        for data, buffers in self.__items:
+            yield pickle.loads(
+                data,
+                buffers=[view[offset : offset + length] for offset, length in buffers],
+            )
+
+    def append(self, message: Message[TPayload], in_band: bool = False) -> None:
         """
         Add a message to this batch.
 
@@ -162,7 +215,18 @@ class MessageBatch(Generic[TPayload]):
         enough space in the shared memory block to write all buffers to be
         transferred out-of-band, this method will raise a ``ValueTooLarge``
         error.
+
+        If ``in_band`` is set, the message is serialized without writing
+        anything to the shared memory block instead, which is slower but
+        does not require any space in the block.
         """
+        if in_band:
+            self.__items.append((pickle.dumps(message, protocol=5), []))
+            return
+
+        buf = self.block.buf
+        assert buf is not None
+
         buffers: MutableSequence[Tuple[int, int]] = []
 
         def buffer_callback(buffer: PickleBuffer) -> None:
@@ -173,7 +237,7 @@ class MessageBatch(Generic[TPayload]):
                 raise ValueTooLarge(
                     f"value exceeds available space in block, {length} bytes needed but {self.block.size - offset} bytes free"
                 )
-            self.block.buf[offset : offset + length] = value
+            buf[offset : offset + length] = value
             self.__offset += length
             buffers.append((offset, length))
 
@@ -214,14 +278,89 @@ def parallel_transform_worker_initializer() -> None:
     signal.signal(signal.SIGINT, signal.SIG_IGN)
 
 
+# The maximum number of messages that are transformed with a single call
+# to the batch function of a ``ParallelTransformStep``.
+BATCH_FUNCTION_MAX_MESSAGES = 100
+
+
+def _apply_batch_function(
+    batch_function: Callable[[Sequence[Message[TPayload]]], Sequence[TTransformed]],
+    input_batch: MessageBatch[TPayload],
+    output_batch: MessageBatch[TTransformed],
+    start_index: int,
+) -> int:
+    """
+    Transforms the messages of the input batch starting at the provided
+    index with the batch function, a slice of messages at a time, until the
+    output batch is full. Returns the index of the first message that was
+    not transformed.
+
+    Since the batch function may have side effects, its results are never
+    discarded: the results of the slice that filled the output block are
+    appended to the output batch in band.
+    """
+    i = start_index
+    while i < len(input_batch):
+        messages = [
+            input_batch[j]
+            for j in range(i, min(i + BATCH_FUNCTION_MAX_MESSAGES, len(input_batch)))
+        ]
+        try:
+            results = batch_function(messages)
+        except Exception:
+            logger.warning(
+                "Caught exception while applying %r to %r messages!",
+                batch_function,
+                len(messages),
+                exc_info=True,
+            )
+            raise
+
+        assert len(results) == len(messages)
+
+        full = False
+        for message, result in zip(messages, results):
+            transformed = Message(
+                message.partition, message.offset, result, message.timestamp
+            )
+            if not full:
+                try:
+                    output_batch.append(transformed)
+                    continue
+                except ValueTooLarge:
+                    # As when transforming messages one at a time, a value
+                    # that does not fit in an empty block never will.
+                    if len(output_batch) == 0:
+                        raise
+                    full = True
+            output_batch.append(transformed, in_band=True)
+
+        i += len(messages)
+        if full:
+            break
+
+    return i
+
+
 def parallel_transform_worker_apply(
     function: Callable[[Message[TPayload]], TTransformed],
     input_batch: MessageBatch[TPayload],
     output_block: SharedMemory,
     start_index: int = 0,
+    batch_function: Optional[
+        Callable[[Sequence[Message[TPayload]]], Sequence[TTransformed]]
+    ] = None,
 ) -> Tuple[int, MessageBatch[TTransformed]]:
     output_batch: MessageBatch[TTransformed] = MessageBatch(output_block)
 
+    if batch_function is not None:
+        return (
+            _apply_batch_function(
+                batch_function, input_batch, output_batch, start_index
+            ),
+            output_batch,
+        )
+
     i = start_index
     while i < len(input_batch):
         message = input_batch[i]
@@ -262,6 +401,27 @@ def parallel_transform_worker_apply(
 
 
 class ParallelTransformStep(ProcessingStep[TPayload]):
+    """
+    Transforms messages in a pool of worker processes, submitting the
+    transformed values to the next processing step.
+
+    Transformed messages are submitted to the next step without copying
+    their out-of-band buffers out of the shared memory block they were
+    written to by the worker (see ``MessageBatch.iter_views``.) An output
+    block is only reused once all of the messages that reference it have
+    been released by the following steps, and additional output blocks are
+    allocated while all of the existing ones are still referenced, up to
+    ``max_output_blocks`` (by default, three blocks per process.) Once all
+    of them are referenced, batches are not submitted to the workers and
+    messages are rejected until the following steps release a block.
+
+    If a ``batch_function`` is provided, workers transform the messages of
+    a batch with calls to it on up to ``BATCH_FUNCTION_MAX_MESSAGES``
+    messages at a time (which must return one result per message, in
+    order) instead of calling ``function`` for each message. Each message
+    is only passed to the batch function once.
+    """
+
     def __init__(
         self,
         function: Callable[[Message[TPayload]], TTransformed],
@@ -272,11 +432,18 @@ class ParallelTransformStep(ProcessingStep[TPayload]):
         input_block_size: int,
         output_block_size: int,
         metrics: MetricsBackend,
+        batch_function: Optional[
+            Callable[[Sequence[Message[TPayload]]], Sequence[TTransformed]]
+        ] = None,
+        max_output_blocks: Optional[int] = None,
     ) -> None:
         self.__transform_function = function
+        self.__batch_transform_function = batch_function
         self.__next_step = next_step
         self.__max_batch_size = max_batch_size
         self.__max_batch_time = max_batch_time
+        self.__output_block_size = output_block_size
+        self.__metrics = metrics
 
         self.__shared_memory_manager = SharedMemoryManager()
         self.__shared_memory_manager.start()
@@ -292,17 +459,30 @@ class ParallelTransformStep(ProcessingStep[TPayload]):
             for _ in range(processes)
         ]
 
+        # Output blocks are returned to this list by finalizers, which may
+        # run on any thread. This relies on ``append`` and ``pop`` being
+        # atomic.
         self.__output_blocks = [
             self.__shared_memory_manager.SharedMemory(output_block_size)
             for _ in range(processes)
         ]
+        self.__output_block_count = processes
+        self.__max_output_blocks = (
+            max_output_blocks if max_output_blocks is not None else processes * 3
+        )
+        assert self.__max_output_blocks >= processes
 
         self.__batch_builder: Optional[BatchBuilder[TPayload]] = None
 
+        # Each input batch is stored with the index of the first message that
+        # has not been transformed yet, and the result of the task that is
+        # transforming it (or None if the task is waiting for an output
+        # block.)
         self.__results: Deque[
             Tuple[
                 MessageBatch[TPayload],
-                AsyncResult[Tuple[int, MessageBatch[TTransformed]]],
+                int,
+                Optional[AsyncResult[Tuple[int, MessageBatch[TTransformed]]]],
             ]
         ] = deque()
 
@@ -310,24 +490,65 @@ class ParallelTransformStep(ProcessingStep[TPayload]):
 
         self.__closed = False
 
+    def __get_output_block(self) -> Optional[SharedMemory]:
+        try:
+            return self.__output_blocks.pop()
+        except IndexError:
+            if self.__output_block_count >= self.__max_output_blocks:
+                return None
+
+            logger.debug(
+                "All output blocks are still referenced, allocating a new block..."
+            )
+            self.__output_block_count += 1
+            self.__metrics.gauge("output_blocks", self.__output_block_count)
+            return self.__shared_memory_manager.SharedMemory(self.__output_block_size)
+
+    def __apply(
+        self, input_batch: MessageBatch[TPayload], start_index: int
+    ) -> "Optional[AsyncResult[Tuple[int, MessageBatch[Any]]]]":
+        """
+        Submits the messages of the batch starting at the provided index to
+        the pool, or returns None if there is no output block available.
+        """
+        output_block = self.__get_output_block()
+        if output_block is None:
+            return None
+
+        return self.__pool.apply_async(
+            parallel_transform_worker_apply,
+            (
+                self.__transform_function,
+                input_batch,
+                output_block,
+                start_index,
+                self.__batch_transform_function,
+            ),
+        )
+
     def __submit_batch(self) -> None:
         assert self.__batch_builder is not None
         batch = self.__batch_builder.build()
+        result = self.__apply(batch, 0)
+        if result is None:
+            raise MessageRejected("no available output blocks")
+
         logger.debug("Submitting %r to %r...", batch, self.__pool)
-        self.__results.append(
-            (
-                batch,
-                self.__pool.apply_async(
-                    parallel_transform_worker_apply,
-                    (self.__transform_function, batch, self.__output_blocks.pop()),
-                ),
-            )
-        )
+        self.__results.append((batch, 0, result))
         self.__batches_in_progress.increment()
         self.__batch_builder = None
 
+    def __has_pending_batch(self) -> bool:
+        return self.__batch_builder is not None and len(self.__batch_builder) > 0
+
     def __check_for_results(self, timeout: Optional[float] = None) -> None:
-        input_batch, result = self.__results[0]
+        input_batch, start_index, result = self.__results[0]
+
+        if result is None:
+            result = self.__apply(input_batch, start_index)
+            if result is None:
+                raise MessageRejected("no available output blocks")
+            self.__results[0] = (input_batch, start_index, result)
 
         # If this call is being made in a context where it is intended to be
         # nonblocking, checking if the result is ready (rather than trying to
@@ -339,8 +560,16 @@ class ParallelTransformStep(ProcessingStep[TPayload]):
 
         i, output_batch = result.get(timeout=timeout)
 
+        self.__metrics.timing(
+            "output_block_utilization",
+            output_batch.get_content_size() / output_batch.block.size,
+        )
+
         # TODO: This does not handle rejections from the next step!
-        for message in output_batch:
+        output_block = output_batch.block
+        for message in output_batch.iter_views(
+            lambda: self.__output_blocks.append(output_block)
+        ):
             self.__next_step.poll()
             self.__next_step.submit(message)
 
@@ -353,18 +582,19 @@ class ParallelTransformStep(ProcessingStep[TPayload]):
             # to the processed index even though the values at those indices
             # will never be unpacked. It probably makes sense to remove that
             # data from the batch to avoid unnecessary serialization overhead.
-            self.__results[0] = (
-                input_batch,
-                self.__pool.apply_async(
-                    parallel_transform_worker_apply,
-                    (self.__transform_function, input_batch, output_batch.block, i,),
-                ),
-            )
+            # The previous output block may still be referenced by messages
+            # that were submitted to the next step, so it can't be reused. If
+            # no other block is available, the batch is resubmitted once one
+            # is released.
+            self.__results[0] = (input_batch, i, self.__apply(input_batch, i))
             return
 
-        logger.debug("Completed %r, reclaiming blocks...", input_batch)
+        logger.debug("Completed %r, reclaiming input block...", input_batch)
+        self.__metrics.timing(
+            "input_block_utilization",
+            input_batch.get_content_size() / input_batch.block.size,
+        )
         self.__input_blocks.append(input_batch.block)
-        self.__output_blocks.append(output_batch.block)
         self.__batches_in_progress.decrement()
 
         del self.__results[0]
@@ -375,11 +605,16 @@ class ParallelTransformStep(ProcessingStep[TPayload]):
         while self.__results:
             try:
                 self.__check_for_results(timeout=0)
-            except multiprocessing.TimeoutError:
+            except (multiprocessing.TimeoutError, MessageRejected):
                 break
 
         if self.__batch_builder is not None and self.__batch_builder.ready():
-            self.__submit_batch()
+            try:
+                self.__submit_batch()
+            except MessageRejected:
+                # The batch is submitted on a later call, once the next step
+                # has released an output block.
+                pass
 
     def __reset_batch_builder(self) -> None:
         try:
@@ -402,10 +637,9 @@ class ParallelTransformStep(ProcessingStep[TPayload]):
             self.__batch_builder.append(message)
         except ValueTooLarge as e:
             logger.debug("Caught %r, closing batch and retrying...", e)
-            self.__submit_batch()
-
-            # This may raise ``MessageRejected`` (if all of the shared memory
+            # These may raise ``MessageRejected`` (if all of the shared memory
             # is in use) and create backpressure.
+            self.__submit_batch()
             self.__reset_batch_builder()
             assert self.__batch_builder is not None
 
@@ -417,8 +651,12 @@ class ParallelTransformStep(ProcessingStep[TPayload]):
     def close(self) -> None:
         self.__closed = True
 
-        if self.__batch_builder is not None and len(self.__batch_builder) > 0:
-            self.__submit_batch()
+        if self.__has_pending_batch():
+            try:
+                self.__submit_batch()
+            except MessageRejected:
+                # The batch is submitted while joining.
+                pass
 
     def terminate(self) -> None:
         self.__closed = True
@@ -436,10 +674,31 @@ class ParallelTransformStep(ProcessingStep[TPayload]):
         deadline = time.time() + timeout if timeout is not None else None
 
         logger.debug("Waiting for %s batches...", len(self.__results))
-        while self.__results:
-            self.__check_for_results(
-                timeout=max(deadline - time.time(), 0) if deadline is not None else None
-            )
+        while self.__results or self.__has_pending_batch():
+            if self.__has_pending_batch():
+                try:
+                    self.__submit_batch()
+                except MessageRejected:
+                    pass
+
+            if self.__results:
+                try:
+                    self.__check_for_results(
+                        timeout=max(deadline - time.time(), 0)
+                        if deadline is not None
+                        else None
+                    )
+                    continue
+                except MessageRejected:
+                    pass
+
+            # All of the output blocks are still referenced by messages that
+            # were submitted to the next step, which should release them as it
+            # makes progress.
+            if deadline is not None and time.time() >= deadline:
+                raise multiprocessing.TimeoutError()
+            self.__next_step.poll()
+            time.sleep(0.01)
 
         self.__pool.close()
 
@@ -449,9 +708,11 @@ class ParallelTransformStep(ProcessingStep[TPayload]):
         # wrong (i.e. we lost track of a task)
         self.__pool.join()
 
-        self.__shared_memory_manager.shutdown()
-
         self.__next_step.close()
         self.__next_step.join(
             timeout=max(deadline - time.time(), 0) if deadline is not None else None
         )
+
+        # The next step may still reference the output blocks until it has
+        # been joined.
+        self.__shared_memory_manager.shutdown()
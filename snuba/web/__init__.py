@@ -1,3 +1,4 @@
+from operator import itemgetter
 from typing import Any, Mapping, NamedTuple
 
 from mypy_extensions import TypedDict
@@ -32,11 +33,21 @@ def transform_column_names(result: QueryResult, mapping: Mapping[str, str]) -> N
     """
     Replaces the column names in a ResultSet object in place.
     """
-
-    transform_rows(
-        result.result,
-        lambda row: {mapping.get(key, key): value for key, value in row.items()},
-    )
+    names = [c["name"] for c in result.result["meta"]]
+    new_names = [mapping.get(name, name) for name in names]
+
+    # Rows only need to be rebuilt when some column is renamed. When they
+    # are, the values are looked up by the names in the metadata (which are
+    # the keys of every row) rather than by going through every row item.
+    if new_names != names:
+        if len(names) == 1:
+            [name] = names
+            transform_rows(result.result, lambda row: {new_names[0]: row[name]})
+        else:
+            get_values = itemgetter(*names)
+            transform_rows(
+                result.result, lambda row: dict(zip(new_names, get_values(row)))
+            )
 
     result.result["meta"] = [
         Column(name=mapping.get(c["name"], c["name"]), type=c["type"])
@@ -0,0 +1,342 @@
+import calendar
+import copy
+import logging
+from dataclasses import dataclass, replace
+from datetime import datetime, timedelta
+from typing import (
+    Callable,
+    Mapping,
+    MutableMapping,
+    MutableSequence,
+    Optional,
+    Sequence,
+)
+
+from snuba.clickhouse.query import Query
+from snuba.clickhouse.query_dsl.accessors import get_time_range
+from snuba.query import OrderByDirection
+from snuba.query.conditions import (
+    ConditionFunctions,
+    combine_and_conditions,
+    get_first_level_and_conditions,
+)
+from snuba.query.expressions import Expression
+from snuba.query.expressions import FunctionCall as FunctionCallExpr
+from snuba.query.expressions import Literal as LiteralExpr
+from snuba.query.matchers import (
+    Any,
+    Column,
+    FunctionCall,
+    Literal,
+    Or,
+    Param,
+    String,
+)
+from snuba.reader import Result, Row
+from snuba.state.cache.abstract import Cache
+from snuba.utils.codecs import JSONData
+
+logger = logging.getLogger(__name__)
+
+
+# The granularity of the time bucket functions produced by the
+# ``TimeSeriesProcessor`` (other than the generic ``toDateTime`` one.)
+BUCKET_FUNCTION_GRANULARITIES: Mapping[str, int] = {
+    "toStartOfMinute": 60,
+    "toStartOfHour": 3600,
+    "toDate": 86400,
+}
+
+_TIMESTAMP_COLUMN = Column(None, Param("column_name", Any(str)))
+
+BUCKET_PATTERN = Or(
+    [
+        FunctionCall(
+            Param(
+                "function_name",
+                Or([String(name) for name in BUCKET_FUNCTION_GRANULARITIES]),
+            ),
+            (_TIMESTAMP_COLUMN, Literal(String("Universal"))),
+        ),
+        FunctionCall(
+            String("toDateTime"),
+            (
+                FunctionCall(
+                    String("multiply"),
+                    (
+                        FunctionCall(
+                            String("intDiv"),
+                            (
+                                FunctionCall(String("toUInt32"), (_TIMESTAMP_COLUMN,)),
+                                Literal(Param("granularity", Any(int))),
+                            ),
+                        ),
+                        Literal(Any(int)),
+                    ),
+                ),
+                Literal(String("Universal")),
+            ),
+        ),
+    ]
+)
+
+
+@dataclass(frozen=True)
+class TimeSeries:
+    """
+    Describes a query that groups its results by time bucket. Since every
+    group only contains the rows of one bucket, the rows returned for a
+    bucket do not depend on the rest of the time range of the query.
+    """
+
+    timestamp_column: str
+    # The alias of the time bucket column in the results.
+    bucket_alias: str
+    granularity: timedelta
+    start: datetime
+    end: datetime
+    descending: bool
+
+
+def get_time_series(query: Query) -> Optional[TimeSeries]:
+    """
+    Returns the time series that the query computes if its results can be
+    built from the results of each time bucket, otherwise returns None.
+
+    This requires the query to group by a single time bucket expression
+    and, since the results of the buckets are concatenated, to not be
+    sorted by anything else than that expression. Queries with totals,
+    offsets or LIMIT BY clauses are not supported.
+    """
+    if query.has_totals() or query.get_offset() or query.get_limitby() is not None:
+        return None
+
+    bucket_expression: Optional[Expression] = None
+    for expression in query.get_groupby_from_ast():
+        match = BUCKET_PATTERN.match(expression)
+        if match is None:
+            continue
+        elif bucket_expression is not None:
+            return None
+
+        bucket_expression = expression
+        granularity = (
+            BUCKET_FUNCTION_GRANULARITIES[match.string("function_name")]
+            if match.contains("function_name")
+            else match.integer("granularity")
+        )
+        timestamp_column = match.string("column_name")
+
+    if bucket_expression is None:
+        return None
+
+    orderby = query.get_orderby_from_ast()
+    if any(item.expression != bucket_expression for item in orderby):
+        return None
+
+    bucket_alias = next(
+        (
+            selected.expression.alias
+            for selected in query.get_selected_columns_from_ast()
+            if selected.expression == bucket_expression
+        ),
+        None,
+    )
+    if bucket_alias is None:
+        return None
+
+    start, end = get_time_range(query, timestamp_column)
+    if start is None or end is None:
+        return None
+
+    return TimeSeries(
+        timestamp_column,
+        bucket_alias,
+        timedelta(seconds=granularity),
+        start,
+        end,
+        bool(orderby) and orderby[0].direction == OrderByDirection.DESC,
+    )
+
+
+def _floor(value: datetime, granularity: timedelta) -> datetime:
+    timestamp = calendar.timegm(value.utctimetuple())
+    return datetime.utcfromtimestamp(
+        timestamp - timestamp % int(granularity.total_seconds())
+    )
+
+
+def _ceil(value: datetime, granularity: timedelta) -> datetime:
+    floor = _floor(value, granularity)
+    return floor if floor == value.replace(tzinfo=None) else floor + granularity
+
+
+def build_range_query(
+    query: Query, timestamp_column: str, start: datetime, end: datetime
+) -> Query:
+    """
+    Returns a copy of the query that only covers the provided time range.
+    """
+    pattern = FunctionCall(
+        Param(
+            "operator",
+            Or([String(ConditionFunctions.GTE), String(ConditionFunctions.LT)]),
+        ),
+        (
+            Param("column", Column(None, String(timestamp_column))),
+            Literal(Any(datetime)),
+        ),
+    )
+
+    def replace_bound(condition: Expression) -> Expression:
+        match = pattern.match(condition)
+        if match is None:
+            return condition
+
+        bound = start if match.string("operator") == ConditionFunctions.GTE else end
+        assert isinstance(condition, FunctionCallExpr)
+        return replace(
+            condition,
+            parameters=(match.expression("column"), LiteralExpr(None, bound)),
+        )
+
+    range_query = copy.deepcopy(query)
+    condition = range_query.get_condition_from_ast()
+    assert condition is not None
+    range_query.set_ast_condition(
+        combine_and_conditions(
+            [replace_bound(c) for c in get_first_level_and_conditions(condition)]
+        )
+    )
+    return range_query
+
+
+@dataclass
+class _QueryRange:
+    start: datetime
+    end: datetime
+    # The buckets that are entirely covered by this range, and are old
+    # enough to be stored in the cache once the range has been queried.
+    buckets: MutableSequence[datetime]
+
+
+def execute_with_bucket_cache(
+    query: Query,
+    time_series: TimeSeries,
+    cache: Cache[JSONData],
+    get_cache_key: Callable[[Query], str],
+    execute: Callable[[Query], Result],
+    mutable_window: timedelta,
+    now: datetime,
+    stats: MutableMapping[str, JSONData],
+) -> Optional[Result]:
+    """
+    Executes a time series query by reading the results of each of its time
+    buckets from the cache and only querying the ranges of buckets that are
+    missing from it. The buckets that end less than ``mutable_window``
+    before ``now``, and the partial buckets at the edges of the time range,
+    are always queried and never cached, since their rows can still change
+    (or depend on the exact time range of the query.)
+
+    The results of each bucket are cached under the key of the query of
+    that bucket alone (see ``get_cache_key``), so they can be reused by any
+    query that only differs in its time range.
+
+    Returns None if the query does not cover any bucket that can be cached,
+    or if the results of a range were truncated by the query limit, in which
+    case the query should be executed as usual.
+    """
+    column = time_series.timestamp_column
+    granularity = time_series.granularity
+
+    first_bucket = _ceil(time_series.start, granularity)
+    last_bucket = _floor(min(time_series.end, now - mutable_window), granularity)
+    if not first_bucket < last_bucket:
+        return None
+
+    buckets: MutableSequence[datetime] = []
+    bucket = first_bucket
+    while bucket < last_bucket:
+        buckets.append(bucket)
+        bucket += granularity
+
+    keys = {
+        bucket: get_cache_key(
+            build_range_query(query, column, bucket, bucket + granularity)
+        )
+        for bucket in buckets
+    }
+
+    cached: MutableMapping[datetime, Result] = {}
+    for bucket in buckets:
+        value = cache.get(keys[bucket])
+        if value is not None:
+            cached[bucket] = value
+
+    stats["bucket_cache_hits"] = len(cached)
+    stats["bucket_cache_misses"] = len(buckets) - len(cached)
+
+    ranges: MutableSequence[_QueryRange] = []
+
+    def add_range(start: datetime, end: datetime, buckets: Sequence[datetime]) -> None:
+        if not start < end:
+            return
+        elif ranges and ranges[-1].end == start:
+            ranges[-1].end = end
+            ranges[-1].buckets.extend(buckets)
+        else:
+            ranges.append(_QueryRange(start, end, [*buckets]))
+
+    add_range(time_series.start, first_bucket, [])
+    for bucket in buckets:
+        if bucket not in cached:
+            add_range(bucket, bucket + granularity, [bucket])
+    add_range(last_bucket, time_series.end, [])
+
+    meta = next((value["meta"] for value in cached.values()), None)
+    rows: MutableMapping[Optional[datetime], MutableSequence[Row]] = {
+        bucket: [*value["data"]] for bucket, value in cached.items()
+    }
+
+    limit = query.get_limit()
+    parsed_buckets: MutableMapping[str, datetime] = {}
+    for query_range in ranges:
+        result = execute(
+            build_range_query(query, column, query_range.start, query_range.end)
+        )
+        if limit is not None and len(result["data"]) >= limit:
+            logger.debug("Results of %r may have been truncated.", query_range)
+            return None
+
+        meta = result["meta"]
+        range_rows: MutableMapping[Optional[datetime], MutableSequence[Row]] = {}
+        for row in result["data"]:
+            value = row[time_series.bucket_alias]
+            if isinstance(value, str):
+                if value not in parsed_buckets:
+                    parsed_buckets[value] = datetime.fromisoformat(value).replace(
+                        tzinfo=None
+                    )
+                bucket_key: Optional[datetime] = parsed_buckets[value]
+            else:
+                bucket_key = None
+            range_rows.setdefault(bucket_key, []).append(row)
+
+        for bucket in query_range.buckets:
+            cache.set(keys[bucket], {"meta": meta, "data": range_rows.get(bucket, [])})
+
+        for bucket_key, bucket_rows in range_rows.items():
+            rows.setdefault(bucket_key, []).extend(bucket_rows)
+
+    assert meta is not None
+
+    ordered_buckets = sorted(
+        (bucket for bucket in rows if bucket is not None),
+        reverse=time_series.descending,
+    )
+    data = [row for bucket in ordered_buckets for row in rows[bucket]]
+    data.extend(rows.get(None, []))
+    if limit is not None:
+        del data[limit:]
+
+    return {"meta": meta, "data": data}
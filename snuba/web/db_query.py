@@ -2,15 +2,28 @@ from __future__ import annotations
 
 import logging
 from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from functools import partial, reduce
 from hashlib import md5
-from typing import Any, Mapping, MutableMapping, Optional, Set, Union
+from typing import (
+    Any,
+    Callable,
+    Iterator,
+    Mapping,
+    MutableMapping,
+    MutableSequence,
+    Optional,
+    Set,
+    Union,
+)
 
 import sentry_sdk
 from sentry_sdk.api import configure_scope
-from snuba import settings, state
+from snuba import environment, settings, state
 from snuba.clickhouse.errors import ClickhouseError
 from snuba.clickhouse.formatter.nodes import FormattedQuery
+from snuba.clickhouse.formatter.query import format_query
 from snuba.clickhouse.query import Query
 from snuba.clickhouse.query_profiler import generate_profile
 from snuba.query import ProcessableQuery
@@ -27,19 +40,92 @@ from snuba.reader import Reader, Result
 from snuba.redis import redis_client
 from snuba.request.request_settings import RequestSettings
 from snuba.state.cache.abstract import Cache
+from snuba.state.cache.codecs import CacheCompression, CompressingCodec
+from snuba.state.cache.local.backend import LocalCache
 from snuba.state.cache.redis.backend import RedisCache
+from snuba.state.cache.singleflight.backend import SingleflightCache
 from snuba.state.rate_limit import (
     PROJECT_RATE_LIMIT_NAME,
     RateLimitAggregator,
     RateLimitExceeded,
 )
 from snuba.util import force_bytes, with_span
-from snuba.utils.codecs import JSONCodec, JSONData
+from snuba.utils.codecs import Codec, JSONBytesCodec, JSONData
 from snuba.utils.metrics.timer import Timer
+from snuba.utils.metrics.wrapper import MetricsWrapper
 from snuba.web import QueryException, QueryResult
+from snuba.web.bucket_cache import execute_with_bucket_cache, get_time_series
+
+metrics = MetricsWrapper(environment.metrics, "db_query")
+
+
+def _build_cache_codec(name: str) -> Codec[bytes, JSONData]:
+    if settings.RESULT_CACHE_COMPRESSION is None:
+        return JSONBytesCodec()
+
+    return CompressingCodec(
+        JSONBytesCodec(),
+        CacheCompression(settings.RESULT_CACHE_COMPRESSION),
+        settings.RESULT_CACHE_COMPRESSION_MIN_SIZE,
+        MetricsWrapper(metrics, name),
+    )
 
-cache: Cache[JSONData] = RedisCache(
-    redis_client, "snuba-query-cache:", JSONCodec(), ThreadPoolExecutor()
+
+redis_cache: Cache[JSONData] = RedisCache(
+    redis_client,
+    "snuba-query-cache:",
+    _build_cache_codec("result_cache"),
+    ThreadPoolExecutor(),
+)
+
+
+# The approximate number of bytes taken by each value of a result. The size
+# of the results kept in the local cache is estimated from their number of
+# rows and columns, since encoding them to measure it would cost about as
+# much as reading them from Redis again.
+_ESTIMATED_RESULT_VALUE_SIZE = 32
+
+
+def _get_result_size(result: JSONData) -> int:
+    return (
+        (len(result["data"]) + 1)
+        * (len(result["meta"]) + 1)
+        * _ESTIMATED_RESULT_VALUE_SIZE
+    )
+
+
+def _copy_result(result: JSONData) -> JSONData:
+    # Results are modified in place after they are returned (see
+    # ``transform_column_names``), which replaces their rows but not the
+    # values in the rows.
+    return {**result, "data": [*result["data"]]}
+
+
+# Concurrent identical queries of the same process share the result of a
+# single read-through call rather than each waiting on Redis.
+cache: Cache[JSONData] = SingleflightCache(
+    LocalCache(
+        redis_cache,
+        settings.RESULT_CACHE_LOCAL_MAX_SIZE,
+        _get_result_size,
+        _copy_result,
+        metrics,
+    )
+    if settings.RESULT_CACHE_LOCAL_MAX_SIZE > 0
+    else redis_cache,
+    _copy_result,
+    metrics,
+)
+
+# Stores the results of each time bucket of time series queries (see
+# ``execute_query_with_bucket_caching``.)
+bucket_cache: Cache[JSONData] = RedisCache(
+    redis_client,
+    "snuba-bucket-cache:",
+    _build_cache_codec("bucket_cache"),
+    ThreadPoolExecutor(),
+    expiry_config_key="bucket_cache_expiry_sec",
+    default_expiry=3600,
 )
 
 logger = logging.getLogger("snuba.query")
@@ -205,16 +291,18 @@ def execute_query(
     return result
 
 
-@with_span(op="db")
-def execute_query_with_rate_limits(
-    clickhouse_query: Union[Query, CompositeQuery[Table]],
+@contextmanager
+def rate_limited(
     request_settings: RequestSettings,
-    formatted_query: FormattedQuery,
-    reader: Reader,
     timer: Timer,
     stats: MutableMapping[str, Any],
     query_settings: MutableMapping[str, Any],
-) -> Result:
+) -> Iterator[None]:
+    """
+    Counts the query against the rate limits of the request for the
+    duration of the block, and lowers the ``max_threads`` setting of the
+    query according to the concurrent queries of the project.
+    """
     # XXX: We should consider moving this that it applies to the logical query,
     # not the physical query.
     with RateLimitAggregator(
@@ -237,6 +325,20 @@ def execute_query_with_rate_limits(
                 1, maxt - project_rate_limit_stats.concurrent + 1
             )
 
+        yield
+
+
+@with_span(op="db")
+def execute_query_with_rate_limits(
+    clickhouse_query: Union[Query, CompositeQuery[Table]],
+    request_settings: RequestSettings,
+    formatted_query: FormattedQuery,
+    reader: Reader,
+    timer: Timer,
+    stats: MutableMapping[str, Any],
+    query_settings: MutableMapping[str, Any],
+) -> Result:
+    with rate_limited(request_settings, timer, stats, query_settings):
         return execute_query(
             clickhouse_query,
             request_settings,
@@ -261,6 +363,7 @@ def execute_query_with_caching(
     timer: Timer,
     stats: MutableMapping[str, Any],
     query_settings: MutableMapping[str, Any],
+    rate_limit: bool = True,
 ) -> Result:
     # XXX: ``uncompressed_cache_max_cols`` is used to control both the result
     # cache, as well as the uncompressed cache. These should be independent.
@@ -274,7 +377,7 @@ def execute_query_with_caching(
         use_cache = False
 
     execute = partial(
-        execute_query_with_rate_limits,
+        execute_query_with_rate_limits if rate_limit else execute_query,
         clickhouse_query,
         request_settings,
         formatted_query,
@@ -312,13 +415,44 @@ def execute_query_with_readthrough_caching(
     timer: Timer,
     stats: MutableMapping[str, Any],
     query_settings: MutableMapping[str, Any],
+    stale_ttl: Optional[int] = None,
+    rate_limit: bool = True,
 ) -> Result:
     query_id = get_query_cache_key(formatted_query)
     query_settings["query_id"] = query_id
+    refresh_settings = {**query_settings}
+    execute = execute_query_with_rate_limits if rate_limit else execute_query
+
+    def refresh() -> Result:
+        # Stale results are refreshed after they have been returned, so the
+        # refresh is timed and recorded separately from the query that
+        # received the stale result, whose timer and stats are not modified.
+        refresh_timer = Timer("refresh_query")
+        refresh_stats: MutableMapping[str, Any] = {}
+        status = QueryStatus.ERROR
+        try:
+            result = execute(
+                clickhouse_query,
+                request_settings,
+                formatted_query,
+                reader,
+                refresh_timer,
+                refresh_stats,
+                {**refresh_settings},
+            )
+            status = QueryStatus.SUCCESS
+            return result
+        except RateLimitExceeded:
+            status = QueryStatus.RATE_LIMITED
+            raise
+        finally:
+            refresh_timer.send_metrics_to(metrics, tags={"status": status.value})
+            logger.debug("Refreshed stale result for %s: %r", query_id, refresh_stats)
+
     return cache.get_readthrough(
         query_id,
         partial(
-            execute_query_with_rate_limits,
+            execute,
             clickhouse_query,
             request_settings,
             formatted_query,
@@ -329,9 +463,110 @@ def execute_query_with_readthrough_caching(
         ),
         timeout=query_settings.get("max_execution_time", 30),
         timer=timer,
+        stale_ttl=stale_ttl,
+        refresh_function=refresh,
     )
 
 
+@with_span(op="db")
+def execute_query_with_bucket_caching(
+    execute_query_strategy: Callable[..., Result],
+    clickhouse_query: Union[Query, CompositeQuery[Table]],
+    request_settings: RequestSettings,
+    formatted_query: FormattedQuery,
+    reader: Reader,
+    timer: Timer,
+    stats: MutableMapping[str, Any],
+    query_settings: MutableMapping[str, Any],
+) -> Result:
+    """
+    Executes time series queries by reusing the cached results of the time
+    buckets they have in common with previous queries (see
+    ``execute_with_bucket_cache``.) Other queries are executed with the
+    provided strategy.
+
+    The ranges of buckets that are missing from the cache are also executed
+    with the provided strategy, so their results are cached and concurrent
+    queries for the same range are deduplicated like for any other query.
+    The query is only counted once against the rate limits, whatever the
+    number of ranges it is split into.
+    """
+    time_series = (
+        get_time_series(clickhouse_query)
+        if isinstance(clickhouse_query, Query)
+        else None
+    )
+
+    if time_series is None:
+        return execute_query_strategy(
+            clickhouse_query,
+            request_settings,
+            formatted_query,
+            reader,
+            timer,
+            stats,
+            query_settings,
+        )
+
+    assert isinstance(clickhouse_query, Query)
+
+    with rate_limited(request_settings, timer, stats, query_settings):
+        # Each range is executed with its own stats, which are then combined
+        # into the stats of the query once all the ranges are executed.
+        range_stats: MutableSequence[Mapping[str, Any]] = []
+
+        def execute(query: Query) -> Result:
+            query_stats: MutableMapping[str, Any] = {}
+            range_stats.append(query_stats)
+            return execute_query_strategy(
+                query,
+                request_settings,
+                format_query(query, request_settings),
+                reader,
+                timer,
+                query_stats,
+                {**query_settings},
+                rate_limit=False,
+            )
+
+        mutable_window = state.get_config("bucket_cache_mutable_window_sec", 3600)
+        assert isinstance(mutable_window, int)
+        result = execute_with_bucket_cache(
+            clickhouse_query,
+            time_series,
+            bucket_cache,
+            lambda query: get_query_cache_key(format_query(query, request_settings)),
+            execute,
+            timedelta(seconds=mutable_window),
+            datetime.utcnow(),
+            stats,
+        )
+        timer.mark("bucket_cache")
+        if result is not None:
+            stats.update(
+                {
+                    "consistent": request_settings.get_consistent(),
+                    "result_rows": len(result["data"]),
+                    "result_cols": len(result["meta"]),
+                }
+            )
+            cache_hits = [s["cache_hit"] for s in range_stats if "cache_hit" in s]
+            if cache_hits:
+                stats["cache_hit"] = all(cache_hits)
+            return result
+
+        return execute_query_strategy(
+            clickhouse_query,
+            request_settings,
+            formatted_query,
+            reader,
+            timer,
+            stats,
+            query_settings,
+            rate_limit=False,
+        )
+
+
 def raw_query(
     # TODO: Passing the whole clickhouse query here is needed as long
     # as the execute method depends on it. Otherwise we can make this
@@ -374,11 +609,25 @@ def raw_query(
         trace_id,
     )
 
-    execute_query_strategy = (
-        execute_query_with_readthrough_caching
-        if state.get_config("use_readthrough_query_cache", 1)
-        else execute_query_with_caching
-    )
+    execute_query_strategy: Callable[..., Result]
+    if state.get_config("use_readthrough_query_cache", 1):
+        # Stale results can be served while they are refreshed for up to
+        # ``cache_stale_ttl_sec`` seconds after they expire, which can be
+        # overridden for each referrer (0 disables it.)
+        stale_ttl = state.get_config(
+            f"cache_stale_ttl_sec_{query_metadata.request.referrer}",
+            state.get_config("cache_stale_ttl_sec", None),
+        )
+        execute_query_strategy = partial(
+            execute_query_with_readthrough_caching, stale_ttl=stale_ttl or None
+        )
+    else:
+        execute_query_strategy = execute_query_with_caching
+
+    if state.get_config("use_bucket_cache", 0):
+        execute_query_strategy = partial(
+            execute_query_with_bucket_caching, execute_query_strategy
+        )
 
     try:
         result = execute_query_strategy(
@@ -0,0 +1,49 @@
+from typing import Any, Iterator, Mapping, Sequence
+
+import rapidjson
+import simplejson as json
+
+# Match the ``simplejson`` defaults for the values that can be found in
+# query results (``Decimal`` values and non finite floats.)
+NUMBER_MODE = rapidjson.NM_DECIMAL | rapidjson.NM_NAN
+
+
+def dumps(value: Any) -> str:
+    """
+    Encodes the value as JSON with ``rapidjson``, falling back to
+    ``simplejson`` for the values that ``rapidjson`` does not support (such
+    as mappings with non string keys.)
+    """
+    try:
+        return rapidjson.dumps(value, number_mode=NUMBER_MODE)
+    except TypeError:
+        return json.dumps(value)
+
+
+def iterencode(
+    payload: Mapping[str, Any], streamed_key: str, chunk_size: int
+) -> Iterator[str]:
+    """
+    Encodes the payload as a JSON object incrementally. The items of the
+    sequence under ``streamed_key`` are encoded ``chunk_size`` at a time, so
+    that the encoded representation of a large sequence is never held in
+    memory all at once.
+    """
+    if not chunk_size > 0:
+        raise ValueError("chunk size must be greater than zero")
+
+    yield "{"
+    for i, (key, value) in enumerate(payload.items()):
+        prefix = f"{',' if i else ''}{dumps(key)}:"
+        if key != streamed_key or not isinstance(value, Sequence):
+            yield prefix + dumps(value)
+            continue
+
+        yield prefix + "["
+        for start in range(0, len(value), chunk_size):
+            # Strip the brackets of the encoded chunk to join its items with
+            # the items of the other chunks.
+            chunk = dumps(value[start : start + chunk_size])[1:-1]
+            yield f"{',' if start else ''}{chunk}"
+        yield "]"
+    yield "}"
@@ -6,6 +6,7 @@ from typing import Any, Mapping, MutableMapping, MutableSequence, Tuple
 from uuid import UUID
 
 import jsonschema
+import rapidjson
 import sentry_sdk
 import simplejson as json
 from flask import Flask, Response, redirect, render_template
@@ -14,7 +15,6 @@ from markdown import markdown
 
 from snuba import environment, settings, state, util
 from snuba.clickhouse.errors import ClickhouseError
-from snuba.clickhouse.http import JSONRowEncoder
 from snuba.clusters.cluster import ClickhouseClientSettings
 from snuba.consumer import KafkaMessageMetadata
 from snuba.datasets.dataset import Dataset
@@ -30,7 +30,7 @@ from snuba.query.exceptions import InvalidQueryException
 from snuba.redis import redis_client
 from snuba.request.exceptions import InvalidJsonRequestException, JsonDecodeException
 from snuba.request.request_settings import HTTPRequestSettings
-from snuba.request.schema import Language, RequestSchema
+from snuba.request.schema import Language, RequestSchema, get_request_schema
 from snuba.request.validation import build_request
 from snuba.state.rate_limit import RateLimitExceeded
 from snuba.subscriptions.codecs import SubscriptionDataCodec
@@ -41,7 +41,7 @@ from snuba.utils.metrics.timer import Timer
 from snuba.utils.metrics.wrapper import MetricsWrapper
 from snuba.utils.streams import Message, Partition, Topic
 from snuba.utils.streams.backends.kafka import KafkaPayload
-from snuba.web import QueryException
+from snuba.web import QueryException, encoding
 from snuba.web.converters import DatasetConverter
 from snuba.web.query import parse_and_run_query
 from snuba.writer import BatchWriterEncoderWrapper, WriterTableRow
@@ -119,7 +119,7 @@ application.url_map.converters["dataset"] = DatasetConverter
 @application.errorhandler(InvalidJsonRequestException)
 def handle_invalid_json(exception: InvalidJsonRequestException) -> Response:
     cause = getattr(exception, "__cause__", None)
-    if isinstance(cause, json.JSONDecodeError):
+    if isinstance(cause, rapidjson.JSONDecodeError):
         data = {"error": {"type": "json", "message": str(cause)}}
     elif isinstance(cause, jsonschema.ValidationError):
         data = {
@@ -263,8 +263,8 @@ def parse_request_body(http_request):
     with sentry_sdk.start_span(description="parse_request_body", op="parse"):
         metrics.timing("http_request_body_length", len(http_request.data))
         try:
-            return json.loads(http_request.data)
-        except json.JSONDecodeError as error:
+            return rapidjson.loads(http_request.data)
+        except (rapidjson.JSONDecodeError, UnicodeDecodeError) as error:
             raise JsonDecodeException(str(error)) from error
 
 
@@ -338,8 +338,8 @@ def dataset_query(dataset: Dataset, body, timer: Timer, language: Language) -> R
     assert http_request.method == "POST"
 
     with sentry_sdk.start_span(description="build_schema", op="validate"):
-        schema = RequestSchema.build_with_extensions(
-            dataset.get_default_entity().get_extensions(), HTTPRequestSettings, language
+        schema = get_request_schema(
+            dataset.get_default_entity(), HTTPRequestSettings, language
         )
 
     request = build_request(body, schema, timer, dataset, http_request.referrer)
@@ -384,7 +384,20 @@ def dataset_query(dataset: Dataset, body, timer: Timer, language: Language) -> R
     if settings.STATS_IN_RESPONSE or request.settings.get_debug():
         payload.update(result.extra)
 
-    return Response(json.dumps(payload), 200, {"Content-Type": "application/json"})
+    # Large results are encoded and sent a chunk of rows at a time instead
+    # of being encoded into a single string.
+    streaming_min_rows = state.get_config("response_streaming_min_rows", 10000)
+    assert isinstance(streaming_min_rows, int)
+    if len(payload["data"]) >= streaming_min_rows:
+        return Response(
+            encoding.iterencode(
+                payload, "data", settings.RESPONSE_STREAMING_CHUNK_SIZE
+            ),
+            200,
+            {"Content-Type": "application/json"},
+        )
+
+    return Response(encoding.dumps(payload), 200, {"Content-Type": "application/json"})
 
 
 @application.errorhandler(InvalidSubscriptionError)
@@ -444,8 +457,9 @@ if application.debug or application.testing:
                 assert isinstance(processed_message, InsertBatch)
                 rows.extend(processed_message.rows)
 
+        table_writer = enforce_table_writer(dataset)
         BatchWriterEncoderWrapper(
-            enforce_table_writer(dataset).get_batch_writer(metrics), JSONRowEncoder(),
+            table_writer.get_batch_writer(metrics), table_writer.get_row_encoder(),
         ).write(rows)
 
         return ("ok", 200, {"Content-Type": "text/plain"})
@@ -485,6 +499,7 @@ if application.debug or application.testing:
                 processes=None,
                 input_block_size=None,
                 output_block_size=None,
+                row_encoder=table_writer.get_row_encoder(),
             ).create(lambda offsets: None)
             strategy.submit(message)
             strategy.close()
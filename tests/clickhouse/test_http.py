@@ -0,0 +1,58 @@
+import gzip
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Iterable, Mapping
+from unittest.mock import Mock
+
+import lz4.frame
+import pytest
+
+from snuba.clickhouse.http import BodyCompression, HTTPWriteBatch, compress_body
+
+
+@pytest.mark.parametrize(
+    "compression, decompress",
+    [
+        (BodyCompression.GZIP, gzip.decompress),
+        (BodyCompression.LZ4, lz4.frame.decompress),
+    ],
+)
+def test_compress_body(compression: BodyCompression, decompress: Any) -> None:
+    chunks = [b'{"a": 1}\n' * 100, b'{"b": 2}\n' * 100]
+    body = b"".join(compress_body(chunks, compression.get_compressor()))
+    assert decompress(body) == b"".join(chunks)
+    assert len(body) < len(b"".join(chunks))
+
+    assert decompress(b"".join(compress_body([], compression.get_compressor()))) == b""
+
+
+def test_write_batch_compression() -> None:
+    requests = []
+
+    def urlopen(
+        method: str, url: str, headers: Mapping[str, str], body: Iterable[bytes]
+    ) -> Mock:
+        requests.append((headers, b"".join(body)))
+        return Mock(status=200)
+
+    batch = HTTPWriteBatch(
+        ThreadPoolExecutor(),
+        Mock(urlopen=urlopen),
+        "default",
+        "test",
+        "user",
+        "password",
+        {},
+        chunk_size=2,
+        compression=BodyCompression.GZIP,
+    )
+
+    rows = [b'{"a": %d}\n' % i for i in range(5)]
+    for row in rows:
+        batch.append(row)
+
+    batch.close()
+    batch.join()
+
+    [(headers, body)] = requests
+    assert headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(body) == b"".join(rows)
@@ -1,6 +1,10 @@
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from unittest.mock import Mock
+from uuid import UUID
+
 from dateutil.tz import tz
-from snuba.clickhouse.native import transform_datetime
+from snuba.clickhouse.formatter.nodes import FormattedQuery, StringNode
+from snuba.clickhouse.native import NativeDriverReader, transform_datetime
 
 
 def test_transform_datetime() -> None:
@@ -14,3 +18,64 @@ def test_transform_datetime() -> None:
         transform_datetime(now.replace(tzinfo=tz.tzoffset("PST", offset)) + offset)
         == fmt
     )
+
+
+def test_reader_transform_result() -> None:
+    client = Mock()
+    client.execute.return_value = (
+        [
+            (date(2020, 1, 2), datetime(2020, 1, 2, 3, 4, 5), UUID(int=1), None, 1),
+            (
+                date(2020, 1, 3),
+                datetime(2020, 1, 3, 3, 4, 5),
+                UUID(int=2),
+                datetime(2020, 1, 2, 3, 4, 5),
+                2,
+            ),
+            (date(1970, 1, 1), datetime(1970, 1, 1), UUID(int=0), None, 3),
+        ],
+        [
+            ("date", "Date"),
+            ("datetime", "DateTime"),
+            ("uuid", "UUID"),
+            ("nullable", "Nullable(DateTime)"),
+            ("count", "UInt64"),
+        ],
+    )
+
+    result = NativeDriverReader(client).execute(
+        FormattedQuery([StringNode("SELECT 1")]), with_totals=True
+    )
+
+    assert result == {
+        "meta": [
+            {"name": "date", "type": "Date"},
+            {"name": "datetime", "type": "DateTime"},
+            {"name": "uuid", "type": "UUID"},
+            {"name": "nullable", "type": "Nullable(DateTime)"},
+            {"name": "count", "type": "UInt64"},
+        ],
+        "data": [
+            {
+                "date": "2020-01-02T00:00:00+00:00",
+                "datetime": "2020-01-02T03:04:05+00:00",
+                "uuid": "00000000-0000-0000-0000-000000000001",
+                "nullable": None,
+                "count": 1,
+            },
+            {
+                "date": "2020-01-03T00:00:00+00:00",
+                "datetime": "2020-01-03T03:04:05+00:00",
+                "uuid": "00000000-0000-0000-0000-000000000002",
+                "nullable": "2020-01-02T03:04:05+00:00",
+                "count": 2,
+            },
+        ],
+        "totals": {
+            "date": "1970-01-01T00:00:00+00:00",
+            "datetime": "1970-01-01T00:00:00+00:00",
+            "uuid": "00000000-0000-0000-0000-000000000000",
+            "nullable": None,
+            "count": 3,
+        },
+    }
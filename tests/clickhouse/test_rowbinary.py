@@ -0,0 +1,87 @@
+import pickle
+from datetime import datetime
+
+import pytest
+
+from snuba.clickhouse.columns import (
+    UUID,
+    Array,
+    ColumnSet,
+    DateTime,
+    Enum,
+    IPv4,
+    Nested,
+    String,
+    UInt,
+)
+from snuba.clickhouse.columns import SchemaModifiers as Modifiers
+from snuba.clickhouse.rowbinary import RowBinaryEncoder, get_insert_columns
+
+columns = ColumnSet(
+    [
+        ("project_id", UInt(64)),
+        ("event_id", UUID()),
+        ("timestamp", DateTime()),
+        ("release", String(Modifiers(nullable=True))),
+        ("ip_address_v4", IPv4(Modifiers(nullable=True))),
+        ("level", Enum([("info", 1), ("error", 2)])),
+        ("tags", Nested([("key", String()), ("value", String())])),
+        ("_tags_hash_map", Array(UInt(64), Modifiers(readonly=True))),
+    ]
+)
+
+
+def test_insert_columns() -> None:
+    assert get_insert_columns(columns) == [
+        "project_id",
+        "event_id",
+        "timestamp",
+        "release",
+        "ip_address_v4",
+        "level",
+        "tags.key",
+        "tags.value",
+    ]
+
+
+def test_encode_row() -> None:
+    encoder = RowBinaryEncoder(columns)
+
+    row = {
+        "project_id": 1,
+        "event_id": "00000000000000010000000000000002",
+        "timestamp": datetime(2020, 1, 1),
+        "release": "abc",
+        "ip_address_v4": "127.0.0.1",
+        "level": "error",
+        "tags.key": ["a"],
+        "tags.value": ["bc"],
+        "_tags_hash_map": [1, 2, 3],
+    }
+
+    assert encoder.encode(row) == b"".join(
+        [
+            (1).to_bytes(8, "little"),
+            (1).to_bytes(8, "little") + (2).to_bytes(8, "little"),
+            (1577836800).to_bytes(4, "little"),
+            b"\x00\x03abc",
+            b"\x00" + (0x7F000001).to_bytes(4, "little"),
+            b"\x02",
+            b"\x01\x01a",
+            b"\x01\x02bc",
+        ]
+    )
+
+    # Missing columns are filled with the default of their type.
+    assert encoder.encode({}) == b"".join(
+        [bytes(8), bytes(16), bytes(4), b"\x01", b"\x01", b"\x01", b"\x00", b"\x00"]
+    )
+
+    with pytest.raises(ValueError):
+        encoder.encode({"project_id": "invalid"})
+
+
+def test_encoder_pickle() -> None:
+    encoder = RowBinaryEncoder(columns)
+    row = {"project_id": 2, "timestamp": datetime(2020, 1, 1), "tags.key": ["a"]}
+    assert pickle.loads(pickle.dumps(encoder)).encode(row) == encoder.encode(row)
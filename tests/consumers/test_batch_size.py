@@ -0,0 +1,66 @@
+import pytest
+
+from snuba.consumers.batch_size import BatchSizeController
+
+
+def test_batch_size_controller() -> None:
+    controller = BatchSizeController(100, 10000, 1.0)
+    assert controller.get_batch_size() == 10000
+
+    # Slow inserts shrink the batch size, by at most half per insert.
+    controller.record_insert(10000, 10000, 4.0)
+    assert controller.get_batch_size() == 5000
+
+    controller.record_insert(5000, 5000, 2.0)
+    assert controller.get_batch_size() == 2500
+
+    # Fast inserts grow the batch size towards the estimated target.
+    controller.record_insert(2500, 2500, 0.5)
+    assert controller.get_batch_size() == 5000
+
+    controller.record_insert(5000, 5000, 0.8)
+    assert controller.get_batch_size() == 6250
+
+    # Fast inserts never shrink the batch size, even if they are small.
+    controller.record_insert(10, 10, 0.5)
+    assert controller.get_batch_size() == 6250
+
+    # The batch size stays within bounds.
+    for _ in range(10):
+        controller.record_insert(
+            controller.get_batch_size(), controller.get_batch_size(), 10.0
+        )
+    assert controller.get_batch_size() == 100
+
+    controller.record_too_many_parts()
+    assert controller.get_batch_size() == 200
+
+    for _ in range(10):
+        controller.record_too_many_parts()
+    assert controller.get_batch_size() == 10000
+
+    with pytest.raises(ValueError):
+        BatchSizeController(100, 10, 1.0)
+
+
+def test_batch_size_controller_target_rows() -> None:
+    controller = BatchSizeController(100, 10000, None, 20000)
+
+    # Each message produces 4 rows, so 5000 messages make up the target.
+    controller.record_insert(10000, 40000, 1.0)
+    assert controller.get_batch_size() == 5000
+
+    controller.record_insert(5000, 20000, 1.0)
+    assert controller.get_batch_size() == 5000
+
+    # With a target latency, fast inserts do not grow the batch size past
+    # the target number of rows.
+    controller = BatchSizeController(100, 10000, 1.0, 20000)
+    controller.record_insert(10000, 40000, 0.5)
+    assert controller.get_batch_size() == 5000
+
+    controller.record_insert(5000, 5000, 0.1)
+    assert controller.get_batch_size() == 10000
+
+    with pytest.raises(ValueError):
+        BatchSizeController(100, 10000, None, None)
@@ -0,0 +1,40 @@
+from urllib.request import urlopen
+
+import rapidjson
+
+from snuba.consumers.stats import ConsumerStats, StatsServer
+from tests.backends.metrics import Increment, TestingMetricsBackend, Timing
+
+
+def test_consumer_stats() -> None:
+    backend = TestingMetricsBackend()
+    stats = ConsumerStats(backend)
+
+    stats.increment("messages", 10)
+    stats.increment("messages", 5)
+    stats.gauge("batches_in_progress", 2)
+    stats.gauge("batches_in_progress", 1)
+    stats.timing("insertions.rows", 100)
+    stats.timing("insertions.rows", 300, tags={"key": "value"})
+
+    assert backend.calls[0] == Increment("messages", 10, None)
+    assert backend.calls[-1] == Timing("insertions.rows", 300, {"key": "value"})
+
+    snapshot = stats.snapshot()
+    assert snapshot["counters"] == {"messages": 15}
+    assert snapshot["gauges"] == {"batches_in_progress": 1}
+    assert snapshot["timings"] == {
+        "insertions.rows": {"count": 2, "sum": 400, "max": 300, "avg": 200}
+    }
+
+    server = StatsServer(stats, "127.0.0.1", 0)
+    server.start()
+    try:
+        with urlopen(f"http://127.0.0.1:{server.port}/") as response:
+            assert response.status == 200
+            body = rapidjson.loads(response.read())
+    finally:
+        server.stop()
+
+    assert body["counters"] == {"messages": 15}
+    assert body["timings"]["insertions.rows"]["avg"] == 200
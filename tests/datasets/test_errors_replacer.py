@@ -6,7 +6,7 @@ from functools import partial
 import simplejson as json
 from typing import Any, Tuple
 
-from snuba import replacer
+from snuba import replacer, settings
 from snuba.clickhouse import DATETIME_FORMAT
 from snuba.datasets import errors_replacer
 from snuba.datasets.storages import StorageKey
@@ -111,6 +111,35 @@ class TestReplacer:
             [1, 2, 3],
         )
 
+    def test_count_modes(self):
+        timestamp = datetime.now(tz=pytz.utc)
+        message = (
+            2,
+            "end_delete_groups",
+            {
+                "project_id": self.project_id,
+                "group_ids": [1, 2, 3],
+                "datetime": timestamp.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+            },
+        )
+
+        try:
+            settings.REPLACER_COUNT_MODE = "exists"
+            replacement = self.replacer.process_message(self._wrap(message))
+            assert (
+                re.sub("[\n ]+", " ", replacement.count_query_template).strip()
+                == "SELECT count() FROM ( SELECT 1 FROM %(table_name)s PREWHERE group_id IN (%(group_ids)s) WHERE project_id = %(project_id)s AND received <= CAST('%(timestamp)s' AS DateTime) AND NOT deleted LIMIT 1 )"
+            )
+
+            settings.REPLACER_COUNT_MODE = "approximate"
+            replacement = self.replacer.process_message(self._wrap(message))
+            assert (
+                re.sub("[\n ]+", " ", replacement.count_query_template).strip()
+                == "SELECT count() FROM %(table_name)s PREWHERE group_id IN (%(group_ids)s) WHERE project_id = %(project_id)s AND received <= CAST('%(timestamp)s' AS DateTime) AND NOT deleted"
+            )
+        finally:
+            settings.REPLACER_COUNT_MODE = "exact"
+
     def test_tombstone_events_process(self):
         timestamp = datetime.now(tz=pytz.utc)
         message = (
@@ -177,6 +206,74 @@ class TestReplacer:
             [1, 2],
         )
 
+    def test_coalesce_replacements(self):
+        timestamp = datetime.now(tz=pytz.utc)
+        messages = [
+            (
+                2,
+                "end_delete_groups",
+                {
+                    "project_id": self.project_id,
+                    "group_ids": [1, 2],
+                    "datetime": timestamp.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+                },
+            ),
+            (
+                2,
+                "end_delete_groups",
+                {
+                    "project_id": self.project_id,
+                    "group_ids": [2, 3],
+                    "datetime": timestamp.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+                },
+            ),
+            (
+                2,
+                "end_delete_groups",
+                {
+                    "project_id": self.project_id + 1,
+                    "group_ids": [4],
+                    "datetime": timestamp.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+                },
+            ),
+            (2, "exclude_groups", {"project_id": self.project_id, "group_ids": [5]},),
+            (2, "exclude_groups", {"project_id": self.project_id, "group_ids": [6]},),
+        ]
+
+        replacements = [
+            self.replacer.process_message(self._wrap(message)) for message in messages
+        ]
+
+        processor = self.storage.get_table_writer().get_replacer_processor()
+        coalesced = processor.coalesce_replacements(replacements)
+        assert len(coalesced) == 3
+
+        formatted = timestamp.strftime(DATETIME_FORMAT)
+        assert (
+            re.sub("[\n ]+", " ", coalesced[0].count_query_template).strip()
+            == "SELECT count() FROM %(table_name)s FINAL PREWHERE group_id IN (%(group_ids)s) WHERE project_id = %(project_id)s AND (%(conditions)s) AND NOT deleted"
+        )
+        assert coalesced[0].query_args["group_ids"] == "1, 2, 3"
+        assert coalesced[0].query_args["conditions"] == (
+            f"(group_id IN (1, 2) AND received <= CAST('{formatted}' AS DateTime))"
+            f" OR (group_id IN (2, 3) AND received <= CAST('{formatted}' AS DateTime))"
+        )
+        assert coalesced[0].query_time_flags == (
+            errors_replacer.EXCLUDE_GROUPS,
+            self.project_id,
+            [1, 2, 3],
+        )
+
+        assert coalesced[1] is replacements[2]
+
+        assert coalesced[2].count_query_template is None
+        assert coalesced[2].insert_query_template is None
+        assert coalesced[2].query_time_flags == (
+            errors_replacer.EXCLUDE_GROUPS,
+            self.project_id,
+            [5, 6],
+        )
+
     def test_unmerge_process(self):
         timestamp = datetime.now(tz=pytz.utc)
         message = (
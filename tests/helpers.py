@@ -2,7 +2,6 @@ from datetime import datetime
 from typing import MutableSequence, Sequence
 
 from snuba.consumer import KafkaMessageMetadata
-from snuba.clickhouse.http import JSONRowEncoder
 from snuba.datasets.events_processor_base import InsertEvent
 from snuba.datasets.storage import WritableStorage
 from snuba.processor import InsertBatch, ProcessedMessage
@@ -18,11 +17,10 @@ def write_processed_messages(
         assert isinstance(message, InsertBatch)
         rows.extend(message.rows)
 
+    table_writer = storage.get_table_writer()
     BatchWriterEncoderWrapper(
-        storage.get_table_writer().get_batch_writer(
-            metrics=DummyMetricsBackend(strict=True)
-        ),
-        JSONRowEncoder(),
+        table_writer.get_batch_writer(metrics=DummyMetricsBackend(strict=True)),
+        table_writer.get_row_encoder(),
     ).write(rows)
 
 
@@ -1,4 +1,5 @@
 from typing import Any, MutableMapping
+from unittest.mock import patch
 
 import pytest
 
@@ -958,3 +959,21 @@ def test_circular_aliases() -> None:
             {"selected_columns": [["f1", [["f2", ["c"], "f2"]], "c"]]},
             get_dataset("events"),
         )
+
+
+def test_parsed_query_cache() -> None:
+    body = {
+        "selected_columns": ["column1"],
+        "conditions": [["column2", "=", "cached"]],
+    }
+    query = parse_query(body, get_dataset("events"))
+
+    # The query is only parsed the first time. Every parsed query can be
+    # modified without affecting the queries parsed later.
+    with patch("snuba.query.parser._parse_query_impl") as parse_query_impl:
+        cached = parse_query(body, get_dataset("events"))
+        assert parse_query_impl.call_count == 0
+    assert cached == query and cached is not query
+
+    cached.set_ast_condition(None)
+    assert parse_query(body, get_dataset("events")) == query
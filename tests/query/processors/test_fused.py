@@ -0,0 +1,180 @@
+from typing import Any, MutableMapping, Sequence
+from unittest.mock import patch
+
+import pytest
+from snuba import state
+from snuba.clickhouse.columns import ColumnSet
+from snuba.clickhouse.processors import QueryProcessor
+from snuba.clickhouse.query import Query
+from snuba.datasets.factory import get_dataset
+from snuba.datasets.plans.query_plan import ClickhouseQueryPlan
+from snuba.datasets.storages.event_id_column_processor import EventIdColumnProcessor
+from snuba.datasets.storages.group_id_column_processor import GroupIdColumnProcessor
+from snuba.pipeline.processors import (
+    execute_all_clickhouse_processors,
+    execute_entity_processors,
+)
+from snuba.query import SelectedExpression
+from snuba.query.conditions import ConditionFunctions, binary_condition
+from snuba.query.data_source.simple import Table
+from snuba.query.expressions import Column, FunctionCall, Literal
+from snuba.query.parser import parse_query
+from snuba.query.processors import fused
+from snuba.query.processors.fused import execute_processors
+from snuba.request.request_settings import HTTPRequestSettings, RequestSettings
+from snuba.utils.metrics.wrapper import MetricsWrapper
+from tests.backends.metrics import TestingMetricsBackend, Timing
+
+
+class LimitProcessor(QueryProcessor):
+    def process_query(self, query: Query, request_settings: RequestSettings) -> None:
+        query.set_limit(10)
+
+
+def build_query() -> Query:
+    return Query(
+        Table("events", ColumnSet([])),
+        selected_columns=[
+            SelectedExpression("event_id", Column("event_id", None, "event_id")),
+            SelectedExpression("group_id", Column("group_id", None, "group_id")),
+        ],
+        condition=binary_condition(
+            ConditionFunctions.EQ, Column(None, None, "group_id"), Literal(None, 1),
+        ),
+    )
+
+
+def test_execute_processors() -> None:
+    backend = TestingMetricsBackend()
+    processors: Sequence[QueryProcessor] = [
+        EventIdColumnProcessor(),
+        GroupIdColumnProcessor(),
+        LimitProcessor(),
+        GroupIdColumnProcessor(),
+    ]
+
+    query = build_query()
+    with patch.object(fused, "metrics", MetricsWrapper(backend, "query_processor")):
+        with patch.object(
+            Query,
+            "transform_expressions",
+            autospec=True,
+            side_effect=Query.transform_expressions,
+        ) as transform_expressions:
+            execute_processors(processors, query, HTTPRequestSettings())
+
+    # The first two processors are applied in a single traversal.
+    assert transform_expressions.call_count == 2
+    assert [(call.name, call.tags) for call in backend.calls] == [
+        (
+            "query_processor.duration",
+            {"processor": "EventIdColumnProcessor", "fused": "true"},
+        ),
+        (
+            "query_processor.duration",
+            {"processor": "GroupIdColumnProcessor", "fused": "true"},
+        ),
+        (
+            "query_processor.duration",
+            {"processor": "FusedExpressionProcessor", "fused": "false"},
+        ),
+        ("query_processor.duration", {"processor": "LimitProcessor", "fused": "false"}),
+        (
+            "query_processor.duration",
+            {"processor": "GroupIdColumnProcessor", "fused": "false"},
+        ),
+    ]
+    assert all(isinstance(call, Timing) for call in backend.calls)
+
+    assert query.get_limit() == 10
+    nullable_group_id = FunctionCall(
+        None, "nullIf", (Column(None, None, "group_id"), Literal(None, 0)),
+    )
+    assert query.get_condition_from_ast() == binary_condition(
+        ConditionFunctions.EQ,
+        FunctionCall(None, "nullIf", (nullable_group_id, Literal(None, 0))),
+        Literal(None, 1),
+    )
+
+    state.set_config("fuse_expression_processors", 0)
+    unfused_query = build_query()
+    execute_processors(processors, unfused_query, HTTPRequestSettings())
+    assert unfused_query == query
+
+
+QUERIES = [
+    (
+        "events",
+        {
+            "selected_columns": ["event_id", "group_id", "tags[foo]", "tags_key"],
+            "aggregations": [
+                ["uniq", "user", "users"],
+                ["isHandled()", None, "handled"],
+                ["top5", "environment", "top_env"],
+            ],
+            "conditions": [
+                ["group_id", "IN", [1, 2, 3]],
+                ["tags[environment]", "=", "production"],
+                ["contexts[device.simulator]", "=", "1"],
+                ["notHandled()", "=", 1],
+            ],
+            "groupby": ["event_id", "group_id", "tags[foo]", "tags_key"],
+            "orderby": "-users",
+        },
+    ),
+    (
+        "discover",
+        {
+            "selected_columns": ["event_id", "tags[sentry:release]"],
+            "aggregations": [["emptyIfNull", "release", "release"]],
+            "conditions": [
+                ["event_id", "=", "a5fbb8ce-1d0d-4d31-8d92-9fae2bd3ab23"],
+                ["group_id", "=", 1],
+                ["tags_value", "=", "a"],
+            ],
+            "groupby": ["event_id", "tags[sentry:release]"],
+        },
+    ),
+    (
+        "transactions",
+        {
+            "selected_columns": ["transaction_name", "tags[foo]"],
+            "aggregations": [
+                ["apdex(duration, 300)", None, "apdex"],
+                ["failure_rate()", None, "failure_rate"],
+                ["uniq", "user", "users"],
+            ],
+            "conditions": [["tags_key", "=", "a"]],
+            "groupby": ["transaction_name", "tags[foo]"],
+        },
+    ),
+]
+
+
+@pytest.mark.parametrize("dataset_name, query_body", QUERIES)
+def test_fused_processors_equivalent(
+    dataset_name: str, query_body: MutableMapping[str, Any]
+) -> None:
+    """
+    Fusing the expression processors of the entities and storages does not
+    change the result of the query processing.
+    """
+
+    def process(fuse: int) -> ClickhouseQueryPlan:
+        state.set_config("fuse_expression_processors", fuse)
+        dataset = get_dataset(dataset_name)
+        query = parse_query(query_body, dataset)
+        settings = HTTPRequestSettings()
+        execute_entity_processors(query, settings)
+        query_plan = (
+            dataset.get_default_entity()
+            .get_query_pipeline_builder()
+            .build_planner(query, settings)
+        ).build_best_plan()
+        execute_all_clickhouse_processors(query_plan, settings)
+        return query_plan
+
+    fused_plan = process(1)
+    unfused_plan = process(0)
+    eq, reason = fused_plan.query.equals(unfused_plan.query)
+    assert eq, reason
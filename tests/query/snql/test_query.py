@@ -1,5 +1,6 @@
 import datetime
 import pytest
+from unittest.mock import patch
 
 from snuba import state
 from snuba.datasets.entities import EntityKey
@@ -26,7 +27,7 @@ from snuba.query.expressions import (
 from snuba.query import LimitBy, OrderBy, OrderByDirection, SelectedExpression
 from snuba.query.composite import CompositeQuery
 from snuba.query.logical import Query as LogicalQuery
-from snuba.query.snql.parser import parse_snql_query
+from snuba.query.snql.parser import _parse_snql_query, parse_snql_query
 
 
 test_cases = [
@@ -1172,3 +1173,44 @@ def test_format_expressions(query_body: str, expected_query: LogicalQuery) -> No
 
     eq, reason = query.equals(expected_query)
     assert eq, reason
+
+
+def test_parsed_query_cache() -> None:
+    events = get_dataset("events")
+    query_body = (
+        "MATCH (events) SELECT count() AS count, 3 * foo(c) BY tags[key] "
+        "WHERE project_id = {project_id} AND tags[key] = '{value}' "
+        "AND timestamp >= toDateTime('{timestamp}') LIMIT 10"
+    )
+
+    def parse(project_id: int, value: str, timestamp: str) -> LogicalQuery:
+        query = parse_snql_query(
+            query_body.format(project_id=project_id, value=value, timestamp=timestamp),
+            events,
+        )
+        assert isinstance(query, LogicalQuery)
+        return query
+
+    first = parse(1, "a", "2021-01-01T00:00:00")
+
+    # Queries with the same shape are built from the template of the first
+    # one instead of being parsed.
+    with patch("snuba.query.snql.parser.parse_snql_query_initial") as parse_initial:
+        query = parse(2, "b", "2021-01-02T00:00:00")
+        assert parse_initial.call_count == 0
+
+    expected = _parse_snql_query(
+        query_body.format(project_id=2, value="b", timestamp="2021-01-02T00:00:00")
+    )
+    eq, reason = query.equals(expected)
+    assert eq, reason
+    assert query.get_limit() == 10
+    assert [c.name for c in query.get_selected_columns_from_ast()] == [
+        "count",
+        "3 * foo(c)",
+        "tags[key]",
+    ]
+
+    # The queries built from a template can be modified safely.
+    query.set_ast_condition(None)
+    assert parse(1, "a", "2021-01-01T00:00:00") == first
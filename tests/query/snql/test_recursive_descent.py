@@ -0,0 +1,106 @@
+from typing import Iterator
+
+import pytest
+
+from snuba import state
+from snuba.datasets.entities import EntityKey
+from snuba.datasets.entities.factory import get_entity
+from snuba.datasets.factory import get_dataset
+from snuba.query.data_source.join import JoinRelationship, JoinType
+from snuba.query.snql.parser import SnQLVisitor, parse_snql_query, snql_grammar
+from snuba.query.snql.recursive_descent import parse_snql_query_recursive_descent
+from tests.query.snql.test_invalid_queries import test_cases as invalid_test_cases
+from tests.query.snql.test_query import test_cases as valid_test_cases
+
+in_list = ", ".join(str(i) for i in range(500))
+selected = ", ".join(f"f{i}(c{i}) AS a{i}" for i in range(100))
+
+additional_test_cases = [
+    pytest.param(f"MATCH (events) SELECT c WHERE a IN tuple({in_list})", id="in"),
+    pytest.param(f"MATCH (events) SELECT {selected}", id="selected columns"),
+    pytest.param(
+        "MATCH (events) SELECT a WHERE ((a = 1 OR (b = 2 AND c = 3)) AND d = 4)",
+        id="nested conditions",
+    ),
+    pytest.param(
+        "MATCH (events) SELECT a WHERE (f(g(h(a))) = 1 AND b = 2)",
+        id="function in parenthesized condition",
+    ),
+    pytest.param(
+        "MATCH (events) SELECT f(a)(b, c) AS d, g()() BY e", id="curried functions",
+    ),
+    pytest.param("MATCH (events) SELECT f(a) AS WHERE a = 1", id="empty alias"),
+    pytest.param("MATCH (events) SELECT a ORDER BY f(a) ASC", id="alias ambiguity"),
+    pytest.param("MATCH (events) SELECT a WHERE a = 1 ANDb = 2", id="no space"),
+    pytest.param("MATCH (events) SELECT a WHERE a IN(1)", id="invalid rhs"),
+    pytest.param("MATCH (events) SELECT a - -1 * -2.5e+3 / b", id="signs"),
+    pytest.param("MATCH (events) SELECT a LIMIT 10 BY b LIMIT 5", id="limit by"),
+    pytest.param("MATCH (events) SELECT a TOTALS False", id="totals"),
+    pytest.param("MATCH (events SAMPLE 1) SELECT a", id="integer sample"),
+    pytest.param("MATCH (nonexistent) SELECT a", id="invalid entity"),
+    pytest.param("MATCH (events) SELECT a WHERE b = 'x\\'y'", id="escaped quote"),
+    pytest.param("MATCH (events) SELECT a WHERE b = 'x' LIKE 'y'", id="incomplete"),
+    pytest.param("", id="empty"),
+]
+
+
+@pytest.fixture(autouse=True)
+def join_relationships() -> Iterator[None]:
+    mapping = {
+        "contains": (EntityKey.TRANSACTIONS, "event_id"),
+        "assigned": (EntityKey.GROUPASSIGNEE, "group_id"),
+        "bookmark": (EntityKey.GROUPEDMESSAGES, "first_release_id"),
+        "activity": (EntityKey.SESSIONS, "org_id"),
+    }
+
+    def events_mock(relationship: str) -> JoinRelationship:
+        entity_key, rhs_column = mapping[relationship]
+        return JoinRelationship(
+            rhs_entity=entity_key,
+            join_type=JoinType.INNER,
+            columns=[("event_id", rhs_column)],
+            equivalences=[],
+        )
+
+    events_entity = get_entity(EntityKey.EVENTS)
+    get_join_relationship = events_entity.get_join_relationship
+    setattr(events_entity, "get_join_relationship", events_mock)
+    yield
+    setattr(events_entity, "get_join_relationship", get_join_relationship)
+
+
+@pytest.mark.parametrize(
+    "query_body",
+    [pytest.param(case.values[0], id=case.id) for case in valid_test_cases]
+    + [pytest.param(case.values[0], id=case.id) for case in invalid_test_cases]
+    + additional_test_cases,
+)
+def test_recursive_descent_parser(query_body: str) -> None:
+    """
+    Both parsers either build the same AST or fail.
+    """
+    try:
+        expected = SnQLVisitor().visit(snql_grammar.parse(query_body))
+    except Exception:
+        with pytest.raises(Exception):
+            parse_snql_query_recursive_descent(query_body)
+        return
+
+    query = parse_snql_query_recursive_descent(query_body)
+    eq, reason = query.equals(expected)
+    assert eq, reason
+
+
+def test_select_parser() -> None:
+    state.set_config("snql_recursive_descent_parser", 1)
+    try:
+        query = parse_snql_query(
+            "MATCH (events) SELECT count() AS count BY title", get_dataset("events")
+        )
+    finally:
+        state.delete_config("snql_recursive_descent_parser")
+
+    assert [c.name for c in query.get_selected_columns_from_ast()] == [
+        "count",
+        "title",
+    ]
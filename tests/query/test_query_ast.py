@@ -1,3 +1,4 @@
+from copy import deepcopy
 from typing import Any, MutableMapping
 
 import pytest
@@ -5,6 +6,7 @@ from snuba.clickhouse.columns import ColumnSet
 from snuba.clickhouse.query import Query
 from snuba.datasets.factory import get_dataset
 from snuba.pipeline.processors import execute_all_clickhouse_processors
+from snuba.query.composite import CompositeQuery
 from snuba.query import OrderBy, OrderByDirection, SelectedExpression
 from snuba.query.conditions import ConditionFunctions, binary_condition
 from snuba.query.data_source.simple import Table
@@ -141,6 +143,48 @@ def test_replace_expression() -> None:
     )
 
 
+def test_copy_query() -> None:
+    """
+    Copies of a query share the expressions with the original query
+    but can be changed without affecting it.
+    """
+    column1 = Column(None, "t1", "c1")
+    function_1 = FunctionCall("alias", "f1", (column1,))
+    condition = binary_condition(
+        ConditionFunctions.IN,
+        column1,
+        FunctionCall(None, "tuple", tuple(Literal(None, i) for i in range(100))),
+    )
+    table = Table("my_table", ColumnSet([]))
+
+    query = Query(
+        table,
+        selected_columns=[SelectedExpression("alias", function_1)],
+        condition=condition,
+        groupby=[function_1],
+    )
+    composite = CompositeQuery(
+        from_clause=query,
+        selected_columns=[SelectedExpression("alias", Column("alias", None, "alias"))],
+    )
+
+    copied = deepcopy(composite)
+    assert copied == composite
+    copied_query = copied.get_from_clause()
+    assert isinstance(copied_query, Query)
+    assert copied_query is not query
+    assert copied_query.get_from_clause() is table
+    assert copied_query.get_condition_from_ast() is condition
+    assert copied_query.get_groupby_from_ast()[0] is function_1
+
+    copied_query.add_condition_to_ast(
+        binary_condition(ConditionFunctions.EQ, column1, Literal(None, "1"))
+    )
+    copied_query.set_ast_groupby([])
+    assert query.get_condition_from_ast() is condition
+    assert query.get_groupby_from_ast() == [function_1]
+
+
 def test_get_all_columns() -> None:
     query_body = {
         "selected_columns": [
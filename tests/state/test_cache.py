@@ -134,3 +134,26 @@ def test_get_readthrough_set_wait_timeout(backend: Cache[bytes]) -> None:
 
     with pytest.raises(ExecutionTimeoutError):
         waiter_slow.result()
+
+
+def test_get_readthrough_stale(backend: Cache[bytes]) -> None:
+    key = "key"
+    function = mock.MagicMock(side_effect=[b"a", b"b"])
+
+    # Values expire after a second (the default ``cache_expiry_sec``) but
+    # are kept for 5 more seconds.
+    assert backend.get_readthrough(key, function, 5, stale_ttl=5) == b"a"
+    with assert_does_not_change(lambda: function.call_count, 1):
+        assert backend.get_readthrough(key, function, 5, stale_ttl=5) == b"a"
+
+    time.sleep(1.5)
+
+    # The stale value is returned while it is refreshed in the background.
+    assert backend.get_readthrough(key, function, 5, stale_ttl=5) == b"a"
+
+    deadline = time.time() + 5
+    while backend.get(key) != b"b":
+        assert time.time() < deadline
+        time.sleep(0.1)
+
+    assert function.call_count == 2
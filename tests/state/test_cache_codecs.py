@@ -0,0 +1,29 @@
+from snuba.state.cache.codecs import CacheCompression, CompressingCodec
+from snuba.utils.codecs import JSONBytesCodec
+from tests.backends.metrics import TestingMetricsBackend, Timing
+
+
+def test_compressing_codec() -> None:
+    metrics = TestingMetricsBackend()
+    codec = CompressingCodec(JSONBytesCodec(), CacheCompression.LZ4, 100, metrics)
+
+    small = {"data": [{"a": 1}]}
+    encoded = codec.encode(small)
+    assert encoded == JSONBytesCodec().encode(small)
+    assert codec.decode(encoded) == small
+    assert metrics.calls == []
+
+    large = {"data": [{"a": 1}] * 100}
+    encoded = codec.encode(large)
+    assert len(encoded) < len(JSONBytesCodec().encode(large))
+    assert codec.decode(encoded) == large
+    assert [(call.name, call.tags) for call in metrics.calls] == [
+        ("compress", {"compression": "lz4"}),
+        ("compression_ratio", {"compression": "lz4"}),
+        ("decompress", {"compression": "lz4"}),
+    ]
+    assert all(isinstance(call, Timing) for call in metrics.calls)
+
+    # Values stored without compression can still be read once it is
+    # enabled.
+    assert codec.decode(JSONBytesCodec().encode(large)) == large
@@ -0,0 +1,86 @@
+from typing import Callable, MutableMapping, Optional
+from unittest import mock
+
+from snuba.state.cache.abstract import Cache
+from snuba.state.cache.local.backend import LocalCache
+from snuba.utils.metrics.timer import Timer
+from tests.backends.metrics import Increment, TestingMetricsBackend
+
+
+class DictCache(Cache[str]):
+    def __init__(self) -> None:
+        self.values: MutableMapping[str, str] = {}
+
+    def get(self, key: str) -> Optional[str]:
+        return self.values.get(key)
+
+    def set(self, key: str, value: str) -> None:
+        self.values[key] = value
+
+    def get_readthrough(
+        self,
+        key: str,
+        function: Callable[[], str],
+        timeout: int,
+        timer: Optional[Timer] = None,
+        stale_ttl: Optional[int] = None,
+        refresh_function: Optional[Callable[[], str]] = None,
+    ) -> str:
+        value = self.values.get(key)
+        if value is None:
+            value = self.values[key] = function()
+        return value
+
+
+def test_local_cache() -> None:
+    backend = DictCache()
+    metrics = TestingMetricsBackend()
+    clock = mock.Mock(return_value=0.0)
+    cache = LocalCache(backend, 8, len, lambda value: value, metrics, clock=clock)
+
+    function = mock.Mock(return_value="aaaa")
+    assert cache.get_readthrough("a", function, 5) == "aaaa"
+    assert function.call_count == 1
+
+    # Values are served from memory, even after they are evicted from the
+    # backend.
+    backend.values.clear()
+    assert cache.get_readthrough("a", function, 5) == "aaaa"
+    assert cache.get("a") == "aaaa"
+    assert function.call_count == 1
+
+    # Values that are read from the backend are kept in memory.
+    backend.set("b", "bbbb")
+    assert cache.get("b") == "bbbb"
+    backend.values.clear()
+    assert cache.get("b") == "bbbb"
+
+    # The least recently used values are evicted when the size limit is
+    # exceeded.
+    cache.get("a")
+    cache.set("c", "cccc")
+    assert cache.get("a") == "aaaa"
+    assert cache.get("b") is None
+    assert cache.get("c") == "cccc"
+
+    # Values that do not fit are only stored in the backend.
+    cache.set("d", "ddddddddd")
+    assert cache.get("a") == "aaaa"
+    assert cache.get("d") == "ddddddddd"
+    backend.values.clear()
+    assert cache.get("d") is None
+
+    # Values expire after ``cache_expiry_sec``.
+    clock.return_value = 1.0
+    assert cache.get("a") is None
+    assert cache.get("c") is None
+
+    counts: MutableMapping[str, int] = {}
+    for call in metrics.calls:
+        if isinstance(call, Increment):
+            counts[call.name] = counts.get(call.name, 0) + int(call.value)
+    assert counts == {
+        "local_cache.hit": 7,
+        "local_cache.miss": 7,
+        "local_cache.evictions": 1,
+    }
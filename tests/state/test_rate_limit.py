@@ -1,4 +1,5 @@
 import pytest
+from contextlib import ExitStack
 from unittest.mock import patch
 import uuid
 
@@ -112,6 +113,35 @@ class TestRateLimit:
             ):
                 pass
 
+    def test_aggregator_single_round_trip(self):
+        global_bucket = str(uuid.uuid4())
+        project_bucket = str(uuid.uuid4())
+        global_params = RateLimitParameters("global", global_bucket, None, 2)
+        project_params = RateLimitParameters("project", project_bucket, None, 1)
+
+        with patch.object(state.rds, "pipeline", wraps=state.rds.pipeline) as pipeline:
+            with RateLimitAggregator([global_params, project_params]) as stats:
+                assert stats.to_dict() == {
+                    "global_rate": 0,
+                    "global_concurrent": 1,
+                    "project_rate": 0,
+                    "project_concurrent": 1,
+                }
+                assert pipeline.call_count == 1
+
+                # The query is not added to the global bucket when it exceeds
+                # the limit of the project.
+                with pytest.raises(RateLimitExceeded):
+                    with RateLimitAggregator([global_params, project_params]):
+                        pass
+                assert state.get_concurrent(global_bucket) == 1
+                assert state.get_concurrent(project_bucket) == 1
+
+            # Both buckets are released at once.
+            assert pipeline.call_count == 3
+            assert state.get_concurrent(global_bucket) == 0
+            assert state.get_concurrent(project_bucket) == 0
+
     def test_rate_limit_container(self):
         rate_limit_container = RateLimitStatsContainer()
         rate_limit_stats = RateLimitStats(rate=0.5, concurrent=2)
@@ -129,3 +159,40 @@ class TestRateLimit:
 
         with rate_limit(rate_limit_params) as stats:
             assert stats is None
+
+    def test_local_bucket(self):
+        bucket = str(uuid.uuid4())
+        redis_bucket = f"{state.ratelimit_prefix}{bucket}"
+        rate_limit_params = RateLimitParameters("foo", bucket, None, 10)
+        state.set_config("rate_limit_local_sync_sec", 10)
+
+        with patch.object(state.time, "time", lambda: 0):
+            # The bucket is synced with Redis by the first query.
+            with rate_limit(rate_limit_params):
+                pass
+            assert state.rds.zcard(redis_bucket) == 1
+
+            # Queries are admitted locally as long as the estimated number of
+            # concurrent queries is at most half of the limit.
+            with ExitStack() as stack:
+                for concurrent in range(1, 6):
+                    stats = stack.enter_context(rate_limit(rate_limit_params))
+                    assert stats.concurrent == concurrent
+                assert state.rds.zcard(redis_bucket) == 1
+
+                # The next query goes through Redis, which writes the queries
+                # admitted locally.
+                stack.enter_context(rate_limit(rate_limit_params))
+                assert state.rds.zcard(redis_bucket) == 7
+                assert state.get_concurrent(bucket) == 6
+
+            # The queries that finished are no longer counted.
+            with rate_limit(rate_limit_params) as stats:
+                assert stats.concurrent == 1
+                assert state.rds.zcard(redis_bucket) == 7
+
+        # The queries admitted locally are written once the bucket needs to
+        # be synced again.
+        with patch.object(state.time, "time", lambda: 10):
+            with rate_limit(rate_limit_params):
+                assert state.rds.zcard(redis_bucket) == 9
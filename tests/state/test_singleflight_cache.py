@@ -0,0 +1,88 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+from typing import Callable, MutableMapping, MutableSequence, Optional
+
+import pytest
+
+from snuba.state.cache.abstract import Cache, ExecutionError
+from snuba.state.cache.singleflight.backend import SingleflightCache
+from snuba.utils.metrics.timer import Timer
+from tests.backends.metrics import Increment, TestingMetricsBackend
+
+
+class BlockingCache(Cache[MutableSequence[str]]):
+    def __init__(self) -> None:
+        self.values: MutableMapping[str, MutableSequence[str]] = {}
+        self.started = Event()
+        self.release = Event()
+        self.calls = 0
+
+    def get(self, key: str) -> Optional[MutableSequence[str]]:
+        return self.values.get(key)
+
+    def set(self, key: str, value: MutableSequence[str]) -> None:
+        self.values[key] = value
+
+    def get_readthrough(
+        self,
+        key: str,
+        function: Callable[[], MutableSequence[str]],
+        timeout: int,
+        timer: Optional[Timer] = None,
+        stale_ttl: Optional[int] = None,
+        refresh_function: Optional[Callable[[], MutableSequence[str]]] = None,
+    ) -> MutableSequence[str]:
+        self.calls += 1
+        self.started.set()
+        assert self.release.wait(5)
+        value = self.values[key] = function()
+        return value
+
+
+def test_singleflight_cache() -> None:
+    backend = BlockingCache()
+    metrics = TestingMetricsBackend()
+    cache = SingleflightCache(backend, lambda value: [*value], metrics)
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        first = executor.submit(cache.get_readthrough, "a", lambda: ["a"], 5)
+        assert backend.started.wait(5)
+        second = executor.submit(cache.get_readthrough, "a", lambda: ["b"], 5)
+        while not metrics.calls:
+            pass
+        backend.release.set()
+
+        assert first.result() == ["a"]
+        assert second.result() == ["a"]
+        # Each caller gets its own copy of the value.
+        assert first.result() is not second.result()
+
+    assert backend.calls == 1
+    assert metrics.calls == [Increment("singleflight.shared", 1, None)]
+
+    # The call is no longer in flight once it completes.
+    assert cache.get_readthrough("a", lambda: ["c"], 5) == ["c"]
+    assert backend.calls == 2
+
+
+def test_singleflight_cache_error() -> None:
+    backend = BlockingCache()
+    cache = SingleflightCache(backend, lambda value: [*value], TestingMetricsBackend())
+
+    def fail() -> MutableSequence[str]:
+        raise ValueError("error")
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        first = executor.submit(cache.get_readthrough, "a", fail, 5)
+        assert backend.started.wait(5)
+        second = executor.submit(cache.get_readthrough, "a", fail, 5)
+        backend.release.set()
+
+        with pytest.raises(ValueError):
+            first.result()
+
+        # The error of the first caller may be raised before the second
+        # caller starts waiting for it, in which case it executes the
+        # function itself.
+        with pytest.raises((ExecutionError, ValueError)):
+            second.result()
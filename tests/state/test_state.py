@@ -2,6 +2,7 @@ import random
 import time
 from collections import ChainMap
 from functools import partial
+from unittest.mock import patch
 
 from snuba import state
 from snuba.state import safe_dumps
@@ -56,3 +57,20 @@ def test_safe_dumps():
     assert safe_dumps(ChainMap({"a": 1}, {"b": 2}), sort_keys=True,) == safe_dumps(
         {"a": 1, "b": 2}, sort_keys=True,
     )
+
+
+def test_config_snapshot() -> None:
+    state.set_config("snapshot", "1000:1/2000:0")
+    snapshot = state.get_config_snapshot()
+    assert snapshot.get("snapshot") == 1000
+    assert snapshot.raw_configs["snapshot"] == "1000:1/2000:0"
+
+    # The configuration is only read again when it changes.
+    with patch.object(state.rds, "hgetall", wraps=state.rds.hgetall) as hgetall:
+        assert state.get_config_snapshot() is snapshot
+        assert state.get_config("snapshot") == 1000
+        assert hgetall.call_count == 0
+
+        state.set_config("snapshot", 3000)
+        assert state.get_config("snapshot") == 3000
+        assert hgetall.call_count == 1
@@ -1,26 +1,34 @@
+import functools
+import gc
 import itertools
 import json
+import logging
 import pickle
+import weakref
 from datetime import datetime
 from pickle import PickleBuffer
-from typing import MutableSequence
-from unittest.mock import Mock, call
+from typing import Any, MutableSequence
+from unittest.mock import Mock, call, patch
 
 import pytest
+from snuba import settings
+from snuba.clickhouse.errors import ClickhouseWriterError
 from snuba.clusters.cluster import ClickhouseClientSettings
 from snuba.consumer import (
+    InsertBatchWriter,
     JSONRowInsertBatch,
     MultistorageConsumerProcessingStrategyFactory,
     StreamingConsumerStrategyFactory,
 )
+from snuba.consumers.batch_size import BatchSizeController
 from snuba.datasets.storage import Storage
-from snuba.processor import InsertBatch, ReplacementBatch
+from snuba.processor import InsertBatch, MessageProcessor, ReplacementBatch
 from snuba.utils.streams import Message, Partition, Topic
 from snuba.utils.streams.backends.kafka import KafkaPayload
 
 from tests.assertions import assert_changes
 from tests.backends.confluent_kafka import FakeConfluentKafkaProducer
-from tests.backends.metrics import TestingMetricsBackend, Timing
+from tests.backends.metrics import Increment, TestingMetricsBackend, Timing
 
 
 def test_streaming_consumer_strategy() -> None:
@@ -37,6 +45,9 @@ def test_streaming_consumer_strategy() -> None:
     replacements_producer = FakeConfluentKafkaProducer()
 
     processor = Mock()
+    processor.process_batch.side_effect = functools.partial(
+        MessageProcessor.process_batch, processor
+    )
     processor.process_message.side_effect = [
         None,
         InsertBatch([{}]),
@@ -96,6 +107,54 @@ def test_streaming_consumer_strategy() -> None:
         strategy.join()
 
 
+def test_insert_batch_writer_too_many_parts() -> None:
+    writer = Mock()
+
+    def write(*args: Any) -> None:
+        # The error is created on each call (rather than being kept by the
+        # mock) so that it does not outlive the insert.
+        if writer.write.call_count == 1:
+            raise ClickhouseWriterError(252, "Too many parts")
+
+    writer.write.side_effect = write
+
+    controller = BatchSizeController(1, 100, 1.0)
+    controller.record_insert(10, 10, 10.0)
+    assert controller.get_batch_size() == 50
+
+    metrics = TestingMetricsBackend()
+    with patch.object(settings, "TOO_MANY_PARTS_RETRY_DELAY", 0):
+        insert_batch_writer = InsertBatchWriter(writer, metrics, controller)
+
+    insert_batch_writer.submit(
+        Message(
+            Partition(Topic("events"), 0),
+            0,
+            JSONRowInsertBatch([b"{}"]),
+            datetime.now(),
+        )
+    )
+    # The log records are retained by pytest, and would keep the exception
+    # (and the writer, through its traceback) alive.
+    with patch.object(logging.getLogger("snuba.consumer"), "disabled", True):
+        insert_batch_writer.close()
+        insert_batch_writer.join()
+
+    assert writer.write.call_count == 2
+    assert controller.get_batch_size() == 100
+    assert Increment("too_many_parts", 1, None) in metrics.calls
+
+    # The writer (and the messages it references) is freed as soon as it is
+    # no longer used, without waiting for the cyclic garbage collector.
+    reference = weakref.ref(insert_batch_writer)
+    gc.disable()
+    try:
+        del insert_batch_writer
+        assert reference() is None
+    finally:
+        gc.enable()
+
+
 def test_json_row_batch_pickle_simple() -> None:
     batch = JSONRowInsertBatch([b"foo", b"bar", b"baz"])
     assert pickle.loads(pickle.dumps(batch)) == batch
@@ -1,15 +1,21 @@
 import pytz
 import re
+import time
 from datetime import datetime
 from functools import partial
+from threading import Lock
+from typing import MutableMapping
+from unittest.mock import Mock, patch
+
 import simplejson as json
 
 from snuba import replacer
 from snuba.clickhouse import DATETIME_FORMAT
+from snuba.clusters.cluster import ClickhouseNode
 from snuba.datasets.errors_replacer import ReplacerState
 from snuba.datasets import errors_replacer
 from snuba.datasets.storages import StorageKey
-from snuba.datasets.storages.factory import get_storage
+from snuba.datasets.storages.factory import get_storage, get_writable_storage
 from snuba.settings import PAYLOAD_DATETIME_FORMAT
 from snuba.utils.metrics.backends.dummy import DummyMetricsBackend
 from snuba.utils.streams import Message, Partition, Topic
@@ -440,3 +446,101 @@ class TestReplacer:
         assert errors_replacer.get_projects_query_flags(
             project_ids, ReplacerState.EVENTS
         ) == (False, [],)
+
+
+def test_node_executor_concurrency() -> None:
+    nodes = [ClickhouseNode("a", 9000, 1, 1), ClickhouseNode("b", 9000, 2, 1)]
+    executor = replacer.NodeExecutor(nodes, 2)
+
+    lock = Lock()
+    running: MutableMapping[ClickhouseNode, int] = {node: 0 for node in nodes}
+    peak: MutableMapping[ClickhouseNode, int] = {node: 0 for node in nodes}
+
+    def run(node: ClickhouseNode) -> ClickhouseNode:
+        with lock:
+            running[node] += 1
+            peak[node] = max(peak[node], running[node])
+        time.sleep(0.01)
+        with lock:
+            running[node] -= 1
+        return node
+
+    assert executor.map(run, nodes * 5) == nodes * 5
+    assert peak == {node: 2 for node in nodes}
+
+    executor.shutdown()
+
+
+def test_sharded_replacement() -> None:
+    nodes = [
+        ClickhouseNode("a", 9000, 1, 1),
+        ClickhouseNode("b", 9000, 1, 2),
+        ClickhouseNode("c", 9000, 2, 1),
+        ClickhouseNode("d", 9000, 3, 1),
+    ]
+    counts = {nodes[0]: 2, nodes[2]: 0, nodes[3]: 1}
+    connections = {node: Mock() for node in nodes}
+    for node, connection in connections.items():
+        connection.execute_robust.return_value = [(counts.get(node),)]
+
+    storage = get_writable_storage(StorageKey.ERRORS)
+    cluster = Mock()
+    cluster.get_local_nodes.return_value = nodes
+    cluster.get_node_connection.side_effect = lambda settings, node: connections[node]
+
+    worker = replacer.ReplacerWorker(
+        Mock(
+            get_cluster=Mock(return_value=cluster),
+            get_table_writer=storage.get_table_writer,
+        ),
+        DummyMetricsBackend(strict=True),
+        per_node_concurrency=2,
+    )
+
+    replacement = worker.process_message(
+        Message(
+            Partition(Topic("replacements"), 0),
+            0,
+            KafkaPayload(
+                None,
+                json.dumps(
+                    (
+                        2,
+                        "tombstone_events",
+                        {
+                            "project_id": 1,
+                            "event_ids": ["00e24a150d7f4ee4b142b61b4d893b6d"],
+                        },
+                    )
+                ).encode("utf-8"),
+                [],
+            ),
+            datetime.now(),
+        )
+    )
+    assert replacement is not None
+    with patch.object(
+        errors_replacer.ErrorsReplacer, "pre_replacement", return_value=True
+    ), patch(
+        "snuba.optimize.get_partitions_to_optimize",
+        return_value=[(datetime(2020, 1, 6), 90)],
+    ), patch(
+        "snuba.optimize.optimize_partitions"
+    ) as optimize_partitions:
+        worker.flush_batch([replacement])
+
+    # Partitions are optimized on a single replica of each shard.
+    assert sorted(
+        nodes.index(node)
+        for node, connection in connections.items()
+        for call in optimize_partitions.call_args_list
+        if call[0][0] is connection
+    ) == [0, 2, 3]
+
+    # Only the first replica of each shard is queried, and the insert is
+    # only run on the shards with matching rows.
+    assert connections[nodes[1]].execute_robust.call_count == 0
+    for node, calls in [(nodes[0], 2), (nodes[2], 1), (nodes[3], 2)]:
+        assert connections[node].execute_robust.call_count == calls
+        for call in connections[node].execute_robust.call_args_list:
+            assert "errors_local" in call[0][0]
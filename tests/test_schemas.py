@@ -0,0 +1,55 @@
+import jsonschema
+import pytest
+
+from snuba.datasets.entities import EntityKey
+from snuba.datasets.entities.factory import get_entity
+from snuba.request.request_settings import (
+    HTTPRequestSettings,
+    SubscriptionRequestSettings,
+)
+from snuba.request.schema import Language, get_request_schema
+from snuba.schemas import SchemaValidator
+
+SCHEMA = {
+    "type": "object",
+    "properties": {
+        "limit": {"type": "integer", "default": 1000},
+        "groupby": {"type": "array", "default": []},
+    },
+    "additionalProperties": False,
+}
+
+
+def test_schema_validator() -> None:
+    validator = SchemaValidator(SCHEMA)
+
+    value = {"limit": 10}
+    assert validator.validate(value) == {"limit": 10, "groupby": []}
+    assert value == {"limit": 10}
+
+    # Defaults are not shared between validated values.
+    validated = validator.validate({})
+    validated["groupby"].append("a")
+    assert validator.validate({}) == {"limit": 1000, "groupby": []}
+
+    with pytest.raises(jsonschema.ValidationError):
+        validator.validate({"limit": "10"})
+
+    assert SchemaValidator(SCHEMA, set_defaults=False).validate({}) == {}
+
+
+def test_request_schema_cache() -> None:
+    events = get_entity(EntityKey.EVENTS)
+    schema = get_request_schema(events, HTTPRequestSettings, Language.LEGACY)
+    assert get_request_schema(events, HTTPRequestSettings, Language.LEGACY) is schema
+    assert get_request_schema(events, HTTPRequestSettings, Language.SNQL) is not schema
+    assert (
+        get_request_schema(events, SubscriptionRequestSettings, Language.LEGACY)
+        is not schema
+    )
+    assert (
+        get_request_schema(
+            get_entity(EntityKey.TRANSACTIONS), HTTPRequestSettings, Language.LEGACY
+        )
+        is not schema
+    )
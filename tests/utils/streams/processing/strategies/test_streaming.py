@@ -1,15 +1,22 @@
+import gc
 import itertools
 import multiprocessing
+import threading
+import time
 from datetime import datetime
 from multiprocessing.managers import SharedMemoryManager
-from typing import Iterator
-from unittest.mock import Mock, call
+from typing import Iterator, MutableSequence, Sequence
+from unittest.mock import Mock, call, patch
 
 import pytest
 
 from snuba.utils.streams.backends.kafka import KafkaPayload
 from snuba.utils.streams.processing.strategies.streaming.collect import CollectStep
 from snuba.utils.streams.processing.strategies.streaming.filter import FilterStep
+from snuba.utils.streams.processing.strategies.streaming import transform
+from snuba.utils.streams.processing.strategies.streaming.instrument import (
+    InstrumentedStep,
+)
 from snuba.utils.streams.processing.strategies.streaming.transform import (
     MessageBatch,
     ParallelTransformStep,
@@ -20,7 +27,9 @@ from snuba.utils.streams.processing.strategies.streaming.transform import (
 from snuba.utils.streams.types import Message, Partition, Topic
 from tests.assertions import assert_changes, assert_does_not_change
 from tests.backends.metrics import Gauge as GaugeCall
+from tests.backends.metrics import Increment as IncrementCall
 from tests.backends.metrics import TestingMetricsBackend
+from tests.backends.metrics import Timing as TimingCall
 
 
 def test_filter() -> None:
@@ -132,6 +141,95 @@ def test_collect() -> None:
         collect_step.join()
 
 
+def test_collect_pending_batches() -> None:
+    events = [threading.Event(), threading.Event()]
+    steps: MutableSequence[Mock] = []
+
+    def step_factory() -> Mock:
+        step = Mock()
+        event = events[len(steps)]
+        step.join.side_effect = lambda timeout=None: event.wait()
+        steps.append(step)
+        return step
+
+    commit_function = Mock()
+    partition = Partition(Topic("topic"), 0)
+    messages = message_generator(partition, 0)
+
+    collect_step: CollectStep[int] = CollectStep(
+        step_factory, commit_function, 1, 60, max_pending_batches=1
+    )
+
+    try:
+        collect_step.submit(next(messages))  # offset 0
+
+        # Closing the batch should not block on the step, and the offsets
+        # should not be committed until the step has finished processing it.
+        collect_step.poll()
+        assert commit_function.call_count == 0
+
+        # A new batch can be collected while the previous one is in flight.
+        collect_step.submit(next(messages))  # offset 1
+        assert len(steps) == 2
+
+        # Closing the new batch has to wait for the previous batch to
+        # complete since only one batch can be in flight.
+        events[0].set()
+        collect_step.poll()
+        assert commit_function.call_args_list == [call({partition: 1})]
+
+        events[1].set()
+        collect_step.close()
+        collect_step.join()
+    finally:
+        for event in events:
+            event.set()
+
+    assert commit_function.call_args_list == [
+        call({partition: 1}),
+        call({partition: 2}),
+    ]
+    assert [step.close.call_count for step in steps] == [1, 1]
+
+
+def test_instrumented_step() -> None:
+    next_step = Mock()
+    metrics = TestingMetricsBackend()
+    clock = Mock(return_value=0.0)
+
+    step: InstrumentedStep[int] = InstrumentedStep(next_step, metrics, 10.0, clock)
+
+    message = Message(Partition(Topic("topic"), 0), 0, 1, datetime.now())
+
+    # Each call reads the clock before and after calling the next step.
+    clock.side_effect = [1.0, 2.0, 2.0, 3.0]
+    step.submit(message)
+    step.poll()
+    assert next_step.submit.call_args == call(message)
+    assert next_step.poll.call_count == 1
+    assert metrics.calls == []
+
+    clock.side_effect = [9.0, 10.0]
+    step.submit(message)
+    assert metrics.calls == [
+        IncrementCall("messages", 2, tags=None),
+        GaugeCall("messages_per_second", 0.2, tags=None),
+        GaugeCall("submit.utilization", 0.2, tags=None),
+        GaugeCall("poll.utilization", 0.1, tags=None),
+    ]
+
+    metrics.calls.clear()
+
+    clock.side_effect = [10.0, 15.0, 15.0]
+    step.join()
+    assert next_step.join.call_count == 1
+    assert metrics.calls == [
+        IncrementCall("messages", 0, tags=None),
+        GaugeCall("messages_per_second", 0.0, tags=None),
+        GaugeCall("join.utilization", 1.0, tags=None),
+    ]
+
+
 def test_message_batch() -> None:
     partition = Partition(Topic("test"), 0)
 
@@ -156,6 +254,40 @@ def test_message_batch() -> None:
             batch.append(message)
 
 
+def test_message_batch_views() -> None:
+    partition = Partition(Topic("test"), 0)
+
+    with SharedMemoryManager() as smm:
+        block = smm.SharedMemory(4096)
+
+        messages = [
+            Message(partition, i, KafkaPayload(None, bytes([i]) * 1000, []), now)
+            for i, now in enumerate([datetime.now()] * 2)
+        ]
+
+        batch: MessageBatch[KafkaPayload] = MessageBatch(block)
+        for message in messages:
+            batch.append(message)
+
+        release = Mock()
+        views = list(batch.iter_views(release))
+        assert views == messages
+        assert isinstance(views[0].payload.value, memoryview)
+        assert release.call_count == 0
+
+        # The block must not be released while any value (or anything
+        # derived from it) is still referenced.
+        value = views[1].payload.value[10:20]
+        del views
+        gc.collect()
+        assert release.call_count == 0
+
+        assert value == bytes([1]) * 10
+        del value
+        gc.collect()
+        assert release.call_count == 1
+
+
 def transform_payload_expand(message: Message[KafkaPayload]) -> KafkaPayload:
     return KafkaPayload(
         message.payload.key, message.payload.value * 2, message.payload.headers,
@@ -209,6 +341,68 @@ def test_parallel_transform_worker_apply() -> None:
             )
 
 
+def transform_payloads_expand(
+    messages: Sequence[Message[KafkaPayload]],
+) -> Sequence[KafkaPayload]:
+    return [transform_payload_expand(message) for message in messages]
+
+
+def test_parallel_transform_worker_apply_batch() -> None:
+    messages = [
+        Message(
+            Partition(Topic("test"), 0),
+            i,
+            KafkaPayload(None, b"\x00" * size, []),
+            datetime.now(),
+        )
+        for i, size in enumerate([1000, 1000, 2000])
+    ]
+
+    with SharedMemoryManager() as smm:
+        input_batch: MessageBatch[KafkaPayload] = MessageBatch(smm.SharedMemory(8192))
+        for message in messages:
+            input_batch.append(message)
+
+        output_block = smm.SharedMemory(4096)
+
+        function = Mock(side_effect=transform_payloads_expand)
+        index, output_batch = parallel_transform_worker_apply(
+            transform_payload_expand, input_batch, output_block, 0, function,
+        )
+
+        # All of the messages are transformed at once. Only the first two
+        # fit in the output block, and the last one is returned in band
+        # rather than being transformed again.
+        assert function.call_args_list == [call(messages)]
+        assert index == 3
+        assert output_batch.get_content_size() == 4000
+        assert [message.payload for message in output_batch] == [
+            transform_payload_expand(message) for message in messages
+        ]
+
+        function.reset_mock()
+        with patch.object(transform, "BATCH_FUNCTION_MAX_MESSAGES", 1):
+            index, output_batch = parallel_transform_worker_apply(
+                transform_payload_expand, input_batch, output_block, 0, function,
+            )
+
+        # The messages are transformed one slice at a time, until the output
+        # block is full.
+        assert function.call_args_list == [call([message]) for message in messages]
+        assert index == 3
+        assert len(output_batch) == 3
+
+        function.reset_mock()
+        with patch.object(transform, "BATCH_FUNCTION_MAX_MESSAGES", 1):
+            index, output_batch = parallel_transform_worker_apply(
+                transform_payload_expand, input_batch, output_block, 1, function,
+            )
+
+        assert function.call_args_list == [call([messages[1]]), call([messages[2]])]
+        assert index == 3
+        assert len(output_batch) == 2
+
+
 def get_subprocess_count() -> int:
     return len(multiprocessing.active_children())
 
@@ -269,13 +463,75 @@ def test_parallel_transform_step() -> None:
     ), assert_changes(
         lambda: metrics.calls,
         [],
-        [GaugeCall("batches_in_progress", value, tags=None) for value in [1.0, 0.0]],
+        [
+            # The first batch does not fit in a single output block. Since the
+            # first output block is still referenced by the messages that were
+            # submitted to the next step, a new block must be allocated for
+            # the rest of the batch.
+            TimingCall("output_block_utilization", 4000 / 4096, tags=None),
+            GaugeCall("output_blocks", 3, tags=None),
+            TimingCall("output_block_utilization", 4000 / 4096, tags=None),
+            TimingCall("input_block_utilization", 4000 / 4096, tags=None),
+            GaugeCall("batches_in_progress", 1.0, tags=None),
+            TimingCall("output_block_utilization", 4000 / 4096, tags=None),
+            TimingCall("input_block_utilization", 2000 / 4096, tags=None),
+            GaugeCall("batches_in_progress", 0.0, tags=None),
+        ],
     ):
         transform_step.join()
 
     assert next_step.submit.call_count == len(messages)
 
 
+def test_parallel_transform_step_output_block_limit() -> None:
+    next_step = Mock()
+
+    messages = [
+        Message(
+            Partition(Topic("test"), 0),
+            i,
+            KafkaPayload(None, b"\x00" * 1000, []),
+            datetime.now(),
+        )
+        for i in range(4)
+    ]
+
+    transform_step = ParallelTransformStep(
+        transform_payload_expand,
+        next_step,
+        processes=1,
+        max_batch_size=4,
+        max_batch_time=60,
+        input_block_size=4096,
+        output_block_size=4096,
+        metrics=TestingMetricsBackend(),
+        max_output_blocks=1,
+    )
+
+    for message in messages:
+        transform_step.submit(message)
+
+    # Only the first half of the batch fits in the output block.
+    deadline = time.time() + 5
+    while next_step.submit.call_count < 2:
+        assert time.time() < deadline
+        transform_step.poll()
+        time.sleep(0.01)
+
+    # The rest of the batch is not transformed while the messages that
+    # reference the only output block are still alive.
+    transform_step.poll()
+    with pytest.raises(multiprocessing.TimeoutError):
+        transform_step.join(timeout=0.1)
+    assert next_step.submit.call_count == 2
+
+    next_step.reset_mock()
+    gc.collect()
+
+    transform_step.join(timeout=5)
+    assert next_step.submit.call_count == 2
+
+
 def test_parallel_transform_step_terminate_workers() -> None:
     next_step = Mock()
 
@@ -0,0 +1,157 @@
+from datetime import datetime, timedelta
+from typing import Any, Callable, MutableMapping, MutableSequence, Optional, Tuple
+
+from snuba.clickhouse.query import Query as ClickhouseQuery
+from snuba.clickhouse.query_dsl.accessors import get_time_range
+from snuba.datasets.entities.factory import get_entity
+from snuba.datasets.factory import get_dataset
+from snuba.datasets.plans.translator.query import identity_translate
+from snuba.query.parser import parse_query
+from snuba.reader import Result
+from snuba.request.request_settings import HTTPRequestSettings
+from snuba.state.cache.abstract import Cache
+from snuba.utils.metrics.timer import Timer
+from snuba.web.bucket_cache import (
+    TimeSeries,
+    execute_with_bucket_cache,
+    get_time_series,
+)
+
+
+class DictCache(Cache[Any]):
+    def __init__(self) -> None:
+        self.values: MutableMapping[str, Any] = {}
+
+    def get(self, key: str) -> Optional[Any]:
+        return self.values.get(key)
+
+    def set(self, key: str, value: Any) -> None:
+        self.values[key] = value
+
+    def get_readthrough(
+        self,
+        key: str,
+        function: Callable[[], Any],
+        timeout: int,
+        timer: Optional[Timer] = None,
+        stale_ttl: Optional[int] = None,
+        refresh_function: Optional[Callable[[], Any]] = None,
+    ) -> Any:
+        raise NotImplementedError
+
+
+def build_query(body: MutableMapping[str, Any]) -> ClickhouseQuery:
+    query = parse_query(body, get_dataset("events"))
+    entity = get_entity(query.get_from_clause().key)
+    settings = HTTPRequestSettings()
+    for p in entity.get_query_processors():
+        p.process_query(query, settings)
+
+    return identity_translate(query)
+
+
+def build_time_series_query(start: str, end: str) -> ClickhouseQuery:
+    return build_query(
+        {
+            "aggregations": [["count()", "", "count"]],
+            "conditions": [
+                ("timestamp", ">=", start),
+                ("timestamp", "<", end),
+                ("project_id", "IN", [1]),
+            ],
+            "groupby": ["time"],
+            "orderby": ["time"],
+            "granularity": 3600,
+        }
+    )
+
+
+def test_get_time_series() -> None:
+    time_series = get_time_series(
+        build_time_series_query("2019-09-18T10:30:00", "2019-09-19T02:30:00")
+    )
+    assert time_series is not None
+    assert time_series.timestamp_column == "timestamp"
+    assert time_series.granularity == timedelta(hours=1)
+    assert time_series.start == datetime(2019, 9, 18, 10, 30)
+    assert time_series.end == datetime(2019, 9, 19, 2, 30)
+    assert not time_series.descending
+
+    # The results of other groups can't be concatenated in order.
+    assert (
+        get_time_series(
+            build_query(
+                {
+                    "aggregations": [["count()", "", "count"]],
+                    "conditions": [
+                        ("timestamp", ">=", "2019-09-18T10:30:00"),
+                        ("timestamp", "<", "2019-09-19T02:30:00"),
+                        ("project_id", "IN", [1]),
+                    ],
+                    "groupby": ["time"],
+                    "orderby": ["-count"],
+                }
+            )
+        )
+        is None
+    )
+
+
+def test_execute_with_bucket_cache() -> None:
+    cache = DictCache()
+    ranges: MutableSequence[Tuple[datetime, datetime]] = []
+
+    def get_rows(time_series: TimeSeries, start: datetime, end: datetime) -> Result:
+        # One row per hour, counting the minutes of the hour in the range.
+        rows = []
+        bucket = start.replace(minute=0)
+        while bucket < end:
+            minutes = (min(end, bucket + timedelta(hours=1)) - max(start, bucket)) // (
+                timedelta(minutes=1)
+            )
+            rows.append(
+                {
+                    time_series.bucket_alias: bucket.isoformat() + "+00:00",
+                    "count": minutes,
+                }
+            )
+            bucket += timedelta(hours=1)
+        return {"meta": [], "data": rows}
+
+    def run(start: str, end: str, now: datetime) -> Result:
+        query = build_time_series_query(start, end)
+        time_series = get_time_series(query)
+        assert time_series is not None
+
+        def execute(query: ClickhouseQuery) -> Result:
+            start, end = get_time_range(query, "timestamp")
+            assert start is not None and end is not None
+            ranges.append((start, end))
+            return get_rows(time_series, start, end)
+
+        result = execute_with_bucket_cache(
+            query,
+            time_series,
+            cache,
+            lambda query: repr(get_time_range(query, "timestamp")),
+            execute,
+            timedelta(hours=1),
+            now,
+            {},
+        )
+        assert result == get_rows(time_series, time_series.start, time_series.end)
+        return result
+
+    run("2019-09-18T10:30:00", "2019-09-19T02:30:00", datetime(2019, 9, 19, 3))
+    assert ranges == [(datetime(2019, 9, 18, 10, 30), datetime(2019, 9, 19, 2, 30))]
+    assert len(cache.values) == 15
+
+    # Only the partial buckets and the buckets that were too recent to be
+    # cached are queried when the time range moves.
+    ranges.clear()
+    run("2019-09-18T11:30:00", "2019-09-19T03:30:00", datetime(2019, 9, 19, 4))
+    assert ranges == [
+        (datetime(2019, 9, 18, 11, 30), datetime(2019, 9, 18, 12)),
+        (datetime(2019, 9, 19, 2), datetime(2019, 9, 19, 3, 30)),
+    ]
+    assert len(cache.values) == 16
@@ -0,0 +1,160 @@
+import time
+from functools import partial
+from typing import Any, Mapping, MutableMapping, Optional, Tuple
+from unittest.mock import patch
+
+from snuba.clickhouse.columns import ColumnSet
+from snuba.clickhouse.formatter.nodes import FormattedQuery
+from snuba.clickhouse.formatter.query import format_query
+from snuba.clickhouse.query import Query
+from snuba.query import SelectedExpression
+from snuba.query.data_source.simple import Table
+from snuba.query.expressions import Column
+from snuba.reader import Reader, Result
+from snuba.redis import redis_client
+from snuba.request.request_settings import HTTPRequestSettings
+from snuba.state.rate_limit import RateLimitAggregator
+from snuba.utils.metrics.timer import Timer
+from snuba.utils.metrics.wrapper import MetricsWrapper
+from snuba.web import db_query
+from snuba.web.bucket_cache import get_time_series
+from snuba.web.db_query import (
+    execute_query_with_bucket_caching,
+    execute_query_with_readthrough_caching,
+    get_query_cache_key,
+)
+from tests.backends.metrics import TestingMetricsBackend, Timing
+from tests.web.test_bucket_cache import build_time_series_query
+
+
+class CountingReader(Reader):
+    def __init__(self, column: str = "event_id") -> None:
+        self.column = column
+        self.calls = 0
+
+    def execute(
+        self,
+        query: FormattedQuery,
+        settings: Optional[Mapping[str, str]] = None,
+        with_totals: bool = False,
+    ) -> Result:
+        self.calls += 1
+        return {"data": [{self.column: self.calls}], "meta": [{"name": self.column}]}
+
+
+def test_stale_refresh_does_not_modify_query_state() -> None:
+    query = Query(
+        Table("events", ColumnSet([])),
+        selected_columns=[
+            SelectedExpression("event_id", Column("event_id", None, "event_id")),
+        ],
+    )
+    settings = HTTPRequestSettings()
+    formatted_query = format_query(query, settings)
+    reader = CountingReader()
+
+    def run() -> Tuple[
+        Result, Timer, MutableMapping[str, Any], MutableMapping[str, Any]
+    ]:
+        timer = Timer("query")
+        stats: MutableMapping[str, Any] = {}
+        query_settings: MutableMapping[str, Any] = {"max_threads": 10}
+        result = execute_query_with_readthrough_caching(
+            query,
+            settings,
+            formatted_query,
+            reader,
+            timer,
+            stats,
+            query_settings,
+            stale_ttl=5,
+        )
+        return result, timer, stats, query_settings
+
+    backend = TestingMetricsBackend()
+    try:
+        with patch.object(db_query, "metrics", MetricsWrapper(backend, "db_query")):
+            result, _, _, _ = run()
+            assert result["data"] == [{"event_id": 1}]
+
+            # The result expires after a second (the default
+            # ``cache_expiry_sec``) and is then stale.
+            time.sleep(1.5)
+
+            result, timer, stats, query_settings = run()
+            assert result["data"] == [{"event_id": 1}]
+            timer_data = timer.finish()
+            expected_stats = {**stats}
+            expected_settings = {**query_settings}
+
+            key = get_query_cache_key(formatted_query)
+            deadline = time.time() + 5
+            while db_query.cache.get(key) != {
+                "data": [{"event_id": 2}],
+                "meta": [{"name": "event_id"}],
+            }:
+                assert time.time() < deadline
+                time.sleep(0.1)
+
+        assert reader.calls == 2
+        assert timer.finish() == timer_data
+        assert stats == expected_stats
+        assert query_settings == expected_settings
+        assert "execute" not in timer_data["marks_ms"]
+
+        # The refresh is recorded with its own timer.
+        refresh_timings = [
+            call
+            for call in backend.calls
+            if isinstance(call, Timing) and call.name == "db_query.refresh_query"
+        ]
+        assert [call.tags for call in refresh_timings] == [{"status": "success"}]
+    finally:
+        redis_client.flushdb()
+
+
+def test_bucket_cache_ranges_use_result_cache() -> None:
+    query = build_time_series_query("2019-09-18T10:30:00", "2019-09-19T02:30:00")
+    query.set_from_clause(Table("errors_local", ColumnSet([])))
+    settings = HTTPRequestSettings()
+    time_series = get_time_series(query)
+    assert time_series is not None
+    reader = CountingReader(time_series.bucket_alias)
+
+    def run() -> Result:
+        stats: MutableMapping[str, Any] = {}
+        result = execute_query_with_bucket_caching(
+            partial(execute_query_with_readthrough_caching, stale_ttl=None),
+            query,
+            settings,
+            format_query(query, settings),
+            reader,
+            Timer("query"),
+            stats,
+            {},
+        )
+        # The stats describe the whole result, not only the last range.
+        assert stats["result_rows"] == len(result["data"])
+        return result
+
+    try:
+        with patch.object(
+            db_query, "RateLimitAggregator", wraps=RateLimitAggregator
+        ) as rate_limit:
+            run()
+            assert reader.calls == 1
+            assert rate_limit.call_count == 1
+
+            # The partial buckets at the edges of the range are then queried
+            # separately, but the query is only rate limited once.
+            run()
+            assert reader.calls == 3
+            assert rate_limit.call_count == 2
+
+            # The partial buckets are not in the bucket cache, but their
+            # results are in the result cache.
+            run()
+            assert reader.calls == 3
+            assert rate_limit.call_count == 3
+    finally:
+        redis_client.flushdb()
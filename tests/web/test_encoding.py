@@ -0,0 +1,26 @@
+from decimal import Decimal
+
+import pytest
+import simplejson as json
+
+from snuba.web.encoding import dumps, iterencode
+
+
+def test_dumps() -> None:
+    value = {"data": [{"a": 1.5, "b": Decimal("2.5"), "c": "é"}], "stats": {1: 2}}
+    assert json.loads(dumps(value)) == json.loads(json.dumps(value))
+
+
+@pytest.mark.parametrize("rows", [0, 1, 3, 7])
+def test_iterencode(rows: int) -> None:
+    payload = {
+        "meta": [{"name": "a", "type": "UInt64"}],
+        "data": [{"a": i} for i in range(rows)],
+        "timing": {"duration_ms": 10},
+    }
+
+    chunks = [*iterencode(payload, "data", 3)]
+    assert "".join(chunks) == dumps(payload)
+    # The opening and closing braces, the meta, the start of the data, one
+    # chunk for every 3 rows, the end of the data and the timing.
+    assert len(chunks) == 6 + (rows + 2) // 3